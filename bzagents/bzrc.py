@@ -15,54 +15,411 @@
 
 from __future__ import division
 
+import base64
+import collections
+import itertools
 import math
+import select
+import struct
 import sys
 import socket
 import time
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    # Needed for encoded occupancy grids; binary ones are decoded without
+    # it, but more slowly.
+    numpy = None
+
+# The binary protocol, chosen with BZRC(..., binary=True).  Responses come
+# as frames of these types, with these records; see bzrflag/binary.py.
+(TEXT, MYTANKS, OTHERTANKS, FLAGS, SHOTS, OCCGRID, STATE, FRAME,
+ ENCODED_OCCGRID, DELTA_OCCGRID) = range(10)
+ENCODINGS = ('bits', 'rle', 'zlib')
+COLORNAME = ('rogue', 'red', 'green', 'blue', 'purple')
+STATUSES = ('alive', 'dead')
+NONE = 255
+FRAME_HEADER = struct.Struct('<IB')
+COUNT = struct.Struct('<I')
+MYTANK = struct.Struct('<BHBBBfffffff')
+OTHERTANK = struct.Struct('<BHBBfff')
+FLAG = struct.Struct('<BBff')
+SHOT = struct.Struct('<ffff')
+OCCGRID_HEADER = struct.Struct('<iiHH')
+ENCODED_OCCGRID_HEADER = struct.Struct('<iiHHB')
+STATE_HEADER = struct.Struct('<dI')
+FRAME_KIND = struct.Struct('<B')
+# The eight grid cells in each byte value of a binary occupancy grid.
+BYTE_BITS = [[byte >> (7 - i) & 1 for i in range(8)] for byte in range(256)]
+
+# The method reading the response to each command, for request.
+READERS = {
+    'shoot': 'read_bool',
+    'speed': 'read_bool',
+    'angvel': 'read_bool',
+    'teams': 'read_teams',
+    'obstacles': 'read_obstacles',
+    'occgrid': 'read_occgrid',
+    'flags': 'read_flags',
+    'shots': 'read_shots',
+    'mytanks': 'read_mytanks',
+    'othertanks': 'read_othertanks',
+    'bases': 'read_bases',
+    'constants': 'read_constants',
+    'state': 'read_state',
+}
+
+# Queued requests are sent once this many bytes are waiting.
+SEND_BUFFER = 65536
+
+# The compact records returned with BZRC(..., compact=True), and for each
+# the conversion of every field after the first word of its line (None
+# leaves it a string).
+MyTank = collections.namedtuple('MyTank', 'index callsign status shots_avail'
+        ' time_to_reload flag x y angle vx vy angvel')
+OtherTank = collections.namedtuple('OtherTank',
+        'callsign color status flag x y angle')
+Flag = collections.namedtuple('Flag', 'color poss_color x y')
+Shot = collections.namedtuple('Shot', 'x y vx vy')
+RECORDS = {
+    'mytank': (MyTank, (int, None, None, int, float, None, float, float,
+                        float, float, float, float)),
+    'othertank': (OtherTank, (None, None, None, None, float, float, float)),
+    'flag': (Flag, (None, None, float, float)),
+    'shot': (Shot, (float, float, float, float)),
+}
 
 
 class BZRC:
     """Class handles queries and responses with remote controled tanks."""
 
-    def __init__(self, host, port, debug=False):
-        """Given a hostname and port number, connect to the RC tanks."""
-        self.debug = debug
-
-        # Note that AF_INET and SOCK_STREAM are defaults.
-        sock = socket.socket()
-        sock.connect((host, port))
+    def __init__(self, host, port, debug=False, binary=False,
+                 compact=False, sock=None):
+        """Given a hostname and port number, connect to the RC tanks (or
+        talk to them over sock, if given, which is already connected).
 
-        # Make a line-buffered "file" from the socket.
-        self.conn = sock.makefile(bufsize=1)
+        With binary, ask for the responses in the compact binary protocol.
+        With compact, tanks, flags and shots in text responses are parsed a
+        whole response at a time into MyTank, OtherTank, Flag and Shot
+        named tuples instead of Answer objects; they have the same fields,
+        but cannot be changed.
 
-        self.handshake()
-
-    def handshake(self):
+        """
+        self.debug = debug
+        self.binary = False
+        self.compact = compact
+
+        if sock is None:
+            # Note that AF_INET and SOCK_STREAM are defaults.
+            sock = socket.socket()
+            sock.connect((host, port))
+        self.sock = sock
+
+        # Complete lines (and, with the binary protocol, (type, payload)
+        # frames) received but not read yet, and the start of the next one.
+        self.lines = collections.deque()
+        self.partial = ''
+        # Requests queued by request but not sent yet, their size, and the
+        # (future, reader) of every request whose response is not read yet.
+        self.outgoing = []
+        self.outgoing_size = 0
+        self.pending = collections.deque()
+        # While poll tries to read a response without blocking, the lines
+        # it took, to put back if the response is not all there.
+        self.taken = None
+        # The world as put together from subscribed frames (see subscribe),
+        # and whether it changed since poll_frame last returned it.
+        self.frame = None
+        self.fresh = False
+        self.frame_mytanks = {}
+        self.frame_othertanks = collections.OrderedDict()
+        self.frame_flags = collections.OrderedDict()
+        # tank index -> (corner, grid) of the last grid got in delta mode
+        self.occgrids = {}
+        # Whether the server has the batch and state commands; assume so
+        # until it says otherwise.
+        self.can_batch = True
+        self.can_state = True
+
+        self.handshake(binary)
+
+    def handshake(self, binary=False):
         """Perform the handshake with the remote tanks."""
         self.expect(('bzrobots', '1'), True)
-        print >>self.conn, 'agent 1'
+        if binary:
+            self.sendline('agent 2 binary')
+            self.binary = True
+        else:
+            self.sendline('agent 1')
 
     def close(self):
         """Close the socket."""
-        self.conn.close()
+        self.sock.close()
+
+    def receive(self):
+        """Wait for data from the RC tanks and split it into lines."""
+        try:
+            data = self.sock.recv(65536)
+        except socket.error:
+            data = ''
+        if not data:
+            print 'Server Shut down. Aborting'
+            sys.exit(1)
+        if not self.binary:
+            lines = (self.partial + data).split('\n')
+            self.partial = lines.pop()
+            self.lines.extend(lines)
+            return
+        buf = self.partial + data
+        start = 0
+        while len(buf) - start >= FRAME_HEADER.size:
+            length, kind = FRAME_HEADER.unpack_from(buf, start)
+            end = start + FRAME_HEADER.size + length
+            if end > len(buf):
+                break
+            payload = buf[start + FRAME_HEADER.size:end]
+            if kind == TEXT:
+                self.lines.extend(payload.split('\n')[:-1])
+            else:
+                self.lines.append((kind, payload))
+            start = end
+        self.partial = buf[start:]
+
+    def read_line(self):
+        """Read the next line from the RC tanks as an array split on
+        whitespace, or the next binary frame as a (type, payload) tuple.
+
+        """
+        while not self.lines:
+            if (self.taken is not None and
+                    not select.select([self.sock], [], [], 0)[0]):
+                raise Incomplete()
+            self.receive()
+        line = self.lines.popleft()
+        if self.taken is not None:
+            self.taken.append(line)
+        if isinstance(line, str):
+            line = line.split()
+        if self.debug:
+            print 'Received: %s' % (line,)
+        return line
 
     def read_arr(self):
         """Read a response from the RC tanks as an array split on
         whitespace.
 
+        Frames pushed by the server in between are taken in on the way.
+
         """
-        try:
-            line = self.conn.readline()
-        except socket.error:
-            print 'Server Shut down. Aborting'
-            sys.exit(1)
+        while True:
+            line = self.read_line()
+            if not self.take_frame(line):
+                return line
+
+    def take_frame(self, line):
+        """Take in line if it starts a pushed frame; return whether it
+        did.
+
+        """
+        if isinstance(line, tuple):
+            if line[0] != FRAME:
+                return False
+            self.read_binary_frame(line[1])
+        elif line and line[0] == 'frame':
+            self.read_frame(line)
+        else:
+            return False
+        return True
+
+    def take_block(self):
+        """Take the lines up to the next "end" line (which is dropped) out
+        of the receive buffer in one go, without splitting them.
+
+        """
+        scanned = 0
+        while True:
+            for count, line in enumerate(itertools.islice(self.lines,
+                                                          scanned, None),
+                                         scanned):
+                if line == 'end':
+                    break
+            else:
+                scanned = len(self.lines)
+                if (self.taken is not None and
+                        not select.select([self.sock], [], [], 0)[0]):
+                    raise Incomplete()
+                self.receive()
+                continue
+            break
+        popleft = self.lines.popleft
+        block = [popleft() for i in xrange(count)]
+        popleft()
+        if self.taken is not None:
+            self.taken.extend(block)
+            self.taken.append('end')
         if self.debug:
-            print 'Received: %s' % line.split()
-        return line.split()
+            print 'Received: %d lines and end' % count
+        return block
+
+    def read_records(self, *kinds):
+        """Read the lines up to the next "end" line as compact records.
+
+        The lines must hold records of the given kinds (mytank, othertank,
+        flag or shot), in that order.  Returns a list of records for each
+        kind.
+
+        """
+        words = ' '.join(self.take_block()).split()
+        start = 0
+        sections = []
+        for kind in kinds:
+            records, start = self.parse_records(words, start, kind)
+            sections.append(records)
+        if start != len(words):
+            self.die_confused(' or '.join(kinds) + ' or end',
+                    words[start:start + 13])
+        return sections
+
+    def parse_records(self, words, start, kind):
+        """Parse the run of records of one kind starting at words[start],
+        a column at a time.  Returns the records and where they end.
+
+        """
+        record, converters = RECORDS[kind]
+        width = len(converters) + 1
+        end = start
+        while end < len(words) and words[end] == kind:
+            end += width
+        if end > len(words):
+            self.die_confused('%d fields' % width, words[end - width:])
+        columns = []
+        for i, convert in enumerate(converters):
+            column = words[start + 1 + i:end:width]
+            if convert is not None:
+                try:
+                    column = map(convert, column)
+                except ValueError, e:
+                    self.die_confused('%s fields' % kind, [str(e)])
+            columns.append(column)
+        return map(record._make, zip(*columns)), end
+
+    def read_binary(self, kind):
+        """Read a binary frame of the given type and return its payload."""
+        line = self.read_arr()
+        if not isinstance(line, tuple) or line[0] != kind:
+            self.die_confused('binary frame of type %d' % kind, line)
+        return line[1]
 
     def sendline(self, line):
-        """Send a line to the RC tanks."""
-        print >>self.conn, line
+        """Send a line to the RC tanks.
+
+        Requests made with request go first, and their responses are read,
+        so that the caller reads the response to this line next.
+
+        """
+        if self.pending:
+            self.settle()
+        self.sock.sendall(line + '\n')
+
+    # Pipelining
+
+    def request(self, command, *args):
+        """Queue a command without waiting for its response.
+
+        Returns a Future for the response, read as the matching get_*
+        method (or shoot, speed or angvel) would return it.  Requests are
+        sent in order once SEND_BUFFER bytes are queued, or by flush, poll
+        or the result of any of their futures, and the responses are
+        matched to them in the same order.  Any number may be in flight,
+        so an agent can keep the connection busy while it thinks:
+
+            tanks = bzrc.request('mytanks')
+            shots = bzrc.request('shots')
+            bzrc.request('speed', 0, 1)
+            bzrc.poll()
+            ...
+            for tank in tanks.result(): ...
+
+        """
+        try:
+            read = getattr(self, READERS[command])
+        except KeyError:
+            raise ValueError('cannot pipeline %s' % command)
+        if command == 'occgrid' and len(args) > 1:
+            if 'delta' in args:
+                raise ValueError('cannot pipeline delta occgrids')
+            read = self.read_encoded_occgrid
+        line = ' '.join([command] + [str(arg) for arg in args]) + '\n'
+        future = Future(self)
+        self.outgoing.append(line)
+        self.outgoing_size += len(line)
+        self.pending.append((future, read))
+        if self.outgoing_size >= SEND_BUFFER:
+            self.flush()
+        return future
+
+    def flush(self):
+        """Send the queued requests.
+
+        Whatever arrives meanwhile is taken in, so that the server, which
+        stops reading from an agent that does not read its responses,
+        never waits on us while we wait on it.
+
+        """
+        data = ''.join(self.outgoing)
+        self.outgoing = []
+        self.outgoing_size = 0
+        while data:
+            readable, writable, _ = select.select([self.sock], [self.sock],
+                                                  [])
+            if readable:
+                self.receive()
+            if writable:
+                data = data[self.sock.send(data):]
+
+    def resolve(self, future, read):
+        """Read the response to the oldest pending request."""
+        try:
+            self.read_ack()
+            future.set_result(read())
+        except UnexpectedResponse, e:
+            future.set_exception(e)
+
+    def poll(self):
+        """Send the queued requests and read the responses which have
+        arrived, without blocking.
+
+        Returns the number of requests still waiting for a response.
+
+        """
+        self.flush()
+        while self.pending:
+            future, read = self.pending[0]
+            self.taken = []
+            try:
+                self.resolve(future, read)
+            except Incomplete:
+                self.lines.extendleft(reversed(self.taken))
+                break
+            finally:
+                self.taken = None
+            self.pending.popleft()
+        return len(self.pending)
+
+    def wait(self, future):
+        """Send the queued requests and read responses until future has
+        its result."""
+        self.flush()
+        while not future.done():
+            self.resolve(*self.pending.popleft())
+
+    def settle(self):
+        """Send the queued requests and read all of their responses."""
+        self.flush()
+        while self.pending:
+            self.resolve(*self.pending.popleft())
 
     def die_confused(self, expected, got_arr):
         """When we think the RC tanks should have responded differently, call
@@ -70,6 +427,8 @@ class BZRC:
         with the array containing what was actually sent.
 
         """
+        if isinstance(got_arr, tuple):
+            got_arr = ['binary frame of type %d' % got_arr[0]]
         raise UnexpectedResponse(expected, ' '.join(got_arr))
 
     def expect(self, expected, full=False):
@@ -164,6 +523,11 @@ class BZRC:
         response = self.read_arr()
         if 'fail' in response:
             return None
+        if self.binary:
+            if not isinstance(response, tuple) or response[0] != OCCGRID:
+                self.die_confused('binary frame of type %d' % OCCGRID,
+                        response)
+            return self.decode_occgrid(response[1])
         pos = tuple(int(a) for a in self.expect('at')[0].split(','))
         size = tuple(int(a) for a in self.expect('size')[0].split('x'))
         grid = [[0 for i in range(size[1])] for j in range(size[0])]
@@ -175,8 +539,38 @@ class BZRC:
         self.expect('end', True)
         return pos, grid
 
+    def read_encoded_occgrid(self, delta=False):
+        """Read a grid in one of the compact encodings (or, with delta, a
+        delta grid)."""
+        kind = DELTA_OCCGRID if delta else ENCODED_OCCGRID
+        response = self.read_arr()
+        if 'fail' in response:
+            return None
+        if self.binary:
+            if not isinstance(response, tuple) or response[0] != kind:
+                self.die_confused('binary frame of type %d' % kind, response)
+            data = response[1]
+            x, y, width, height, encoding = \
+                    ENCODED_OCCGRID_HEADER.unpack_from(data)
+            pos = (x, y)
+            encoding = ENCODINGS[encoding]
+            data = data[ENCODED_OCCGRID_HEADER.size:]
+        else:
+            pos = tuple(int(a) for a in self.expect('at')[0].split(','))
+            width, height = (int(a) for a in self.expect('size')[0].split('x'))
+            encoding, = self.expect('delta' if delta else 'encoding')
+            data = base64.b64decode(self.read_arr()[0])
+            self.expect('end', True)
+        return pos, decode_grid(data, encoding, width, height)
+
     def read_flags(self):
         """Get flag information."""
+        if self.binary:
+            return self.decode_section(self.read_binary(FLAGS), 0,
+                    self.decode_flag, FLAG.size)[0]
+        if self.compact:
+            self.expect('begin', True)
+            return self.read_records('flag')[0]
         line = self.read_arr()
         if line[0] != 'begin':
             self.die_confused('begin', line)
@@ -185,20 +579,29 @@ class BZRC:
         while True:
             line = self.read_arr()
             if line[0] == 'flag':
-                flag = Answer()
-                flag.color = line[1]
-                flag.poss_color = line[2]
-                flag.x = float(line[3])
-                flag.y = float(line[4])
-                flags.append(flag)
+                flags.append(self.parse_flag(line))
             elif line[0] == 'end':
                 break
             else:
                 self.die_confused('flag or end', line)
         return flags
 
+    def parse_flag(self, line):
+        flag = Answer()
+        flag.color = line[1]
+        flag.poss_color = line[2]
+        flag.x = float(line[3])
+        flag.y = float(line[4])
+        return flag
+
     def read_shots(self):
         """Get shot information."""
+        if self.binary:
+            return self.decode_section(self.read_binary(SHOTS), 0,
+                    self.decode_shot, SHOT.size)[0]
+        if self.compact:
+            self.expect('begin', True)
+            return self.read_records('shot')[0]
         line = self.read_arr()
         if line[0] != 'begin':
             self.die_confused('begin', line)
@@ -207,20 +610,29 @@ class BZRC:
         while True:
             line = self.read_arr()
             if line[0] == 'shot':
-                shot = Answer()
-                shot.x = float(line[1])
-                shot.y = float(line[2])
-                shot.vx = float(line[3])
-                shot.vy = float(line[4])
-                shots.append(shot)
+                shots.append(self.parse_shot(line))
             elif line[0] == 'end':
                 break
             else:
                 self.die_confused('shot or end', line)
         return shots
 
+    def parse_shot(self, line):
+        shot = Answer()
+        shot.x = float(line[1])
+        shot.y = float(line[2])
+        shot.vx = float(line[3])
+        shot.vy = float(line[4])
+        return shot
+
     def read_mytanks(self):
         """Get friendly tank information."""
+        if self.binary:
+            return self.decode_section(self.read_binary(MYTANKS), 0,
+                    self.decode_mytank, MYTANK.size)[0]
+        if self.compact:
+            self.expect('begin', True)
+            return self.read_records('mytank')[0]
         line = self.read_arr()
         if line[0] != 'begin':
             self.die_confused('begin', line)
@@ -229,28 +641,37 @@ class BZRC:
         while True:
             line = self.read_arr()
             if line[0] == 'mytank':
-                tank = Answer()
-                tank.index = int(line[1])
-                tank.callsign = line[2]
-                tank.status = line[3]
-                tank.shots_avail = int(line[4])
-                tank.time_to_reload = float(line[5])
-                tank.flag = line[6]
-                tank.x = float(line[7])
-                tank.y = float(line[8])
-                tank.angle = float(line[9])
-                tank.vx = float(line[10])
-                tank.vy = float(line[11])
-                tank.angvel = float(line[12])
-                tanks.append(tank)
+                tanks.append(self.parse_mytank(line))
             elif line[0] == 'end':
                 break
             else:
                 self.die_confused('mytank or end', line)
         return tanks
 
+    def parse_mytank(self, line):
+        tank = Answer()
+        tank.index = int(line[1])
+        tank.callsign = line[2]
+        tank.status = line[3]
+        tank.shots_avail = int(line[4])
+        tank.time_to_reload = float(line[5])
+        tank.flag = line[6]
+        tank.x = float(line[7])
+        tank.y = float(line[8])
+        tank.angle = float(line[9])
+        tank.vx = float(line[10])
+        tank.vy = float(line[11])
+        tank.angvel = float(line[12])
+        return tank
+
     def read_othertanks(self):
         """Get enemy tank information."""
+        if self.binary:
+            return self.decode_section(self.read_binary(OTHERTANKS), 0,
+                    self.decode_othertank, OTHERTANK.size)[0]
+        if self.compact:
+            self.expect('begin', True)
+            return self.read_records('othertank')[0]
         line = self.read_arr()
         if line[0] != 'begin':
             self.die_confused('begin', line)
@@ -259,21 +680,212 @@ class BZRC:
         while True:
             line = self.read_arr()
             if line[0] == 'othertank':
-                tank = Answer()
-                tank.callsign = line[1]
-                tank.color = line[2]
-                tank.status = line[3]
-                tank.flag = line[4]
-                tank.x = float(line[5])
-                tank.y = float(line[6])
-                tank.angle = float(line[7])
-                tanks.append(tank)
+                tanks.append(self.parse_othertank(line))
             elif line[0] == 'end':
                 break
             else:
                 self.die_confused('othertank or end', line)
         return tanks
 
+    def parse_othertank(self, line):
+        tank = Answer()
+        tank.callsign = line[1]
+        tank.color = line[2]
+        tank.status = line[3]
+        tank.flag = line[4]
+        tank.x = float(line[5])
+        tank.y = float(line[6])
+        tank.angle = float(line[7])
+        return tank
+
+    def read_state(self):
+        """Get everything that moves, as seen in one simulation step."""
+        if self.binary:
+            data = self.read_binary(STATE)
+            elapsed, tick = STATE_HEADER.unpack_from(data)
+            sections = self.decode_sections(data, STATE_HEADER.size)
+            state = Answer()
+            state.time = elapsed
+            state.tick = tick
+            state.mytanks, state.othertanks, state.flags, state.shots = \
+                    sections
+            return state
+        self.expect('begin', True)
+        line = self.expect('state')
+        state = Answer()
+        state.time = float(line[0])
+        state.tick = int(line[1])
+        if self.compact:
+            state.mytanks, state.othertanks, state.flags, state.shots = \
+                    self.read_records('mytank', 'othertank', 'flag', 'shot')
+            return state
+        state.mytanks = []
+        state.othertanks = []
+        state.flags = []
+        state.shots = []
+        parsers = {'mytank': (self.parse_mytank, state.mytanks),
+                   'othertank': (self.parse_othertank, state.othertanks),
+                   'flag': (self.parse_flag, state.flags),
+                   'shot': (self.parse_shot, state.shots)}
+        while True:
+            line = self.read_arr()
+            if line[0] == 'end':
+                break
+            try:
+                parse, items = parsers[line[0]]
+            except KeyError:
+                self.die_confused('mytank, othertank, flag, shot or end',
+                        line)
+            items.append(parse(line))
+        return state
+
+    def read_frame(self, header):
+        """Take in a frame pushed by the server, given its first line."""
+        elapsed, tick, kind = header[1:]
+        if self.compact:
+            sections = self.read_records('mytank', 'othertank', 'flag',
+                                         'shot')
+            self.update_frame(float(elapsed), int(tick), kind == 'full',
+                              *sections)
+            return
+        mytanks = []
+        othertanks = []
+        flags = []
+        shots = []
+        parsers = {'mytank': (self.parse_mytank, mytanks),
+                   'othertank': (self.parse_othertank, othertanks),
+                   'flag': (self.parse_flag, flags),
+                   'shot': (self.parse_shot, shots)}
+        while True:
+            line = self.read_line()
+            if line[0] == 'end':
+                break
+            try:
+                parse, items = parsers[line[0]]
+            except KeyError:
+                self.die_confused('mytank, othertank, flag, shot or end',
+                        line)
+            items.append(parse(line))
+        self.update_frame(float(elapsed), int(tick), kind == 'full',
+                          mytanks, othertanks, flags, shots)
+
+    def read_binary_frame(self, data):
+        """Take in a binary frame pushed by the server."""
+        elapsed, tick = STATE_HEADER.unpack_from(data)
+        delta, = FRAME_KIND.unpack_from(data, STATE_HEADER.size)
+        mytanks, othertanks, flags, shots = self.decode_sections(data,
+                STATE_HEADER.size + FRAME_KIND.size)
+        self.update_frame(elapsed, tick, not delta, mytanks, othertanks,
+                          flags, shots)
+
+    def update_frame(self, elapsed, tick, full, mytanks, othertanks, flags,
+                     shots):
+        """Bring the world put together from frames up to date."""
+        if full:
+            self.frame_mytanks.clear()
+            self.frame_othertanks.clear()
+            self.frame_flags.clear()
+        for tank in mytanks:
+            self.frame_mytanks[tank.index] = tank
+        for tank in othertanks:
+            self.frame_othertanks[tank.callsign] = tank
+        for flag in flags:
+            self.frame_flags[flag.color] = flag
+        frame = Answer()
+        frame.time = elapsed
+        frame.tick = tick
+        frame.mytanks = [self.frame_mytanks[index]
+                         for index in sorted(self.frame_mytanks)]
+        frame.othertanks = self.frame_othertanks.values()
+        frame.flags = self.frame_flags.values()
+        frame.shots = shots
+        self.frame = frame
+        self.fresh = True
+
+    # Binary protocol decoding
+
+    def decode_section(self, data, offset, decode, size):
+        """Decode the section at offset; returns the decoded records and
+        the offset after them.
+
+        """
+        count, = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        items = []
+        for i in xrange(count):
+            items.append(decode(data, offset))
+            offset += size
+        return items, offset
+
+    def decode_sections(self, data, offset):
+        """Decode the mytank, othertank, flag and shot sections at offset."""
+        sections = []
+        for decode, record in ((self.decode_mytank, MYTANK),
+                               (self.decode_othertank, OTHERTANK),
+                               (self.decode_flag, FLAG),
+                               (self.decode_shot, SHOT)):
+            items, offset = self.decode_section(data, offset, decode,
+                    record.size)
+            sections.append(items)
+        return sections
+
+    def decode_mytank(self, data, offset):
+        (color, index, status, shots_avail, flag, reload, x, y, angle, vx,
+                vy, angvel) = MYTANK.unpack_from(data, offset)
+        tank = Answer()
+        tank.index = index
+        tank.callsign = COLORNAME[color] + str(index)
+        tank.status = STATUSES[status]
+        tank.shots_avail = shots_avail
+        tank.time_to_reload = reload
+        tank.flag = flag == NONE and '-' or COLORNAME[flag]
+        tank.x = x
+        tank.y = y
+        tank.angle = angle
+        tank.vx = vx
+        tank.vy = vy
+        tank.angvel = angvel
+        return tank
+
+    def decode_othertank(self, data, offset):
+        color, index, status, flag, x, y, angle = OTHERTANK.unpack_from(data,
+                offset)
+        tank = Answer()
+        tank.callsign = COLORNAME[color] + str(index)
+        tank.color = COLORNAME[color]
+        tank.status = STATUSES[status]
+        tank.flag = flag == NONE and '-' or COLORNAME[flag]
+        tank.x = x
+        tank.y = y
+        tank.angle = angle
+        return tank
+
+    def decode_flag(self, data, offset):
+        color, possess, x, y = FLAG.unpack_from(data, offset)
+        flag = Answer()
+        flag.color = COLORNAME[color]
+        flag.poss_color = possess == NONE and 'none' or COLORNAME[possess]
+        flag.x = x
+        flag.y = y
+        return flag
+
+    def decode_shot(self, data, offset):
+        shot = Answer()
+        shot.x, shot.y, shot.vx, shot.vy = SHOT.unpack_from(data, offset)
+        return shot
+
+    def decode_occgrid(self, data):
+        """Decode an OCCGRID frame; the grid is a NumPy array if NumPy is
+        available, and a list of lists otherwise."""
+        x, y, width, height = OCCGRID_HEADER.unpack_from(data)
+        bits = data[OCCGRID_HEADER.size:]
+        if numpy is not None:
+            return (x, y), decode_grid(bits, 'bits', width, height)
+        flat = list(itertools.chain.from_iterable(
+                BYTE_BITS[byte] for byte in bytearray(bits)))
+        grid = [flat[i:i + height] for i in xrange(0, width * height, height)]
+        return (x, y), grid
+
     def read_bases(self):
         """Get base information."""
         bases = []
@@ -351,11 +963,37 @@ class BZRC:
         self.read_ack()
         return self.read_obstacles()
 
-    def get_occgrid(self, tankid):
-        """Request an occupancy grid for a tank"""
-        self.sendline('occgrid %d' % tankid)
+    def get_occgrid(self, tankid, encoding=None, delta=False):
+        """Request an occupancy grid for a tank
+
+        With an encoding (bits, rle or zlib), the grid is sent compressed
+        and returned as a NumPy array of 0s and 1s, indexed [x, y], instead
+        of a list of lists.  So is the grid sent with the binary protocol,
+        if NumPy is available.
+
+        With delta, only the cells which changed since the last delta grid
+        for the tank are sent, and the grid is put back together from the
+        one kept here.  The result is a NumPy array, as with an encoding.
+
+        """
+        if delta:
+            self.sendline('occgrid %d delta %s' % (tankid, encoding or 'rle'))
+            self.read_ack()
+            result = self.read_encoded_occgrid(True)
+            if result is None:
+                return None
+            pos, changed = result
+            last_pos, last = self.occgrids.get(tankid, (None, None))
+            grid = shift_grid(last_pos, last, pos, changed.shape) ^ changed
+            self.occgrids[tankid] = (pos, grid)
+            return pos, grid.copy()
+        if encoding is None:
+            self.sendline('occgrid %d' % tankid)
+            self.read_ack()
+            return self.read_occgrid()
+        self.sendline('occgrid %d %s' % (tankid, encoding))
         self.read_ack()
-        return self.read_occgrid()
+        return self.read_encoded_occgrid()
 
     def get_flags(self):
         """Request a list of flags."""
@@ -393,14 +1031,78 @@ class BZRC:
         self.read_ack()
         return self.read_constants()
 
+    def get_state(self):
+        """Request our tanks, other tanks, flags and shots in one go.
+
+        Returns an Answer with the time and tick of the simulation step they
+        were all taken from, and mytanks, othertanks, flags and shots lists.
+
+        """
+        self.sendline('state')
+        self.read_ack()
+        return self.read_state()
+
+    # Subscriptions
+
+    def subscribe(self, every=1, delta=False):
+        """Ask the server to push the state every so many simulation steps.
+
+        Pick the frames up with poll_frame instead of asking for the state.
+        With delta, the server only sends what changed and the frames are
+        put back together here.  Subscribing every 0 steps stops them.
+
+        """
+        self.sendline('subscribe %d%s' % (every, delta and ' delta' or ''))
+        self.read_ack()
+        return self.read_bool()
+
+    def poll_frame(self, timeout=0):
+        """Return the newest state pushed by the server, or None.
+
+        Takes in whatever frames have arrived without blocking.  If none
+        did since the last call, waits up to timeout seconds (forever if
+        timeout is None) for one, and returns None if none comes.  The
+        state is an Answer like that of get_state.
+
+        """
+        if self.pending:
+            self.settle()
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            while self.lines:
+                line = self.read_line()
+                if not self.take_frame(line) and line:
+                    self.die_confused('frame', line)
+            if self.fresh:
+                self.fresh = False
+                return self.frame
+            wait = None
+            if timeout is not None:
+                wait = max(0, deadline - time.time())
+            if not select.select([self.sock], [], [], wait)[0]:
+                return None
+            self.receive()
+
     # Optimized queries
 
     def get_lots_o_stuff(self):
         """Network-optimized request for mytanks, othertanks, flags, and shots.
 
-        Returns a tuple with the four results.
+        Returns a tuple with the four results.  They come from a single
+        state request, and so from the same simulation step, when the server
+        supports it.
 
         """
+        if self.can_state:
+            try:
+                state = self.get_state()
+                return (state.mytanks, state.othertanks, state.flags,
+                        state.shots)
+            except UnexpectedResponse, e:
+                if e.got != 'fail invalid command':
+                    raise
+                self.can_state = False
         self.sendline('mytanks')
         self.sendline('othertanks')
         self.sendline('flags')
@@ -418,7 +1120,20 @@ class BZRC:
         return (mytanks, othertanks, flags, shots)
 
     def do_commands(self, commands):
-        """Send commands for a bunch of tanks in a network-optimized way."""
+        """Send commands for a bunch of tanks in a network-optimized way.
+
+        Returns a (speed, angvel, shoot) tuple of results for each command;
+        a shot which was not asked for counts as False.  All the commands go
+        in a single batch request when the server supports it.
+
+        """
+        if self.can_batch:
+            try:
+                return self.batch(commands)
+            except UnexpectedResponse, e:
+                if e.got != 'fail invalid command':
+                    raise
+                self.can_batch = False
         for cmd in commands:
             self.sendline('speed %s %s' % (cmd.index, cmd.speed))
             self.sendline('angvel %s %s' % (cmd.index, cmd.angvel))
@@ -439,6 +1154,58 @@ class BZRC:
             results.append((result_speed, result_angvel, result_shoot))
         return results
 
+    def batch(self, commands):
+        """Send commands for a bunch of tanks in one batch request.
+
+        A speed or angvel of None leaves it unchanged.  Returns a (speed,
+        angvel, shoot) tuple of results for each command, as do_commands.
+
+        """
+        if not commands:
+            return []
+        fields = ['batch']
+        for cmd in commands:
+            fields.append('%s %s %s %d' % (cmd.index,
+                    '-' if cmd.speed is None else cmd.speed,
+                    '-' if cmd.angvel is None else cmd.angvel,
+                    bool(cmd.shoot)))
+        self.sendline(' '.join(fields))
+        self.read_ack()
+        results = self.expect('ok')
+        if len(results) != len(commands):
+            self.die_confused('ok with %d results' % len(commands),
+                    ['ok'] + results)
+        return [tuple(c == '1' for c in result) for result in results]
+
+def decode_grid(data, encoding, width, height):
+    """Decode an encoded occupancy grid into a NumPy array."""
+    if encoding == 'rle':
+        runs = numpy.fromstring(data, '<u4')
+        flat = numpy.repeat(numpy.arange(len(runs), dtype=numpy.uint8) % 2,
+                            runs)
+    else:
+        if encoding == 'zlib':
+            data = zlib.decompress(data)
+        flat = numpy.unpackbits(numpy.fromstring(data, numpy.uint8))
+    return flat[:width * height].reshape(width, height)
+
+
+def shift_grid(last_pos, last, pos, shape):
+    """Move the grid last, whose corner was at last_pos, to the window of
+    the given shape whose corner is at pos, filling the rest with 0s."""
+    grid = numpy.zeros(shape, numpy.uint8)
+    if last is None:
+        return grid
+    x0 = max(last_pos[0], pos[0])
+    y0 = max(last_pos[1], pos[1])
+    x1 = min(last_pos[0] + last.shape[0], pos[0] + shape[0])
+    y1 = min(last_pos[1] + last.shape[1], pos[1] + shape[1])
+    if x0 < x1 and y0 < y1:
+        grid[x0 - pos[0]:x1 - pos[0], y0 - pos[1]:y1 - pos[1]] = \
+                last[x0 - last_pos[0]:x1 - last_pos[0],
+                     y0 - last_pos[1]:y1 - last_pos[1]]
+    return grid
+
 
 class Answer(object):
     """BZRC returns an Answer for things like tanks, obstacles, etc.
@@ -450,6 +1217,40 @@ class Answer(object):
     pass
 
 
+class Future(object):
+    """The response to a request, which may not have arrived yet."""
+
+    def __init__(self, bzrc):
+        self.bzrc = bzrc
+        self.finished = False
+        self.value = None
+        self.error = None
+
+    def done(self):
+        """Return whether the response has been read."""
+        return self.finished
+
+    def result(self):
+        """Return the response, waiting for it if need be.
+
+        Raises UnexpectedResponse if the response could not be understood.
+
+        """
+        if not self.finished:
+            self.bzrc.wait(self)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def set_result(self, value):
+        self.value = value
+        self.finished = True
+
+    def set_exception(self, error):
+        self.error = error
+        self.finished = True
+
+
 class Command(object):
     """Class for setting a command for a tank."""
 
@@ -472,4 +1273,8 @@ class UnexpectedResponse(Exception):
                 self.got)
 
 
+class Incomplete(Exception):
+    """Raised by read_line when poll finds a response not all there."""
+
+
 # vim: et sw=4 sts=4
@@ -0,0 +1,229 @@
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Simulation throughput benchmarks.
+
+Plays headless games on every map for a range of team sizes and shot limits,
+with every tank driving flat out in random directions and firing as fast as
+it can, and measures how quickly the simulation steps.  Each run reports
+ticks per second, the median and 99th percentile time of a single step, and
+the peak resident memory of the process.  Runs are made one at a time, each
+in a fresh process, so their memory figures and timings do not disturb each
+other.
+
+Results are written as JSON; pass an earlier results file with --compare to
+see how a revision changed things.
+
+"""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import os
+import sys
+import glob
+import json
+import time
+import random
+import platform
+import optparse
+import resource
+import subprocess
+import multiprocessing
+
+import numpy
+
+import config
+import game
+
+DEFAULT_TANKS = '10,25,50,100,200'
+DEFAULT_SHOTS = '5,20'
+
+# Steps run before timing starts; tanks spawn during the first one.
+WARMUP_TICKS = 10
+
+
+def int_list(text):
+    """Parse a comma separated list of integers.
+
+    >>> int_list('10, 25,50')
+    [10, 25, 50]
+    """
+    return [int(x) for x in text.split(',') if x.strip()]
+
+
+def runs(maps, tanks, shots, ticks, args=()):
+    """Return the description of every run in the sweep."""
+    return [{'map': world, 'tanks': n, 'max_shots': m, 'ticks': ticks,
+             'args': list(args)}
+            for world in maps for n in tanks for m in shots]
+
+
+def drive(g, rand):
+    """Send every tank the synthetic commands for one tick."""
+    for team in g.teams.values():
+        for tankid in xrange(len(team.tanks)):
+            team.speed(tankid, rand.choice((-1, 1)))
+            team.angvel(tankid, rand.uniform(-1, 1))
+            team.shoot(tankid)
+
+
+def run_one(run):
+    """Play one benchmark run and return its description with the results."""
+    result = dict(run)
+    args = ['--test', '--world=%s' % run['map'],
+            '--default-tanks=%d' % run['tanks'],
+            '--max-shots=%d' % run['max_shots'], '--seed=1']
+    args += run['args']
+    start = time.time()
+    game_loop = game.GameLoop(config.Config(args))
+    g = game_loop.game
+    result['setup_s'] = time.time() - start
+    dt = 1.0 / game_loop.config['tick_rate']
+    rand = random.Random(1)
+    for i in xrange(WARMUP_TICKS):
+        drive(g, rand)
+        g.update(dt)
+
+    clock = time.time
+    times = numpy.empty(run['ticks'])
+    start = clock()
+    for i in xrange(run['ticks']):
+        drive(g, rand)
+        before = clock()
+        g.update(dt)
+        times[i] = clock() - before
+    elapsed = clock() - start
+
+    result['ticks_per_s'] = run['ticks'] / elapsed
+    result['tick_p50_ms'] = float(numpy.percentile(times, 50)) * 1000
+    result['tick_p99_ms'] = float(numpy.percentile(times, 99)) * 1000
+    result['tick_max_ms'] = float(times.max()) * 1000
+    result['shots'] = len(list(g.shots()))
+    # kilobytes on Linux
+    result['peak_rss_kb'] = resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def run_isolated(run):
+    """Play a run in a fresh process."""
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(run_one, (run,))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def revision():
+    """Return the git revision of the working tree, if there is one."""
+    path = os.path.dirname(os.path.abspath(__file__))
+    try:
+        out = subprocess.Popen(['git', 'describe', '--always', '--dirty'],
+                               cwd=path, stdout=subprocess.PIPE,
+                               stderr=open(os.devnull, 'w')).communicate()[0]
+    except OSError:
+        return None
+    return out.strip() or None
+
+
+def key(result):
+    return (os.path.basename(result['map']), result['tanks'],
+            result['max_shots'], ' '.join(result['args']))
+
+
+def compare(old, new):
+    """Return report lines comparing two results files' runs."""
+    before = dict((key(r), r) for r in old['results'])
+    lines = ['%-24s %6s %5s %10s %10s %7s' % ('map', 'tanks', 'shots',
+             'old tick/s', 'new tick/s', 'change')]
+    for r in new['results']:
+        k = key(r)
+        if k not in before:
+            continue
+        was = before[k]['ticks_per_s']
+        lines.append('%-24s %6d %5d %10.1f %10.1f %+6.1f%%'
+                     % (k[0], k[1], k[2], was, r['ticks_per_s'],
+                        100.0 * (r['ticks_per_s'] - was) / was))
+    return lines
+
+
+def main(args=None):
+    """Run the benchmark sweep described on the command line."""
+    p = optparse.OptionParser(usage='%prog [options] [map.bzw ...]')
+    p.add_option('-o', '--output',
+        dest='output', default='benchmark.json',
+        help='file to write the results to')
+    p.add_option('--tanks',
+        dest='tanks', default=DEFAULT_TANKS,
+        help='comma separated tanks per team to try (default %s)'
+             % DEFAULT_TANKS)
+    p.add_option('--max-shots',
+        dest='max_shots', default=DEFAULT_SHOTS,
+        help='comma separated shot limits to try (default %s)'
+             % DEFAULT_SHOTS)
+    p.add_option('--ticks',
+        type='int', dest='ticks', default=200,
+        help='timed simulation steps per run')
+    p.add_option('--game-args',
+        dest='game_args', default='',
+        help='extra bzrflag options for every run, e.g. "--vectorized"')
+    p.add_option('--compare',
+        dest='compare',
+        help='earlier results file to compare against')
+    opts, maps = p.parse_args(args)
+    if not maps:
+        path = os.path.dirname(os.path.abspath(__file__))
+        maps = sorted(glob.glob(os.path.join(path, '..', 'maps', '*.bzw')))
+    sweep = runs(maps, int_list(opts.tanks), int_list(opts.max_shots),
+                 opts.ticks, opts.game_args.split())
+    results = []
+    for run in sweep:
+        result = run_isolated(run)
+        print ('%-24s tanks %4d shots %3d: %8.1f ticks/s  p50 %7.2fms  '
+               'p99 %7.2fms  rss %dkB'
+               % (os.path.basename(run['map']), run['tanks'],
+                  run['max_shots'], result['ticks_per_s'],
+                  result['tick_p50_ms'], result['tick_p99_ms'],
+                  result['peak_rss_kb']))
+        sys.stdout.flush()
+        results.append(result)
+    report = {'revision': revision(), 'python': platform.python_version(),
+              'machine': platform.platform(), 'time': time.time(),
+              'results': results}
+    out = open(opts.output, 'w')
+    json.dump(report, out, indent=2, sort_keys=True)
+    out.close()
+    print 'results in %s' % opts.output
+    if opts.compare:
+        for line in compare(json.load(open(opts.compare)), report):
+            print line
+    return True
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+# vim: et sw=4 sts=4
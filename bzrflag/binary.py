@@ -0,0 +1,231 @@
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Binary encoding of BZRC responses.
+
+An agent which answers the handshake with "agent 2 binary" instead of
+"agent 1" still sends its commands as lines of text, but gets every
+response as a frame:
+
+    length (uint32), type (uint8), payload of length bytes
+
+All numbers are little-endian.  Responses which have no binary form (acks,
+ok, fail, and the lists that do not change during a game) are TEXT frames
+holding exactly the text the text protocol would send.  The others are:
+
+    MYTANKS     mytank section
+    OTHERTANKS  othertank section
+    FLAGS       flag section
+    SHOTS       shot section
+    OCCGRID     x, y (int32), width, height (uint16), then the grid as
+                width * height bits, x major, packed most significant bit
+                first into bytes
+    STATE       time elapsed (float64), tick (uint32), then the mytank,
+                othertank, flag and shot sections
+    FRAME       time elapsed (float64), tick (uint32), 0 for a full frame
+                or 1 for a delta frame (uint8), then the four sections as
+                for STATE (see the subscribe command)
+    ENCODED_OCCGRID
+                x, y (int32), width, height (uint16), the index of the
+                encoding in ENCODINGS (uint8), then the encoded grid
+    DELTA_OCCGRID
+                as ENCODED_OCCGRID, but the grid is a delta (see below)
+
+A section is a count (uint32) followed by that many records:
+
+    mytank     color (uint8), index (uint16), status, shots available,
+               flag (uint8), time to reload, x, y, angle, vx, vy, angvel
+               (float32)
+    othertank  color, index (uint16), status, flag (uint8), x, y, angle
+               (float32)
+    flag       color, possessing color (uint8), x, y (float32)
+    shot       x, y, vx, vy (float32)
+
+Colors are indices into COLORNAME and statuses into STATUSES; a flag of
+NONE means none.  A tank's callsign is its color followed by its index.
+
+Occupancy grids can also be asked for in a compact encoding (in either
+protocol; see the occgrid command).  Every encoding takes the grid's cells
+x major, as a flat run of width * height cells:
+
+    bits  one bit per cell, most significant bit first
+    rle   the lengths of the alternating runs of empty and occupied cells
+          (uint32), starting with the empty cells
+    zlib  the bits encoding, compressed with zlib
+
+A delta grid holds a 1 for each cell which differs from the last grid sent
+for the same tank (in delta mode, on the same connection), after that grid
+is moved to the new window with shift_grid.  Cells outside the last window
+count as 0, so the first delta is the whole grid.
+
+"""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import zlib
+import struct
+
+import numpy
+
+import constants
+
+(TEXT, MYTANKS, OTHERTANKS, FLAGS, SHOTS, OCCGRID, STATE, FRAME,
+ ENCODED_OCCGRID, DELTA_OCCGRID) = range(10)
+
+ENCODINGS = ('bits', 'rle', 'zlib')
+
+COLORNAME = constants.COLORNAME
+STATUSES = (constants.TANKALIVE, constants.TANKDEAD)
+NONE = 255
+
+header = struct.Struct('<IB')
+count = struct.Struct('<I')
+mytank = struct.Struct('<BHBBBfffffff')
+othertank = struct.Struct('<BHBBfff')
+flag = struct.Struct('<BBff')
+shot = struct.Struct('<ffff')
+occgrid_header = struct.Struct('<iiHH')
+encoded_occgrid_header = struct.Struct('<iiHHB')
+state_header = struct.Struct('<dI')
+frame_kind = struct.Struct('<B')
+
+# Leading bytes of a record which say which entity it describes.
+KEYS = {'mytanks': 3, 'othertanks': 3, 'flags': 1}
+
+
+def frame(kind, payload):
+    """Return a frame of the given type holding payload.
+
+    >>> frame(TEXT, 'ok\\n')
+    '\\x03\\x00\\x00\\x00\\x00ok\\n'
+    """
+    return header.pack(len(payload), kind) + payload
+
+
+def section(records):
+    """Return records (packed strings) as a section."""
+    return count.pack(len(records)) + ''.join(records)
+
+
+def occgrid(pos, grid):
+    """Return an OCCGRID frame for the grid whose corner is at pos."""
+    width, height = grid.shape
+    bits = numpy.packbits(numpy.asarray(grid, bool).ravel())
+    return frame(OCCGRID, occgrid_header.pack(pos[0], pos[1], width, height)
+                 + bits.tostring())
+
+
+def encoded_occgrid(pos, grid, encoding, kind=ENCODED_OCCGRID):
+    """Return an ENCODED_OCCGRID (or DELTA_OCCGRID) frame for the grid
+    whose corner is at pos."""
+    width, height = grid.shape
+    return frame(kind, encoded_occgrid_header.pack(pos[0], pos[1],
+                 width, height, ENCODINGS.index(encoding))
+                 + encode_grid(grid, encoding))
+
+
+def shift_grid(last_pos, last, pos, shape):
+    """Return the grid last, whose corner was at last_pos, moved to the
+    window of the given shape whose corner is at pos.  Cells the two
+    windows do not share are 0.
+
+    >>> last = numpy.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+    >>> shift_grid((0, 0), last, (1, -1), (3, 3))
+    array([[0, 4, 5],
+           [0, 7, 8],
+           [0, 0, 0]])
+    """
+    grid = numpy.zeros(shape, numpy.uint8 if last is None else last.dtype)
+    if last is None:
+        return grid
+    x0 = max(last_pos[0], pos[0])
+    y0 = max(last_pos[1], pos[1])
+    x1 = min(last_pos[0] + last.shape[0], pos[0] + shape[0])
+    y1 = min(last_pos[1] + last.shape[1], pos[1] + shape[1])
+    if x0 < x1 and y0 < y1:
+        grid[x0 - pos[0]:x1 - pos[0], y0 - pos[1]:y1 - pos[1]] = \
+                last[x0 - last_pos[0]:x1 - last_pos[0],
+                     y0 - last_pos[1]:y1 - last_pos[1]]
+    return grid
+
+
+def encode_grid(grid, encoding):
+    """Encode a grid as bits, rle or zlib.
+
+    >>> grid = numpy.array([[1, 1, 0], [0, 0, 1]])
+    >>> encode_grid(grid, 'bits')
+    '\\xc4'
+    >>> numpy.fromstring(encode_grid(grid, 'rle'), '<u4')
+    array([0, 2, 3, 1], dtype=uint32)
+    """
+    flat = numpy.asarray(grid, bool).ravel()
+    if encoding == 'rle':
+        starts = numpy.flatnonzero(flat[1:] != flat[:-1]) + 1
+        bounds = numpy.concatenate(([0], starts, [flat.size]))
+        runs = numpy.diff(bounds)
+        if flat.size and flat[0]:
+            runs = numpy.concatenate(([0], runs))
+        return runs.astype('<u4').tostring()
+    bits = numpy.packbits(flat).tostring()
+    if encoding == 'zlib':
+        return zlib.compress(bits)
+    return bits
+
+
+def decode_grid(data, encoding, width, height):
+    """Decode a grid encoded by encode_grid into a uint8 array.
+
+    >>> grid = numpy.array([[1, 1, 0], [0, 0, 1]])
+    >>> for encoding in ENCODINGS:
+    ...     data = encode_grid(grid, encoding)
+    ...     assert (decode_grid(data, encoding, 2, 3) == grid).all()
+    """
+    if encoding == 'rle':
+        runs = numpy.fromstring(data, '<u4')
+        flat = numpy.repeat(numpy.arange(len(runs), dtype=numpy.uint8) % 2,
+                            runs)
+    else:
+        if encoding == 'zlib':
+            data = zlib.decompress(data)
+        flat = numpy.unpackbits(numpy.fromstring(data, numpy.uint8))
+    return flat[:width * height].reshape(width, height)
+
+
+def delta(records, last, keylen):
+    """Return the records which differ from those in last (a dict by key,
+    updated in place)."""
+    changed = []
+    for record in records:
+        key = record[:keylen]
+        if last.get(key) != record:
+            last[key] = record
+            changed.append(record)
+    return changed
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+# vim: et sw=4 sts=4
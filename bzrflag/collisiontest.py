@@ -224,6 +224,143 @@ def circle_to_circle(circle1, circle2):
     return get_dist(circle1[0],circle2[0]) <= circle1[1] + circle2[1]
 
 
+def sweep_circle_circle(circle1, move1, circle2, move2):
+    """Find when two circles moving in straight lines first touch.
+
+    Each circle moves by its move vector over one unit of time.
+
+    @return: Earliest time in [0, 1] at which the circles overlap, or None.
+
+    >>> sweep_circle_circle(((0,0), 1), (10,0), ((5,0), 1), (0,0))
+    0.3
+    >>> sweep_circle_circle(((0,0), 1), (10,0), ((5,0), 1), (10,0)) is None
+    True
+    >>> sweep_circle_circle(((0,0), 1), (10,0), ((5,3), 1), (0,0)) is None
+    True
+    >>> sweep_circle_circle(((0,0), 1), (1,0), ((1,0), 1), (0,0))
+    0.0
+    """
+    (ax, ay), ra = circle1
+    (bx, by), rb = circle2
+    wx = ax - bx
+    wy = ay - by
+    ex = move1[0] - move2[0]
+    ey = move1[1] - move2[1]
+    r = ra + rb
+    c = wx*wx + wy*wy - r*r
+    if c <= 0:
+        return 0.0
+    b = wx*ex + wy*ey
+    if b >= 0:
+        # not approaching
+        return None
+    a = ex*ex + ey*ey
+    disc = b*b - a*c
+    if disc < 0:
+        return None
+    t = (-b - math.sqrt(disc)) / a
+    if t > 1:
+        return None
+    return t
+
+
+def sweep_circle_line(circle, move, line):
+    """Find when a circle moving in a straight line first touches a line
+    segment.
+
+    @return: Earliest time in [0, 1] at which they touch, or None.
+
+    >>> sweep_circle_line(((0,0), 1), (10,0), ((5,-5), (5,5)))
+    0.4
+    >>> sweep_circle_line(((0,0), 1), (10,0), ((5,2), (5,5))) is None
+    True
+    >>> round(sweep_circle_line(((0,0), 1), (10,0), ((5,.6), (5,5))), 2)
+    0.42
+    >>> sweep_circle_line(((5,0), 1), (10,0), ((5,-5), (5,5)))
+    0.0
+    """
+    (px, py), r = circle
+    (ax, ay), (bx, by) = line
+    dx, dy = move
+    first = None
+    ux = bx - ax
+    uy = by - ay
+    length = math.sqrt(ux*ux + uy*uy)
+    if length:
+        ux /= length
+        uy /= length
+        # signed distance from the segment's line, and where along it
+        side = (px - ax)*-uy + (py - ay)*ux
+        along = (px - ax)*ux + (py - ay)*uy
+        if abs(side) <= r:
+            if 0 <= along <= length:
+                return 0.0
+        else:
+            rate = dx*-uy + dy*ux
+            if rate:
+                t = ((r if side > 0 else -r) - side) / rate
+                if 0 <= t <= 1 and 0 <= along + t*(dx*ux + dy*uy) <= length:
+                    first = t
+    for end in line:
+        t = sweep_circle_circle(circle, move, (end, 0), (0, 0))
+        if t is not None and (first is None or t < first):
+            first = t
+    return first
+
+
+def sweep_circle_poly(circle, move, poly):
+    """Find when a circle moving in a straight line first touches a polygon.
+
+    @return: Earliest time in [0, 1] at which they touch, or None.
+
+    >>> poly = ((2,-1), (4,-1), (4,1), (2,1))
+    >>> sweep_circle_poly(((0,0), .5), (10,0), poly)
+    0.15
+    >>> sweep_circle_poly(((0,0), .5), (0,10), poly) is None
+    True
+    >>> sweep_circle_poly(((3,0), .5), (10,0), poly)
+    0.0
+    """
+    if point_in_poly(circle[0], poly):
+        return 0.0
+    first = None
+    for i,point in enumerate(poly):
+        t = sweep_circle_line(circle, move, (poly[i-1], point))
+        if t is not None and (first is None or t < first):
+            first = t
+    return first
+
+
+def sweep_circle_in_rect(circle, move, rect):
+    """Find when a circle moving in a straight line first pokes out of a
+    rectangle.
+
+    @return: Earliest time in [0, 1] at which it crosses the rectangle's
+    edge, or None.
+
+    >>> sweep_circle_in_rect(((0,0), 1), (10,0), (-5,-5,10,10))
+    0.4
+    >>> sweep_circle_in_rect(((0,0), 1), (2,2), (-5,-5,10,10)) is None
+    True
+    """
+    (px, py), r = circle
+    (x, y, w, h) = rect
+    first = None
+    for pos, step, low, high in ((px, move[0], x, x + w),
+                                 (py, move[1], y, y + h)):
+        if pos - r < low or pos + r > high:
+            return 0.0
+        if step > 0:
+            t = (high - r - pos) / float(step)
+        elif step < 0:
+            t = (low + r - pos) / float(step)
+        else:
+            continue
+        if t <= 1 and (first is None or t < first):
+            first = t
+    return first
+
+
 def get_dist(point_A, point_B):
     """Calculate distance between two points.
 
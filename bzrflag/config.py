@@ -32,7 +32,9 @@ import optparse
 import ConfigParser
 import logging
 
+import replay
 import world
+import worldcache
 
 class ParseError(Exception): pass
 class ArgumentError(Exception): pass
@@ -46,7 +48,12 @@ class Config:
     """
 
     def __init__(self, args=None):
+        if args is None:
+            args = sys.argv[1:]
+        self.args = list(args)
         self.options = self.parse_cli_args(args)
+        if self.options['replay']:
+            self.setup_replay()
         self.setup_world()
 
     def get(self, key, default):
@@ -58,8 +65,33 @@ class Config:
     def __getitem__(self, key):
         return self.options[key]
 
+    def setup_replay(self):
+        """Play back a replay with the options it was recorded with.
+
+        Only the options deciding how the replay is shown are taken from
+        this command line.
+        """
+        local = self.options
+        header = replay.load_header(local['replay'])
+        self.options = self.parse_cli_args(header['argv'])
+        for key in ('replay', 'test', 'window_size', 'debug', 'debug_out',
+                    'stats', 'stats_interval', 'profile', 'profile_calls',
+                    'profile_out'):
+            self.options[key] = local[key]
+        self.options['random_seed'] = header['seed']
+        self.options['record'] = None
+        # there are no agents to wait for
+        self.options['fast_forward'] = False
+        self.replay_header = header
+
     def setup_world(self):
-        """Parse the world file"""
+        """Parse the world file
+
+        world_key identifies the world's text and size.  With
+        --world-cache, the parsed world is loaded from (or saved to) the
+        cache directory instead; world_cache and world_key are then also
+        used by the game to cache the occupancy grid.
+        """
         if not self.options['world']:
             raise ArgumentError('no world defined')
         if not os.path.isfile(self.options['world']):
@@ -67,10 +99,20 @@ class Config:
                 %self.options['world'])
         text = open(self.options['world']).read()
         size = int(self.options['world_size'])
+        self.world_cache = None
+        self.world_key = worldcache.world_key(text, size, size)
+        if self.options['world_cache']:
+            self.world_cache = worldcache.WorldCache(
+                    self.options['world_cache'])
+            self.world = self.world_cache.load_world(self.world_key)
+            if self.world is not None:
+                return
         results = world.World.parser(size, size).parseString(text)
         if not results:
             raise ParseError('invalid world file: %s'%config['world'])
         self.world = results[0]
+        if self.world_cache is not None:
+            self.world_cache.save_world(self.world_key, self.world)
 
     def parse_cli_args(self, args):
         """Parse command line arguments."""
@@ -101,6 +143,15 @@ class Config:
             dest='world_size',
             default='800',
             help='specify the world size (it is always square)')
+        p.add_option('--world-cache',
+            dest='world_cache',
+            help='directory in which to cache parsed worlds and grids')
+        p.add_option('--record',
+            dest='record',
+            help='record a replay of the game to the given file')
+        p.add_option('--replay',
+            dest='replay',
+            help='play back a recorded game (add --test to skip the display)')
         p.add_option('--config',
             dest='config',
             help='set the config file')
@@ -117,8 +168,58 @@ class Config:
             dest='no_report_obstacles',
             help='report obstacles? (turn off to force use\
                                      of the occupancy grid)')
+        p.add_option('--max-connections',
+            type='int', default=1,
+            dest='max_connections',
+            help='number of agents which may connect to each team at once')
         p.add_option('--occgrid-width', type='int',
             default=50, help='width of reported occupancy grid')
+        p.add_option('--vectorized',
+            action='store_true', default=False,
+            dest='vectorized',
+            help='advance tanks and shots in batches with NumPy arrays')
+        p.add_option('--fast-forward',
+            action='store_true', default=False,
+            dest='fast_forward',
+            help='run on simulated time, stepping as soon as every\
+                                     connected agent has sent a command')
+        p.add_option('--tick-rate',
+            type='float', default=50.0,
+            dest='tick_rate',
+            help='physics steps per simulated second')
+        p.add_option('--fps',
+            type='float', default=30.0,
+            dest='fps',
+            help='maximum frames drawn per second')
+        p.add_option('--step-timeout',
+            type='float', default=1.0,
+            dest='step_timeout',
+            help='longest wall-clock wait for agents per fast-forward step')
+        p.add_option('--min-agents',
+            type='int', default=1,
+            dest='min_agents',
+            help='in fast-forward mode, hold the clock until this many\
+                                     agents are connected')
+        p.add_option('--stats',
+            action='store_true', default=False,
+            dest='stats',
+            help='time each phase of the game loop and each command')
+        p.add_option('--stats-interval',
+            type='float', default=0,
+            dest='stats_interval',
+            help='write the timings to the debug log every this many\
+                                     seconds (implies --stats)')
+        p.add_option('--profile',
+            dest='profile',
+            help='run a phase (e.g. update, display, network or\
+                                     bzrc_occgrid) under cProfile')
+        p.add_option('--profile-calls',
+            type='int', default=500,
+            dest='profile_calls',
+            help='number of calls of the phase to profile')
+        p.add_option('--profile-out',
+            dest='profile_out',
+            help='file to save profiles to, instead of the debug log')
 
         ## tank behavior
         p.add_option('--max-shots',
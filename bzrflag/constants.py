@@ -86,11 +86,26 @@ FONTSIZE = 16
 # A higher loop timeout decreases CPU usage but also decreases the frame rate.
 LOOP_TIMEOUT = 0.01
 
+# Physics steps the scheduler may run back to back to catch up with the wall
+# clock before it drops the backlog.
+MAX_CATCHUP_STEPS = 10
+
 # Server
-BACKLOG = 5
+BACKLOG = 128
+# Bytes of unsent responses at which the server stops reading a client's
+# commands.
+MAX_PENDING_OUTPUT = 1 << 20
 
 # Game
 RESPAWNTRIES = 1000
 
+# Collision broadphase: side length of a spatial hash cell, in world units.
+# Should be a few tank diameters; smaller cells mean fewer narrowphase tests
+# but more re-bucketing as objects move.
+GRIDCELLSIZE = 32
+# Finer cells used by the --vectorized backend to find tanks and shots with a
+# clear path.  A tank (plus one tick of travel) must fit within two cells.
+CLEARCELLSIZE = 16
+
 
 
@@ -30,16 +30,22 @@ __copyright__ = "Copyright 2008-2011 Brigham Young University"
 __license__ = "GNU GPL"
 
 import math
+import time
 import random
-import datetime
 import logging
-import asyncore
+import contextlib
+
+import numpy
 
 import collisiontest
 import constants
 import config
 import graphics
+import replay
 import server
+import spatialhash
+import stats
+import vectorized
 
 logger = logging.getLogger('game')
 
@@ -51,32 +57,173 @@ class GameLoop:
         self.config = config
         if self.config['random_seed'] != -1:
             random.seed(self.config['random_seed'])
+            numpy.random.seed(self.config['random_seed'])
         self.game = Game(self, self.config)
         if not self.config['test']:
             self.display = graphics.Display(self, self.config)
         self.running = False
         self.gameover = False
-        self.timestamp = datetime.datetime.utcnow()
         self.messages = []
+        self.servers = []
+        # responses to read-only queries, shared by every team's server
+        self.responses = server.ResponseCache(self.game)
+        self.clock_started = False
+        self.stats = None
+        if self.config['stats'] or self.config['stats_interval']:
+            self.stats = stats.Stats(interval=self.config['stats_interval'],
+                                     profile_out=self.config['profile_out'])
+            if self.config['profile']:
+                self.stats.profile(self.config['profile'],
+                                   self.config['profile_calls'])
+        # fixed-rate scheduler state (see run_physics)
+        self.clock = time.time()
+        self.accumulator = 0.0
+        self.next_frame = self.clock
+
+        self.recorder = None
+        if self.config['record']:
+            self.recorder = replay.Recorder(self.config['record'],
+                    self.config.args, self.game.seed, self.game.teams.keys(),
+                    self.config.world_key)
+            self.game.recorder = self.recorder
+        self.player = None
+        if self.config['replay']:
+            reader = replay.Reader(self.config['replay'])
+            if reader.header['world_key'] != self.config.world_key:
+                logger.warning('the world has changed since the replay '
+                               'was recorded')
+            self.player = replay.Player(reader, self.game)
 
     def start_servers(self):
-        """Start servers for each team. """
+        """Start servers for each team.
+
+        Ports given as 0 are allocated by the OS; read them back from
+        the servers afterwards.
+        """
         for color, team in self.game.teams.items():
             port = self.config[color + '_port']
             address = ('0.0.0.0', port)
-            srv = server.Server(address, team, self.game, self.config)
+            srv = server.Server(address, team, self.game, self.config,
+                                cache=self.responses, stats=self.stats)
+            self.servers.append(srv)
             if not self.config['test']:
                 print 'port for %s: %s' % (color, srv.get_port())
 
-    def update_game(self):
-        """Updates the game world."""
-        now = datetime.datetime.utcnow()
-        delta = now - self.timestamp
-        self.timestamp = now
-        dt = ((24 * 60 * 60) * delta.days
-               + delta.seconds
-               + (10 ** -6) * delta.microseconds)
-        self.game.update(dt)
+    def stop_servers(self):
+        """Close the team servers and any connected agents."""
+        for srv in self.servers:
+            for handler in srv.handlers[:]:
+                handler.close()
+            srv.close()
+        self.servers = []
+
+    def scores(self):
+        """Return a dict mapping each team color to its total score."""
+        return dict((color, team.score.total())
+                    for color, team in self.game.teams.items())
+
+    def agents(self):
+        """Return the handlers of all agents which have completed the
+        handshake."""
+        return [handler for srv in self.servers for handler in srv.handlers
+                if handler.established]
+
+    def wait_for_agents(self):
+        """Service the network until every agent has had its turn.
+
+        Used in fast-forward mode: returns once each connected agent has
+        sent a command since the last step, or once step_timeout seconds
+        have passed without that happening (so a stalled agent cannot hold
+        up the game forever).  Before the first step, the clock is held
+        until at least min_agents agents are connected.
+        """
+        deadline = time.time() + self.config['step_timeout']
+        agents = []
+        while self.running:
+            server.poll()
+            agents = self.agents()
+            if not self.clock_started:
+                if len(agents) < self.config['min_agents']:
+                    deadline = time.time() + self.config['step_timeout']
+                else:
+                    self.clock_started = True
+            if self.clock_started:
+                if all(agent.requests for agent in agents):
+                    break
+                if time.time() > deadline:
+                    logger.debug('step timeout waiting for agents')
+                    break
+            server.poll(constants.LOOP_TIMEOUT)
+        for agent in agents:
+            agent.requests = 0
+
+    def step(self):
+        """Advance the game by one fixed fast-forward timestep."""
+        self.wait_for_agents()
+        self.physics_step(1.0 / self.config['tick_rate'])
+
+    def run_physics(self):
+        """Advance the game in fixed steps until it has caught up with the
+        wall clock.
+
+        Every step is 1/tick_rate seconds long however slowly the loop
+        runs, so a slow frame means more steps rather than a larger dt.  The
+        network is serviced between steps.  If the game falls more than
+        MAX_CATCHUP_STEPS behind, the backlog is dropped and the game runs
+        slower than real time rather than falling further behind.
+        """
+        dt = 1.0 / self.config['tick_rate']
+        now = time.time()
+        self.accumulator += now - self.clock
+        self.clock = now
+        steps = 0
+        while self.accumulator >= dt and not self.game.end_game:
+            if steps == constants.MAX_CATCHUP_STEPS:
+                logger.debug('physics fell behind, dropping %.3fs'
+                             % self.accumulator)
+                self.accumulator = 0.0
+                break
+            if steps:
+                server.poll()
+            self.physics_step(dt)
+            self.accumulator -= dt
+            steps += 1
+
+    def physics_step(self, dt):
+        """Take one physics step, or the next step of the replay."""
+        if self.player is not None:
+            step, args = self.player.step, ()
+        else:
+            step, args = self.game.update, (dt,)
+        if self.stats is None:
+            step(*args)
+        else:
+            self.stats.call('update', step, *args)
+        self.publish()
+
+    def publish(self):
+        """Push state frames to the agents which subscribed to them."""
+        for srv in self.servers:
+            for handler in srv.handlers:
+                if handler.subscription is not None:
+                    handler.publish()
+
+    def time_to_next_event(self):
+        """Return the seconds until the next physics step or frame."""
+        now = time.time()
+        wait = (1.0 / self.config['tick_rate'] - self.accumulator
+                - (now - self.clock))
+        if not self.config['test']:
+            wait = min(wait, self.next_frame - now)
+        return max(0.0, wait)
+
+    def frame_due(self):
+        """Return True (and schedule the next frame) if a frame is due."""
+        now = time.time()
+        if now < self.next_frame:
+            return False
+        self.next_frame = now + 1.0 / self.config['fps']
+        return True
 
     def update_graphics(self):
         """Updates graphics based on recent changes to game state.
@@ -86,38 +233,63 @@ class GameLoop:
         while len(self.game.inbox) > 0:
             self.display.add_object(self.game.inbox.pop())
         while len(self.game.trash) > 0:
-            self.display.remove_object(self.game.trash.pop())
+            shot = self.game.trash.pop()
+            self.display.remove_object(shot)
+            self.game.shot_pool.release(shot)
 
         # Write any pending messages to the console.
         for message in self.messages:
             self.display.console.write(message)
         self.messages = []
 
+    def draw(self):
+        """Bring the display up to date and draw a frame."""
+        self.update_graphics()
+        self.display.update()
+
     def loop(self):
         """The main loop of bzrflag.
 
         Checks events, updates positions, and draws to the screen until
         the pygame window is closed, KeyboardInterrupt, or System Exit.
+        Physics runs at tick_rate steps per second, the network is serviced
+        whenever it is ready, and frames are drawn at up to fps per second.
         """
         self.running = True
-        self.start_servers()
+        if not self.servers and self.player is None:
+            self.start_servers()
         if not self.config['test']:
             self.display.setup()
+        self.clock = self.next_frame = time.time()
         try:
             while self.running:
                 if self.game.end_game:
                     break
-                asyncore.loop(constants.LOOP_TIMEOUT, count=1)
-                self.update_game()
-                if not self.config['test']:
-                    self.update_graphics()
-                    self.display.update()
+                if self.player is not None and self.config['test']:
+                    # headless playback runs flat out
+                    self.physics_step(None)
+                elif self.player is not None:
+                    time.sleep(self.time_to_next_event())
+                    self.run_physics()
+                elif self.config['fast_forward']:
+                    self.step()
+                else:
+                    server.poll(self.time_to_next_event())
+                    self.run_physics()
+                if not self.config['test'] and self.frame_due():
+                    if self.stats is None:
+                        self.draw()
+                    else:
+                        self.stats.call('display', self.draw)
+                if self.stats is not None:
+                    self.stats.tick()
         except KeyboardInterrupt:
             pass
         finally:
+            if self.recorder is not None:
+                self.recorder.close()
             final_scores = '\nFinal Score\n'
-            for team in self.game.teams:
-                team_total = self.game.teams[team].score.total()
+            for team, team_total in self.scores().items():
                 final_scores += 'Team %s: %d\n' % (team, team_total)
             if not self.config['test']:
                 print final_scores
@@ -142,7 +314,22 @@ class Game(object):
         # queue of objects that need to be created or destroyed
         self.inbox = []
         self.trash = []
+        # dead shots waiting to be fired again
+        self.shot_pool = ShotPool(self.new_shot)
+
+        # The game draws from its own generator, so that sensor noise in
+        # the servers' responses cannot change how a match plays out.
+        self.seed = self.config['random_seed']
+        if self.seed == -1:
+            self.seed = random.randrange(1 << 31)
+        self.random = random.Random(self.seed)
+        # replay.Recorder, if the game is being recorded
+        self.recorder = None
+        # bumped by restore(), as the same tick may then be played twice
+        self.epoch = 0
         self.timespent = 0.0
+        # number of completed simulation steps
+        self.tick = 0
         self.timelimit = self.config['time_limit']
         self.inertia_linear = 1
         self.inertia_angular = 1
@@ -150,14 +337,42 @@ class Game(object):
         self.taunt_msg = None
         self.taunt_color = None
 
+        # struct-of-arrays state for the vectorized backend
+        self.arrays = None
+        if self.config['vectorized']:
+            ntanks = sum(team_size(self.config, item.color)
+                         for item in self.config.world.bases)
+            self.arrays = vectorized.EntityArrays(ntanks,
+                    ntanks * self.config['max_shots'])
+
         # track objects on map
         self.obstacles = [Box(i) for i in self.config.world.boxes]
-        self.build_truegrid()
+        self.load_truegrid()
+
+        # broadphase grids: obstacles are bucketed once, tanks and shots are
+        # re-bucketed as they move.
+        self.obstacle_grid = spatialhash.SpatialHash(constants.GRIDCELLSIZE)
+        for o in self.obstacles:
+            self.obstacle_grid.insert_poly(o, o.shape)
+        self.tank_grid = spatialhash.SpatialHash(constants.GRIDCELLSIZE)
+        self.shot_grid = spatialhash.SpatialHash(constants.GRIDCELLSIZE)
+        if self.arrays is not None:
+            half_size = (self.config.world.size[0]/2,
+                         self.config.world.size[1]/2)
+            self.arrays.setup_broadphase(constants.CLEARCELLSIZE, half_size,
+                                         [o.shape for o in self.obstacles],
+                                         constants.GRIDCELLSIZE)
         self.bases = dict((i.color, Base(i)) for i in self.config.world.bases)
 
         self.teams = {}
         for color,base in self.bases.items():
             self.teams[color] = Team(self, color, base, self.config)
+        if self.arrays is not None:
+            for team in self.teams.values():
+                for tank in team.tanks:
+                    self.arrays.tank_zone[tank.slot] = (team.base.center[0],
+                            team.base.center[1],
+                            team.tanks_radius + constants.TANKRADIUS)
 
     def update(self, dt):
         """Update the teams."""
@@ -166,38 +381,143 @@ class Game(object):
             self.taunt_timer -= dt
             if self.taunt_timer <= 0:
                 self.taunt_msg = None
-                self.game_loop.display.redraw()
+                if not self.config['test']:
+                    self.game_loop.display.redraw()
         if self.timespent > self.config['time_limit']:
             self.end_game = True
             return
+        if self.recorder is not None:
+            self.recorder.tick(dt)
+        if self.arrays is not None:
+            tanks, shots = self.arrays.step(dt,
+                    [team.flag.pos for team in self.teams.values()])
+            for tank in tanks:
+                self.move_tank(tank)
+            for shot in shots:
+                self.move_shot(shot)
         for team in self.teams.values():
             team.update(dt)
+        self.tick += 1
+
+    def snapshot(self):
+        """Capture the state of the game, to be put back by restore().
+
+        Lets agents running in the same process try out "what if" futures
+        against the real engine rather than a copy of its physics:
+
+            state = game.snapshot()
+            team.speed(0, 1)
+            game.update(0.1)
+            ... look at the result ...
+            game.restore(state)
+
+        A snapshot is made of tuples of the entities' values (and NumPy
+        copies of the vectorized arrays) alongside references to the
+        entities themselves, so it is cheap to take, never changes, and can
+        be restored any number of times.
+        """
+        teams = [(team, team.flag.snapshot(), team.score.snapshot(),
+                  [tank.snapshot() for tank in team.tanks])
+                 for team in self.teams.values()]
+        shots = [(shot, shot.snapshot()) for shot in self.shots()]
+        arrays = None
+        if self.arrays is not None:
+            arrays = self.arrays.snapshot()
+        return (self.timespent, self.tick, self.end_game, self.taunt_msg,
+                self.taunt_timer, self.taunt_color, self.random.getstate(),
+                teams, shots, arrays, self.tank_grid.snapshot(),
+                self.shot_grid.snapshot())
+
+    def restore(self, state):
+        """Put the game back to a snapshot."""
+        (self.timespent, self.tick, self.end_game, self.taunt_msg,
+         self.taunt_timer, self.taunt_color, rng, teams, shots, arrays,
+         tank_grid, shot_grid) = state
+        live = set(shot for shot, shot_state in shots)
+        for shot in list(self.shots()):
+            if shot not in live:
+                shot.discard()
+        if arrays is not None:
+            self.arrays.restore(arrays)
+        self.random.setstate(rng)
+        for team, flag, score, tanks in teams:
+            for tank, tank_state in zip(team.tanks, tanks):
+                tank.restore(tank_state)
+            team.flag.restore(flag)
+            team.score.restore(score)
+        for shot, shot_state in shots:
+            shot.restore(shot_state)
+        self.tank_grid.restore(tank_grid)
+        self.shot_grid.restore(shot_grid)
+        # shots which died since the snapshot are alive again; those the
+        # display already took out of the trash need their sprites back
+        pool = self.shot_pool
+        if not self.config['test']:
+            self.inbox.extend(shot for shot in pool.free if shot in live)
+        pool.free = [shot for shot in pool.free if shot not in live]
+        self.trash[:] = [shot for shot in self.trash if shot not in live]
+        self.epoch += 1
+
+    @contextlib.contextmanager
+    def rollout(self):
+        """Context in which the game may be played forward, and is then
+        restored.  Nothing done inside it is recorded."""
+        state = self.snapshot()
+        recorder = self.recorder
+        self.recorder = None
+        try:
+            yield self
+        finally:
+            self.recorder = recorder
+            self.restore(state)
+
+    def make_tank(self, team, tankid):
+        """Create a tank for the given team."""
+        if self.arrays is not None:
+            return ArrayTank(team, tankid, self.config, self.arrays)
+        return Tank(team, tankid, self.config)
+
+    def make_shot(self, tank):
+        """Fire a shot from the given tank, reusing a dead one if possible."""
+        return self.shot_pool.acquire(tank)
+
+    def new_shot(self, tank):
+        """Allocate a shot fired by the given tank."""
+        if self.arrays is not None:
+            return ArrayShot(tank, self.config, self.arrays)
+        return Shot(tank, self.config)
+
+    def load_truegrid(self):
+        """Load the occupancy grid from the world cache, or build it (and
+        save it there) if it is not cached."""
+        cache = self.config.world_cache
+        if cache is not None:
+            self.occgrid = cache.load_grid(self.config.world_key)
+            if self.occgrid is not None:
+                return
+        self.build_truegrid()
+        if cache is not None:
+            cache.save_grid(self.config.world_key, self.occgrid)
 
     def build_truegrid(self):
         """Builds occupancy grid with obstacles in self.obstacles.
 
-        Note: Occupancy grids with rotated obstalces not implemnted.
+        The grid is a uint8 array indexed [x][y], with 1 marking occupied
+        cells.  Rotated obstacles fill every cell whose center they cover.
         """
-        self.occgrid = [[0 for i in range(self.config.world.width)] 
-                           for j in range(self.config.world.height)]
+        self.occgrid = numpy.zeros((self.config.world.width,
+                                    self.config.world.height), numpy.uint8)
         offset_x = self.config.world.width/2
         offset_y = self.config.world.height/2
         for o in self.obstacles:
             if o.rot == 0:
                 lx = (o.pos[0] - o.size[0]/2, o.pos[1] - o.size[1]/2)
-                for x in xrange(o.size[0]):
-                    for y in xrange(o.size[1]):
-                        self.occgrid[x+lx[0]+offset_x][y+lx[1]+offset_y] = 1
+                x = max(0, int(lx[0] + offset_x))
+                y = max(0, int(lx[1] + offset_y))
+                self.occgrid[x:int(lx[0] + offset_x + o.size[0]),
+                             y:int(lx[1] + offset_y + o.size[1])] = 1
             else:
-                # We didn't have enough time to implement occupancy grids with
-                # rotated obstalces; we figured it was low priority anyway
-                # because it would be really difficult for students to deal
-                # with.  If someone implements it sometime, great.  Until then,
-                # this is our workaround - the server returns a fail on a
-                # request for the occupancy grid if there are rotated
-                # obstacles.
-                self.occgrid = None
-                break
+                fill_poly(self.occgrid, o.shape, (offset_x, offset_y))
 
     def obstacle_at(self, x, y):
         """Checks for obstacle at given point."""
@@ -220,6 +540,42 @@ class Game(object):
             for shot in tank.shots:
                 yield shot
 
+    def obstacles_near(self, pos, radius):
+        """Return obstacles which may overlap the given circle."""
+        return self.obstacle_grid.query(pos, radius)
+
+    def tanks_near(self, pos, radius):
+        """Return tanks which may overlap the given circle."""
+        return self.tank_grid.query(pos, radius)
+
+    def shots_near(self, pos, radius):
+        """Return shots which may overlap the given circle."""
+        return self.shot_grid.query(pos, radius)
+
+    def move_tank(self, tank):
+        """Re-bucket a tank after its position changed."""
+        if in_deadzone(tank.pos):
+            self.tank_grid.remove(tank)
+        else:
+            self.tank_grid.move(tank, tank.pos, constants.TANKRADIUS)
+
+    def move_shot(self, shot):
+        """Re-bucket a shot after its position changed."""
+        self.shot_grid.move(shot, shot.pos, constants.SHOTRADIUS)
+
+    def remove_shot(self, shot):
+        """Remove a dead shot from the broadphase and retire it.
+
+        The display still has to remove the shot's sprite, so it goes back
+        to the pool once it has been taken out of the trash; without a
+        display it goes back straight away.
+        """
+        self.shot_grid.remove(shot)
+        if self.config['test']:
+            self.shot_pool.release(shot)
+        else:
+            self.trash.append(shot)
+
     def dropFlag(self, flag):
         """Sets flag to None."""
         if flag.tank is not None:
@@ -269,11 +625,9 @@ class Team(object):
         self.config = config
         self.color = color
         self.map = map
-        ntanks = self.config[self.color+'_tanks']
-        if ntanks is None:
-            ntanks = self.config['default_tanks']
+        ntanks = team_size(self.config, self.color)
 
-        self.tanks = [Tank(self, i, self.config) for i in xrange(ntanks)]
+        self.tanks = [map.make_tank(self, i) for i in xrange(ntanks)]
         self.tanks_radius = constants.TANKRADIUS * ntanks * 3/2.0
         self.base = base
         base.team = self
@@ -311,10 +665,10 @@ class Team(object):
 
         tank.status = constants.TANKALIVE
         tank.reset_speed()
-        if tank.pos != constants.DEADZONE:
+        if not in_deadzone(tank.pos):
             return
 
-        tank.rot = random.uniform(0, 2*math.pi)
+        tank.rot = self.map.random.uniform(0, 2*math.pi)
         pos = self.spawn_position()
         for i in xrange(constants.RESPAWNTRIES):
             if self.check_position(pos, constants.TANKRADIUS):
@@ -324,17 +678,18 @@ class Team(object):
             raise Exception("No workable spawning spots found for team %s"
                             %self.color)
         tank.pos = pos
+        self.map.move_tank(tank)
 
     def check_position(self, pos, rad):
         """Check a position to see if it is safe to spawn a tank there."""
         for o in self._obstacles:
             if collisiontest.circle_to_poly((pos,rad), o.shape):
                 return False
-        for s in self.map.shots():
+        for s in self.map.shots_near(pos, rad):
             shot = (s.pos, constants.SHOTRADIUS)
             if collisiontest.circle_to_circle((pos,rad), shot):
                 return False
-        for t in self.map.tanks():
+        for t in self.map.tanks_near(pos, rad):
             tank = (t.pos, constants.TANKRADIUS)
             if collisiontest.circle_to_circle((pos,rad), tank):
                 return False
@@ -348,8 +703,8 @@ class Team(object):
 
     def spawn_position(self):
         """Generate a random spawning position around the base."""
-        angle = random.uniform(0, 2*math.pi)
-        dist = random.uniform(0,1) * self.tanks_radius
+        angle = self.map.random.uniform(0, 2*math.pi)
+        dist = self.map.random.uniform(0,1) * self.tanks_radius
         return [self.base.center[0] + dist*math.cos(angle),
                 self.base.center[1] + dist*math.sin(angle)]
 
@@ -368,7 +723,10 @@ class Team(object):
 
     def shoot(self, tankid):
         """Tell a tank to shoot."""
-        return self.tank(tankid).shoot()
+        tank = self.tank(tankid)
+        if self.map.recorder is not None:
+            self.map.recorder.command(self.color, 'shoot', tankid)
+        return tank.shoot()
 
     def speed(self, tankid, value):
         """Set a tank's goal speed."""
@@ -378,7 +736,10 @@ class Team(object):
             value = -1
         if not (1 >= value >= -1):
             raise Exception("not a number")
-        self.tank(tankid).setspeed(value)
+        tank = self.tank(tankid)
+        if self.map.recorder is not None:
+            self.map.recorder.command(self.color, 'speed', tankid, value)
+        tank.setspeed(value)
 
     def angvel(self, tankid, value):
         """Set a tank's goal angular velocity."""
@@ -388,9 +749,14 @@ class Team(object):
             value = -1
         if not (1 >= value >= -1):
             raise Exception("not a number")
-        self.tank(tankid).setangvel(value)
+        tank = self.tank(tankid)
+        if self.map.recorder is not None:
+            self.map.recorder.command(self.color, 'angvel', tankid, value)
+        tank.setangvel(value)
 
     def taunt(self, message):
+        if self.map.recorder is not None:
+            self.map.recorder.taunt(self.color, message)
         return self.map.taunt(message, self.color)
 
 
@@ -402,6 +768,11 @@ class Tank(object):
     Attributes:
         rot: angular rotation in radians; always between 0 and 2*pi
     """
+    __slots__ = ('config', 'team', 'pos', 'goal_speed', 'goal_angvel',
+                 'speed', 'angvel', 'rot', 'callsign', 'status', 'shots',
+                 'reloadtimer', 'dead_timer', 'flag', 'spawned', 'last_pos',
+                 'moved_tick')
+
     size = (constants.TANKRADIUS*2,) * 2
     radius = constants.TANKRADIUS
 
@@ -421,6 +792,8 @@ class Tank(object):
         self.dead_timer = -1
         self.flag = None
         self.spawned = False
+        self.last_pos = None
+        self.moved_tick = None
 
     def reset_speed(self):
         """Reset rot, speed and angvel to zero."""
@@ -430,6 +803,20 @@ class Tank(object):
         self.angvel = 0
         self.rot = 0
 
+    def snapshot(self):
+        """Return the tank's state (see Game.snapshot)."""
+        return (tuple(self.pos), self.goal_speed, self.goal_angvel,
+                self.speed, self.angvel, self.rot, self.status,
+                self.reloadtimer, self.dead_timer, self.flag, self.spawned,
+                self.last_pos, self.moved_tick, tuple(self.shots))
+
+    def restore(self, state):
+        (pos, self.goal_speed, self.goal_angvel, self.speed, self.angvel,
+         self.rot, self.status, self.reloadtimer, self.dead_timer, self.flag,
+         self.spawned, self.last_pos, self.moved_tick, shots) = state
+        self.pos = list(pos)
+        self.shots = list(shots)
+
     def setspeed(self, speed):
         """Set the goal speed."""
         self.goal_speed = speed
@@ -443,32 +830,40 @@ class Tank(object):
         if self.reloadtimer > 0 or \
                 len(self.shots) >= self.config['max_shots']:
             return False
-        shot = Shot(self, self.config)
-        self.shots.insert(0, shot)
-        self.team.map.inbox.append(shot)
+        shot = self.team.map.make_shot(self)
+        shot.index = len(self.shots)
+        self.shots.append(shot)
+        if not self.config['test']:
+            self.team.map.inbox.append(shot)
         self.reloadtimer = constants.RELOADTIME
         return True
 
     def kill(self):
         """Kill tank."""
         self.status = constants.TANKDEAD
+        if self.flag:
+            # the flag stays where the tank died
+            self.flag.pos = [self.pos[0], self.pos[1]]
         self.pos = constants.DEADZONE
+        self.team.map.move_tank(self)
         self.dead_timer = self.config['respawn_time']
         self.team.score.score_tank(self)
         if self.flag:
             self.team.map.dropFlag(self.flag)
             self.flag = None
-        for shot in self.shots:
+        # Shot.kill takes each live shot out of the list; a dead one (which
+        # should not be there) would stay, so iterate over a copy.
+        for shot in reversed(self.shots[:]):
             shot.kill()
-        self.shots = []
+        del self.shots[:]
 
     def collision_at(self, pos):
         """Return True if collision at given position, and False otherwise."""
         rad = constants.TANKRADIUS
-        for obs in self.team.map.obstacles:
+        for obs in self.team.map.obstacles_near(pos, rad):
             if collisiontest.circle_to_poly(((pos),rad), obs.shape):
                 return True
-        for tank in self.team.map.tanks():
+        for tank in self.team.map.tanks_near(pos, rad):
             if tank is self:
                 continue
             if collisiontest.circle_to_circle((tank.pos, rad), (pos, rad)):
@@ -488,12 +883,13 @@ class Tank(object):
 
     def update(self, dt):
         """Update the tank's position, status, velocities."""
-        for shot in self.shots:
-            shot.update(dt)
+        # newest first; a shot dying only moves an already updated one
+        shots = self.shots
+        for i in xrange(len(shots) - 1, -1, -1):
+            shots[i].update(dt)
 
-        if self.reloadtimer > 0:
-            self.reloadtimer -= dt
-        if (self.pos == constants.DEADZONE and
+        self.update_reload(dt)
+        if (in_deadzone(self.pos) and
             self.status != constants.TANKDEAD):
             self.team.respawn(self)
         if self.status == constants.TANKDEAD:
@@ -504,7 +900,15 @@ class Tank(object):
             return
 
         self.update_goals(dt)
+        self.move(dt)
+
+    def move(self, dt):
+        """Drive, sliding along whatever the tank bumps into."""
         dx,dy = self.velocity()
+        if not dx and not dy:
+            return
+        self.last_pos = (self.pos[0], self.pos[1])
+        self.moved_tick = self.team.map.tick
         if not self.collision_at((self.pos[0]+dx*dt,
                                   self.pos[1]+dy*dt)):
             self.pos[0] += dx*dt
@@ -513,6 +917,26 @@ class Tank(object):
             self.pos[1] += dy*dt
         elif not self.collision_at((self.pos[0]+dx*dt, self.pos[1])):
             self.pos[0] += dx*dt
+        else:
+            return
+        self.team.map.move_tank(self)
+
+    def path(self, dt):
+        """Return where the tank starts this tick and how far it travels.
+
+        Tanks which have already moved this tick report the move they made;
+        the others are assumed to carry on at their current velocity.
+        """
+        if self.moved_tick == self.team.map.tick:
+            x, y = self.last_pos
+            return self.last_pos, (self.pos[0] - x, self.pos[1] - y)
+        dx, dy = self.velocity()
+        return (self.pos[0], self.pos[1]), (dx*dt, dy*dt)
+
+    def update_reload(self, dt):
+        """Count down the reload timer."""
+        if self.reloadtimer > 0:
+            self.reloadtimer -= dt
 
     def update_goal(self, num, goal, by):
         """Update given num by given amount until equal to given goal."""
@@ -551,87 +975,340 @@ class Shot(object):
     Contains the logic for a shot on the map.
     """
 
+    __slots__ = ('config', 'tank', 'team', 'rot', 'distance', 'pos', 'vel',
+                 'status', 'index')
+
     size = (constants.SHOTRADIUS*2,) * 2
 
     def __init__(self, tank, config):
         self.config = config
+        self.fire(tank)
+
+    def fire(self, tank):
+        """(Re)start the shot from the given tank.
+
+        Called for new shots and for dead ones taken from the ShotPool.
+        """
         self.tank = tank
+        self.index = None
         self.team = tank.team
         self.rot = self.tank.rot
         self.distance = 0
-        self.pos = tank.pos[:]
+        self.pos = [tank.pos[0], tank.pos[1]]
         speed = constants.SHOTSPEED + tank.speed
         self.vel = (speed * math.cos(self.rot), speed * math.sin(self.rot))
         self.status = constants.SHOTALIVE
+        self.team.map.move_shot(self)
 
     def update(self, dt):
         """Move the shot."""
         if (self.status == constants.SHOTDEAD or
-            self.pos == constants.DEADZONE):
+            in_deadzone(self.pos)):
             return
-        self.distance += math.hypot(self.vel[0]*dt, self.vel[1]*dt)
-
-        ## do we need to lerp?
-        if self.vel[0]*dt > constants.TANKRADIUS*2:
-                p1 = self.pos[:]
-                p2 = [self.pos[0]+self.vel[0]*dt, self.pos[1]+self.vel[1]*dt]
-                self.check_line(p1,p2)
-        else:
-            self.pos[0] += self.vel[0]*dt
-            self.pos[1] += self.vel[1]*dt
-            self.check_collisions()
-        if self.distance > constants.SHOTRANGE:
+        dx, dy = self.advance(dt)
+        self.sweep(dx, dy, dt)
+        if (self.status == constants.SHOTALIVE and
+            self.distance > constants.SHOTRANGE):
             self.kill()
-
-    def check_collisions(self):
-        """Check for collisions."""
+        if self.status == constants.SHOTALIVE:
+            self.team.map.move_shot(self)
+
+    def advance(self, dt):
+        """Add this tick's travel to distance and return the displacement."""
+        dx = self.vel[0]*dt
+        dy = self.vel[1]*dt
+        self.distance += math.hypot(dx, dy)
+        return dx, dy
+
+    def sweep(self, dx, dy, dt):
+        """Move the shot by (dx, dy), stopping at the first thing it hits.
+
+        The shot's circle is swept along its whole path against the
+        obstacles, the walls and the tanks (themselves moving over the same
+        tick), so fast shots cannot tunnel through anything thin.
+        """
         s_rad = constants.SHOTRADIUS
         t_rad = constants.TANKRADIUS
-        for obs in self.team.map.obstacles:
-            if collisiontest.circle_to_poly(((self.pos),s_rad), obs.shape):
-                return self.kill()
-        for tank in self.team.map.tanks():
-            if self in tank.shots:
+        pos = (self.pos[0], self.pos[1])
+        end = (pos[0] + dx, pos[1] + dy)
+        move = (dx, dy)
+        circle = (pos, s_rad)
+        first = None
+        victim = None
+        map = self.team.map
+        for obs in map.obstacle_grid.query_line(pos, end, s_rad):
+            t = collisiontest.sweep_circle_poly(circle, move, obs.shape)
+            if t is not None and (first is None or t < first):
+                first = t
+        w, h = self.config.world.size
+        t = collisiontest.sweep_circle_in_rect(circle, move,
+                                               (-w/2, -h/2, w, h))
+        if t is not None and (first is None or t < first):
+            first = t
+        reach = s_rad + constants.TANKSPEED*dt
+        for tank in map.tank_grid.query_line(pos, end, reach):
+            if tank is self.tank or in_deadzone(tank.pos):
                 continue
-            if collisiontest.circle_to_circle((tank.pos, t_rad),
-                                              (self.pos, s_rad)):
-                if tank.team == self.team and not self.config['friendly_fire']:
-                    continue
-                tank.kill()
-                return self.kill()
-        at_left_wall = self.pos[0]-s_rad < -self.config.world.size[0]/2
-        at_bottem_wall = self.pos[1]-s_rad < -self.config.world.size[1]/2
-        at_right_wall = self.pos[0]+s_rad > self.config.world.size[0]/2
-        at_top_wall = self.pos[1]+s_rad > self.config.world.size[1]/2
-        if at_left_wall or at_bottem_wall or at_right_wall or at_top_wall:
-            return self.kill()
-
-    def check_line(self, p1, p2):
-        """Check for collisions."""
-        s_rad = constants.SHOTRADIUS
-        t_rad = constants.TANKRADIUS
-        for obs in self.team.map.obstacles:
-            if collisiontest.line_cross_rect((p1,p2), obs.rect):
-                return self.kill()
-        for tank in self.team.map.tanks():
-            if collisiontest.line_cross_circle((p1,p2), (tank.pos, t_rad + s_rad)):
-                if tank.team == self.team and not self.config['friendly_fire']:
-                    continue
-                tank.kill()
-                return self.kill()
-        at_left_wall = self.pos[0]-s_rad < -self.config.world.size[0]/2
-        at_bottem_wall = self.pos[1]-s_rad < -self.config.world.size[1]/2
-        at_right_wall = self.pos[0]+s_rad > self.config.world.size[0]/2
-        at_top_wall = self.pos[1]+s_rad > self.config.world.size[1]/2
-        if at_left_wall or at_bottem_wall or at_right_wall or at_top_wall:
-            return self.kill()
+            if tank.team == self.team and not self.config['friendly_fire']:
+                continue
+            start, travel = tank.path(dt)
+            t = collisiontest.sweep_circle_circle(circle, move,
+                                                  (start, t_rad), travel)
+            if t is not None and (first is None or t < first):
+                first = t
+                victim = tank
+        if first is None:
+            self.pos[0] += dx
+            self.pos[1] += dy
+            return
+        self.pos[0] += dx*first
+        self.pos[1] += dy*first
+        if victim is not None:
+            victim.kill()
+        self.kill()
+
+    def snapshot(self):
+        """Return the shot's state (see Game.snapshot)."""
+        return (self.tank, self.team, self.rot, self.distance,
+                tuple(self.pos), self.vel, self.status, self.index)
+
+    def restore(self, state):
+        (self.tank, self.team, self.rot, self.distance, pos, self.vel,
+         self.status, self.index) = state
+        self.pos = list(pos)
+
+    def discard(self):
+        """Drop a shot which is not part of the game being restored."""
+        self.status = constants.SHOTDEAD
+        self.index = None
+        self.team.map.remove_shot(self)
 
     def kill(self):
-        """Remove the shot from the map."""
+        """Remove the shot from the map and from its tank's shots."""
+        if self.status == constants.SHOTDEAD:
+            return
         self.status = constants.SHOTDEAD
-        self.tank.team.map.trash.append(self)
-        if self in self.tank.shots:
-            self.tank.shots.remove(self)
+        # swap the tank's last shot into this one's place
+        shots = self.tank.shots
+        last = shots.pop()
+        if last is not self:
+            shots[self.index] = last
+            last.index = self.index
+        self.index = None
+        self.team.map.remove_shot(self)
+
+
+class ShotPool(object):
+    """Free list of dead shots.
+
+    Shots live for a few seconds at most, so rather than allocating a new
+    one for every trigger pull, dead shots are kept here and fired again.
+    """
+
+    def __init__(self, new_shot):
+        self.new_shot = new_shot
+        self.free = []
+
+    def __len__(self):
+        return len(self.free)
+
+    def acquire(self, tank):
+        """Return a live shot fired by the given tank."""
+        if self.free:
+            shot = self.free.pop()
+            shot.fire(tank)
+            return shot
+        return self.new_shot(tank)
+
+    def release(self, shot):
+        """Keep a dead shot for reuse."""
+        self.free.append(shot)
+
+
+def array_property(name):
+    """Property reading and writing one element of an EntityArrays field."""
+    def fget(self):
+        return getattr(self.arrays, name)[self.slot]
+    def fset(self, value):
+        getattr(self.arrays, name)[self.slot] = value
+    return property(fget, fset)
+
+
+def shot_property(name, detached):
+    """Like array_property, falling back to an attribute once detached."""
+    def fget(self):
+        if self.slot is None:
+            return getattr(self, detached)
+        return getattr(self.arrays, name)[self.slot]
+    def fset(self, value):
+        if self.slot is None:
+            setattr(self, detached, value)
+        else:
+            getattr(self.arrays, name)[self.slot] = value
+    return property(fget, fset)
+
+
+class ArrayTank(Tank):
+    """Tank whose physical state is a row of the vectorized EntityArrays.
+
+    Goals, rotation and velocity are advanced for every tank at once by
+    EntityArrays.step, so update_goals and update_reload are no-ops here.
+    Tanks the step has already moved only update their shots.
+    """
+
+    __slots__ = ('arrays', 'slot')
+
+    def __init__(self, team, tankid, config, arrays):
+        self.arrays = arrays
+        self.slot = arrays.add_tank(self)
+        Tank.__init__(self, team, tankid, config)
+
+    def _get_pos(self):
+        return self.arrays.tank_pos[self.slot]
+
+    def _set_pos(self, pos):
+        self.arrays.tank_pos[self.slot] = pos
+
+    pos = property(_get_pos, _set_pos)
+
+    def _get_status(self):
+        if self.arrays.tank_alive[self.slot]:
+            return constants.TANKALIVE
+        return constants.TANKDEAD
+
+    def _set_status(self, status):
+        self.arrays.tank_alive[self.slot] = status == constants.TANKALIVE
+
+    status = property(_get_status, _set_status)
+
+    rot = array_property('tank_rot')
+    speed = array_property('tank_speed')
+    goal_speed = array_property('tank_goal_speed')
+    angvel = array_property('tank_angvel')
+    goal_angvel = array_property('tank_goal_angvel')
+    reloadtimer = array_property('tank_reload')
+    dead_timer = array_property('tank_dead_timer')
+
+    def reset_speed(self):
+        """Reset rot, speed and angvel to zero."""
+        Tank.reset_speed(self)
+        self.arrays.tank_vel[self.slot] = 0
+
+    def snapshot(self):
+        """Return the state not held in the arrays (see Game.snapshot)."""
+        return (self.flag, self.spawned, self.last_pos, self.moved_tick,
+                tuple(self.shots))
+
+    def restore(self, state):
+        (self.flag, self.spawned, self.last_pos, self.moved_tick,
+         shots) = state
+        self.shots = list(shots)
+
+    def update(self, dt):
+        arrays = self.arrays
+        arrays.tank_updated[self.slot] = True
+        if not (arrays.tank_moved[self.slot] and
+                arrays.tank_alive[self.slot]):
+            Tank.update(self, dt)
+            return
+        shots = self.shots
+        for i in xrange(len(shots) - 1, -1, -1):
+            shots[i].update(dt)
+
+    def path(self, dt):
+        """Return the path a scalar Tank would report at this point of
+        the tick.
+
+        Until its own update, a scalar tank has neither moved nor changed
+        its velocity, even if the step has already done both here.
+        """
+        arrays = self.arrays
+        slot = self.slot
+        if not arrays.tank_updated[slot]:
+            if arrays.tank_moved[slot]:
+                x, y = arrays.tank_last_pos[slot]
+            else:
+                x, y = self.pos
+            dx, dy = arrays.tank_prev_vel[slot]
+            return (float(x), float(y)), (float(dx)*dt, float(dy)*dt)
+        if arrays.tank_moved[slot]:
+            x, y = arrays.tank_last_pos[slot]
+            return (x, y), (self.pos[0] - x, self.pos[1] - y)
+        return Tank.path(self, dt)
+
+    def update_reload(self, dt):
+        pass
+
+    def update_goals(self, dt):
+        pass
+
+    def velocity(self):
+        """Return the tank's linear velocity as of the last step."""
+        vx, vy = self.arrays.tank_vel[self.slot]
+        return float(vx), float(vy)
+
+
+class ArrayShot(Shot):
+    """Shot whose state is a row of the vectorized EntityArrays.
+
+    The row is returned to the free list when the shot dies; from then on
+    the shot keeps a private copy of its last position.
+    """
+
+    __slots__ = ('arrays', 'slot', '_pos', '_vel', '_distance')
+
+    def __init__(self, tank, config, arrays):
+        self.arrays = arrays
+        self.slot = None
+        Shot.__init__(self, tank, config)
+
+    def fire(self, tank):
+        """Take a free row and (re)start the shot from the given tank."""
+        self.slot = self.arrays.add_shot(self)
+        Shot.fire(self, tank)
+
+    pos = shot_property('shot_pos', '_pos')
+    vel = shot_property('shot_vel', '_vel')
+    distance = shot_property('shot_distance', '_distance')
+
+    def update(self, dt):
+        if self.slot is None or not self.arrays.shot_moved[self.slot]:
+            Shot.update(self, dt)
+
+    def advance(self, dt):
+        """Return the displacement computed by EntityArrays.step."""
+        dx, dy = self.arrays.shot_disp[self.slot]
+        return float(dx), float(dy)
+
+    def snapshot(self):
+        """Return the state not held in the arrays (see Game.snapshot)."""
+        return (self.tank, self.team, self.rot, self.status, self.index,
+                self.slot)
+
+    def restore(self, state):
+        (self.tank, self.team, self.rot, self.status, self.index,
+         self.slot) = state
+
+    def discard(self):
+        """Drop the shot, leaving its row to EntityArrays.restore."""
+        Shot.discard(self)
+        if self.slot is not None:
+            self.detach()
+
+    def kill(self):
+        """Remove the shot from the map and release its row."""
+        Shot.kill(self)
+        if self.slot is not None:
+            self.arrays.free_shot(self.detach())
+
+    def detach(self):
+        """Copy the shot's state out of its row and return the row."""
+        slot = self.slot
+        self._pos = [float(x) for x in self.pos]
+        self._vel = tuple(float(x) for x in self.vel)
+        self._distance = float(self.distance)
+        self.slot = None
+        return slot
 
 
 class Flag(object):
@@ -640,6 +1317,8 @@ class Flag(object):
     Contains the logic for team flags on a map.
     """
 
+    __slots__ = ('team', 'rot', 'pos', 'tank')
+
     size = (constants.FLAGRADIUS*2,) * 2
 
     def __init__(self, team):
@@ -648,6 +1327,14 @@ class Flag(object):
         self.pos = team.base.center
         self.tank = None
 
+    def snapshot(self):
+        """Return the flag's state (see Game.snapshot)."""
+        return self.tank, tuple(self.pos)
+
+    def restore(self, state):
+        self.tank, pos = state
+        self.pos = list(pos)
+
     def update(self, dt):
         """Update the flag's position."""
         f_rad = constants.FLAGRADIUS
@@ -659,7 +1346,7 @@ class Flag(object):
             if collisiontest.circle_to_rect((self.pos, f_rad), rect):
                 self.tank.team.map.scoreFlag(self)
         else:
-            for tank in self.team.map.tanks():
+            for tank in self.team.map.tanks_near(self.pos, f_rad):
                 if collisiontest.circle_to_circle((self.pos, f_rad),
                                                   (tank.pos, t_rad)):
                     if tank.team is self.team:
@@ -670,6 +1357,20 @@ class Flag(object):
                     return
 
 
+def in_deadzone(pos):
+    """True if pos is constants.DEADZONE (where dead objects are parked)."""
+    return (pos[0] == constants.DEADZONE[0] and
+            pos[1] == constants.DEADZONE[1])
+
+
+def team_size(config, color):
+    """Return the number of tanks configured for the given team."""
+    ntanks = config[color+'_tanks']
+    if ntanks is None:
+        ntanks = config['default_tanks']
+    return ntanks
+
+
 def rotate_scale(p1, p2, angle, scale = 1.0):
     """Rotate p1 around p2 with an angle of angle."""
     theta = math.atan2(p1[1] - p2[1], p1[0] - p2[0])
@@ -695,6 +1396,40 @@ def scale_rotate_poly(points, scale, rotation):
         yield rotate_scale(point, center, rotation, scale)
 
 
+def fill_poly(grid, poly, offset):
+    """Mark the cells of grid whose centers lie inside a convex polygon.
+
+    Cell (i, j) covers the world square with corner (i - offset[0],
+    j - offset[1]).  Cells in the polygon's bounding box are tested against
+    every edge at once, so the cost is one array operation per edge.
+
+    >>> grid = numpy.zeros((4, 4), numpy.uint8)
+    >>> fill_poly(grid, [(0, -1.5), (1.5, 0), (0, 1.5), (-1.5, 0)], (2, 2))
+    >>> grid.tolist()
+    [[0, 0, 0, 0], [0, 1, 1, 0], [0, 1, 1, 0], [0, 0, 0, 0]]
+    """
+    points = [(x + offset[0], y + offset[1]) for x, y in poly]
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    i0 = max(0, int(math.floor(min(xs))))
+    i1 = min(grid.shape[0], int(math.ceil(max(xs))))
+    j0 = max(0, int(math.floor(min(ys))))
+    j1 = min(grid.shape[1], int(math.ceil(max(ys))))
+    if i0 >= i1 or j0 >= j1:
+        return
+    cx = numpy.arange(i0, i1)[:, numpy.newaxis] + 0.5
+    cy = numpy.arange(j0, j1)[numpy.newaxis, :] + 0.5
+    # Orientation of the polygon, so that "inside" is on the same side of
+    # every edge whichever way the corners are listed.
+    edges = zip(points, points[1:] + points[:1])
+    area = sum(x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in edges)
+    sign = 1 if area > 0 else -1
+    inside = numpy.ones((i1 - i0, j1 - j0), bool)
+    for (x1, y1), (x2, y2) in edges:
+        inside &= sign * ((x2 - x1) * (cy - y1) - (y2 - y1) * (cx - x1)) >= 0
+    grid[i0:i1, j0:j1] |= inside
+
+
 def polygon_center(points):
     """Return position of center of polygon."""
     points = tuple(points)
@@ -709,10 +1444,13 @@ class Base(object):
     Contains the logic & data for a team's Base on a map.
     """
 
+    __slots__ = ('color', 'center', 'pos', 'size', 'radius', 'rect', 'shape',
+                 'rot', 'team')
+
     def __init__(self, item):
         self.color = item.color
-        self.center = self.pos = item.pos.asList()
-        self.size = tuple(x*2 for x in item.size.asList())
+        self.center = self.pos = list(item.pos)
+        self.size = tuple(x*2 for x in item.size)
         self.radius = math.sqrt((self.size[0]/2)**2 + (self.size[1]/2)**2)
         poly = tuple(convertBoxtoPoly(item.pos,self.size))
         self.rect = (item.pos[0]-self.size[0]/2,
@@ -728,7 +1466,7 @@ class Obstacle(object):
     """
 
     def __init__(self, item):
-        self.center = self.pos = item.pos.asList()
+        self.center = self.pos = list(item.pos)
         self.shape = ()
         self.rot = item.rot
         self.radius = 0
@@ -745,7 +1483,7 @@ class Box(Obstacle):
     def __init__(self, item):
         Obstacle.__init__(self, item)
         self.radius = math.hypot(*item.size)
-        self.size = tuple(x*2 for x in item.size.asList())
+        self.size = tuple(x*2 for x in item.size)
         self.shape = list(scale_rotate_poly((convertBoxtoPoly
                          (item.pos, self.size,item.rot)), 1, item.rot))
         self.rect = (tuple(self.pos)+self.size)
@@ -754,12 +1492,21 @@ class Box(Obstacle):
 class Score(object):
     """Score object: keeps track of a team's score."""
 
+    __slots__ = ('team', 'value', 'flags', 'timer')
+
     def __init__(self, team):
         self.team = team
         self.value = 0
         self.flags = 0
         self.timer = 0
 
+    def snapshot(self):
+        """Return the score's state (see Game.snapshot)."""
+        return self.value, self.flags, self.timer
+
+    def restore(self, state):
+        self.value, self.flags, self.timer = state
+
     def update(self, dt):
         """Update scores."""
         self.timer += dt
@@ -0,0 +1,459 @@
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Load generator and latency benchmark for the BZRC server.
+
+Opens a number of agent connections to every team port and pipelines a mix
+of command bursts down each of them:
+
+    drive    speed, angvel and shoot for one tank
+    poll     mytanks and othertanks
+    occgrid  occgrid for one tank
+
+The server answers the commands of a connection in order, so each response
+is matched with the oldest outstanding command.  For every command type the
+tool reports the throughput and the p50/p99/p999 latency from sending a
+command to receiving its ack line, and to receiving its whole response.
+
+Either point it at a running server (``bzloadtest localhost 4000 4001``) or
+let it start a headless one with --world, in which case the server's
+--occgrid-width and --max-connections are set to match the load.
+
+"""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import os
+import sys
+import json
+import time
+import errno
+import random
+import select
+import socket
+import optparse
+import subprocess
+import collections
+import multiprocessing
+
+import numpy
+
+import config
+
+DEFAULT_MIX = 'drive:4,poll:2,occgrid:1'
+
+# Seconds to wait for outstanding responses once the run is over.
+DRAIN_TIMEOUT = 5
+
+# Seconds to keep trying to connect while a server starts up, and the
+# first wait between tries (doubled after each).
+START_TIMEOUT = 30
+RETRY_DELAY = 0.05
+
+
+def parse_mix(text):
+    """Parse a workload mix of name:weight pairs.
+
+    >>> parse_mix('drive:4,poll')
+    [('drive', 4.0), ('poll', 1.0)]
+    >>> parse_mix('dance:1')
+    Traceback (most recent call last):
+    ...
+    ValueError: unknown workload: dance
+    """
+    mix = []
+    for item in text.split(','):
+        name, _, weight = item.strip().partition(':')
+        if name not in WORKLOADS:
+            raise ValueError('unknown workload: %s' % name)
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def drive_burst(rand, tankid):
+    return ['speed %d %s' % (tankid, rand.uniform(-1, 1)),
+            'angvel %d %s' % (tankid, rand.uniform(-1, 1)),
+            'shoot %d' % tankid]
+
+
+def poll_burst(rand, tankid):
+    return ['mytanks', 'othertanks']
+
+
+def occgrid_burst(rand, tankid):
+    return ['occgrid %d' % tankid]
+
+
+WORKLOADS = {'drive': drive_burst, 'poll': poll_burst,
+             'occgrid': occgrid_burst}
+
+
+class Connection(object):
+    """One agent connection, pipelining commands and timing the responses.
+
+    At most depth commands are outstanding at once.  With a rate, bursts
+    are queued at that many commands per second; otherwise a new burst is
+    queued whenever the last one has been sent.
+    """
+
+    def __init__(self, host, port, mix, tanks, depth, rate, seed):
+        self.connect(host, port)
+        self.sock.setblocking(False)
+        self.rand = random.Random(seed)
+        self.mix = mix
+        self.total_weight = sum(weight for name, weight in mix)
+        self.tanks = tanks
+        self.depth = depth
+        self.rate = rate
+        self.next_burst = time.time()
+        self.queue = collections.deque()
+        # [command, sent, acked] for each command awaiting its response
+        self.outstanding = collections.deque()
+        self.out = ''
+        self.buffer = ''
+        self.in_block = False
+        self.samples = {}
+
+    def connect(self, host, port):
+        """Connect and shake hands, retrying with backoff while the server
+        is starting up (or has not yet let go of an earlier connection).
+        """
+        deadline = time.time() + START_TIMEOUT
+        delay = RETRY_DELAY
+        while True:
+            try:
+                self.sock = socket.create_connection((host, port))
+                if self.handshake():
+                    return
+            except socket.error:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError('could not connect to %s:%d' % (host, port))
+            time.sleep(delay)
+            delay = min(2 * delay, 1)
+
+    def handshake(self):
+        """Shake hands; returns False if the server hung up instead."""
+        f = self.sock.makefile('r', 0)
+        try:
+            line = f.readline()
+        finally:
+            f.close()
+        if not line:
+            self.sock.close()
+            return False
+        if line != 'bzrobots 1\n':
+            raise RuntimeError('unexpected greeting %r' % line)
+        self.sock.sendall('agent 1\n')
+        return True
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def pick(self):
+        """Return the commands of a randomly chosen burst."""
+        x = self.rand.uniform(0, self.total_weight)
+        for name, weight in self.mix:
+            x -= weight
+            if x <= 0:
+                break
+        return WORKLOADS[name](self.rand, self.rand.randrange(self.tanks))
+
+    def schedule(self, now):
+        """Queue bursts which are due, and send what the window allows."""
+        if self.rate:
+            while self.next_burst <= now and len(self.queue) < self.depth:
+                burst = self.pick()
+                self.queue.extend(burst)
+                self.next_burst += len(burst) / self.rate
+        elif not self.queue:
+            self.queue.extend(self.pick())
+        sent = []
+        while self.queue and len(self.outstanding) < self.depth:
+            command = self.queue.popleft()
+            self.outstanding.append([command, now, None])
+            sent.append(command + '\n')
+        if sent:
+            self.out += ''.join(sent)
+
+    def wait(self, now):
+        """Return the seconds until the next burst is due."""
+        if not self.rate:
+            return 0
+        return max(0, self.next_burst - now)
+
+    def flush(self):
+        """Send as much of the output as the socket takes."""
+        try:
+            n = self.sock.send(self.out)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        self.out = self.out[n:]
+
+    def receive(self, now):
+        """Read whatever has arrived; returns False once closed."""
+        try:
+            data = self.sock.recv(1 << 16)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            raise
+        if not data:
+            return False
+        self.feed(data, now)
+        return True
+
+    def feed(self, data, now):
+        """Match complete response lines with the outstanding commands."""
+        lines = (self.buffer + data).split('\n')
+        self.buffer = lines.pop()
+        for line in lines:
+            if self.in_block:
+                if line == 'end':
+                    self.in_block = False
+                    self.done(now)
+            elif line.startswith('ack '):
+                if self.outstanding and self.outstanding[0][2] is None:
+                    self.outstanding[0][2] = now
+            elif line == 'begin':
+                self.in_block = True
+            else:
+                self.done(now)
+
+    def done(self, now):
+        if not self.outstanding:
+            return
+        command, sent, acked = self.outstanding.popleft()
+        if acked is None:
+            acked = now
+        name = command.split(' ', 1)[0]
+        acks, dones = self.samples.setdefault(name, ([], []))
+        acks.append(acked - sent)
+        dones.append(now - sent)
+
+    def close(self):
+        self.sock.close()
+
+
+def run_worker(job):
+    """Drive a share of the connections; returns their latency samples."""
+    host, ports, opts, seed = job
+    mix = parse_mix(opts['mix'])
+    conns = [Connection(host, port, mix, opts['tanks'], opts['depth'],
+                        opts['rate'], seed + i)
+             for i, port in enumerate(ports)]
+    by_fd = dict((conn.fileno(), conn) for conn in conns)
+    poller = select.poll()
+    for conn in conns:
+        poller.register(conn, select.POLLIN)
+    writing = set()
+
+    start = time.time()
+    end = start + opts['duration']
+    drain_end = end + DRAIN_TIMEOUT
+    while True:
+        now = time.time()
+        if now >= end:
+            if now >= drain_end or not any(c.outstanding for c in conns):
+                break
+        timeout = 0.05
+        for conn in conns:
+            if now < end:
+                conn.schedule(now)
+                timeout = min(timeout, conn.wait(now))
+            want = select.POLLIN
+            if conn.out:
+                want |= select.POLLOUT
+            if want & select.POLLOUT or conn in writing:
+                poller.modify(conn, want)
+                if conn.out:
+                    writing.add(conn)
+                else:
+                    writing.discard(conn)
+        for fd, event in poller.poll(timeout * 1000):
+            conn = by_fd[fd]
+            if event & select.POLLOUT:
+                conn.flush()
+            if event & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                if not conn.receive(time.time()):
+                    raise RuntimeError('server closed the connection')
+    elapsed = min(time.time(), end) - start
+    samples = {}
+    for conn in conns:
+        for name, (acks, dones) in conn.samples.items():
+            merged = samples.setdefault(name, ([], []))
+            merged[0].extend(acks)
+            merged[1].extend(dones)
+        conn.close()
+    return elapsed, samples
+
+
+def summarize(elapsed, samples):
+    """Return per command throughput and latency percentiles (in ms)."""
+    report = {}
+    for name, (acks, dones) in samples.items():
+        acks = numpy.array(acks) * 1000
+        dones = numpy.array(dones) * 1000
+        entry = {'count': len(dones), 'per_s': len(dones) / elapsed}
+        for label, values in (('ack', acks), ('done', dones)):
+            for p in (50, 99, 99.9):
+                key = '%s_p%s_ms' % (label, str(p).replace('.', ''))
+                entry[key] = float(numpy.percentile(values, p))
+        report[name] = entry
+    return report
+
+
+def free_port():
+    """Return a port which was free a moment ago."""
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def start_server(world, connections, server_args):
+    """Start a headless server on the given world; returns (process, ports).
+    """
+    colors = [base.color for base in
+              config.Config(['--world=%s' % world]).world.bases]
+    ports = dict((color, free_port()) for color in colors)
+    path = os.path.dirname(os.path.abspath(__file__))
+    argv = [sys.executable, os.path.join(path, '..', 'bin', 'bzrflag'),
+            '--test', '--world=%s' % world,
+            '--max-connections=%d' % connections]
+    argv += ['--%s-port=%d' % item for item in ports.items()]
+    argv += server_args
+    process = subprocess.Popen(argv)
+    # No probe connection here: it would take up a connection slot.  The
+    # agent connections wait for the server instead (see Connection.connect).
+    return process, sorted(ports.values())
+
+
+def run(host, ports, opts, processes=1):
+    """Run the load test and return the summarized report."""
+    targets = [port for port in ports for i in xrange(opts['connections'])]
+    jobs = [(host, targets[i::processes], opts, 1000 * i)
+            for i in xrange(processes) if targets[i::processes]]
+    if processes == 1:
+        results = [run_worker(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(run_worker, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    elapsed = max(result[0] for result in results)
+    samples = {}
+    for result in results:
+        for name, (acks, dones) in result[1].items():
+            merged = samples.setdefault(name, ([], []))
+            merged[0].extend(acks)
+            merged[1].extend(dones)
+    return summarize(elapsed, samples)
+
+
+def main(args=None):
+    """Run a load test as described on the command line."""
+    p = optparse.OptionParser(usage='%prog [options] [host port ...]')
+    p.add_option('--world',
+        dest='world',
+        help='start a headless server on this world instead')
+    p.add_option('--occgrid-width',
+        type='int', dest='occgrid_width', default=50,
+        help='occupancy grid width of the started server')
+    p.add_option('--server-args',
+        dest='server_args', default='',
+        help='extra options for the started server')
+    p.add_option('-c', '--connections',
+        type='int', dest='connections', default=1,
+        help='connections per team port')
+    p.add_option('--mix',
+        dest='mix', default=DEFAULT_MIX,
+        help='workload weights (default %s)' % DEFAULT_MIX)
+    p.add_option('--rate',
+        type='float', dest='rate', default=0,
+        help='commands per second per connection (default: flat out)')
+    p.add_option('--depth',
+        type='int', dest='depth', default=8,
+        help='commands in flight per connection')
+    p.add_option('--tanks',
+        type='int', dest='tanks', default=10,
+        help='tank ids to address commands to')
+    p.add_option('-d', '--duration',
+        type='float', dest='duration', default=10,
+        help='seconds to run for')
+    p.add_option('-j', '--processes',
+        type='int', dest='processes', default=1,
+        help='client processes to spread the connections over')
+    p.add_option('-o', '--output',
+        dest='output',
+        help='file to write the results to as JSON')
+    opts, args = p.parse_args(args)
+    parse_mix(opts.mix)
+    server = None
+    if opts.world:
+        if args:
+            p.error('give either --world or a host and ports')
+        server_args = ['--occgrid-width=%d' % opts.occgrid_width]
+        server_args += opts.server_args.split()
+        server, ports = start_server(opts.world, opts.connections,
+                                     server_args)
+        host = 'localhost'
+    elif len(args) < 2:
+        p.error('expected a host and at least one port')
+    else:
+        host = args[0]
+        ports = [int(port) for port in args[1:]]
+    try:
+        report = run(host, ports, vars(opts), opts.processes)
+    finally:
+        if server is not None:
+            server.kill()
+            server.wait()
+
+    print '%-10s %8s %8s %9s %9s %9s %9s %9s %9s' % ('command', 'count',
+            'per s', 'ack p50', 'ack p99', 'ack p999', 'done p50',
+            'done p99', 'done p999')
+    for name, entry in sorted(report.items()):
+        print ('%-10s %8d %8.1f %9.2f %9.2f %9.2f %9.2f %9.2f %9.2f'
+               % (name, entry['count'], entry['per_s'], entry['ack_p50_ms'],
+                  entry['ack_p99_ms'], entry['ack_p999_ms'],
+                  entry['done_p50_ms'], entry['done_p99_ms'],
+                  entry['done_p999_ms']))
+    if opts.output:
+        out = open(opts.output, 'w')
+        json.dump(report, out, indent=2, sort_keys=True)
+        out.close()
+    return True
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+# vim: et sw=4 sts=4
@@ -0,0 +1,195 @@
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Replay recording and playback.
+
+Given the command line, the seed of the game's random number generator and
+the commands the agents sent, the simulation is deterministic, so that is all
+a replay stores.  Playing it back re-runs the match without its agents.
+
+A replay is a gzipped stream of little-endian records.  It starts with the
+magic string and a version, followed by a length-prefixed JSON header
+holding the command line, the seed and the world's key (see
+:func:`worldcache.world_key`).  Then come the events, each tagged by one
+byte:
+
+    C  team (uint8), command (uint8), tank (uint16), value (float64)
+    S  team (uint8), length (uint16), taunt message
+    T  length of the simulation step (float64)
+
+Commands and taunts are applied, in order, just before the step that
+follows them.
+
+"""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import gzip
+import json
+import struct
+import logging
+
+logger = logging.getLogger('replay')
+
+MAGIC = 'BZRFLAG-REPLAY\n'
+VERSION = 1
+
+COMMANDS = ('shoot', 'speed', 'angvel')
+
+_version = struct.Struct('<H')
+_length = struct.Struct('<I')
+_command = struct.Struct('<BBHd')
+_taunt = struct.Struct('<BH')
+_tick = struct.Struct('<d')
+
+
+class ReplayError(Exception): pass
+
+
+def read_header(f):
+    """Read the magic string, version and header from an open replay."""
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ReplayError('not a replay file')
+    version, = _version.unpack(f.read(_version.size))
+    if version != VERSION:
+        raise ReplayError('unsupported replay version %d' % version)
+    length, = _length.unpack(f.read(_length.size))
+    return json.loads(f.read(length))
+
+
+def load_header(path):
+    """Return the header of the replay at path.
+
+    The header is a dict with the game's command line ('argv'), the seed of
+    its random number generator ('seed'), the team colors ('teams') and the
+    world's key ('world_key').
+    """
+    f = gzip.open(path, 'rb')
+    try:
+        return read_header(f)
+    finally:
+        f.close()
+
+
+class Recorder(object):
+    """Writes the commands and steps of a game to a replay file."""
+
+    def __init__(self, path, argv, seed, teams, world_key=None):
+        self.teams = sorted(teams)
+        self.team_index = dict((color, i) for i,color in enumerate(self.teams))
+        header = json.dumps({'argv': list(argv), 'seed': seed,
+                             'teams': self.teams, 'world_key': world_key})
+        self.file = gzip.open(path, 'wb')
+        self.file.write(MAGIC)
+        self.file.write(_version.pack(VERSION))
+        self.file.write(_length.pack(len(header)))
+        self.file.write(header)
+
+    def command(self, color, command, tankid, value=0.0):
+        """Record a shoot, speed or angvel command."""
+        self.file.write('C' + _command.pack(self.team_index[color],
+                                            COMMANDS.index(command),
+                                            tankid, value))
+
+    def taunt(self, color, message):
+        self.file.write('S' + _taunt.pack(self.team_index[color],
+                                          len(message)) + message)
+
+    def tick(self, dt):
+        """Record a simulation step of dt seconds."""
+        self.file.write('T' + _tick.pack(dt))
+
+    def close(self):
+        self.file.close()
+
+
+class Reader(object):
+    """Reads back a replay file written by Recorder."""
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'rb')
+        self.header = read_header(self.file)
+        self.teams = self.header['teams']
+
+    def events(self):
+        """Yield the replay's events in order.
+
+        Events are ('command', color, command, tankid, value),
+        ('taunt', color, message) and ('tick', dt) tuples.
+        """
+        read = self.file.read
+        while True:
+            tag = read(1)
+            if not tag:
+                return
+            if tag == 'C':
+                team, command, tankid, value = _command.unpack(
+                        read(_command.size))
+                yield ('command', self.teams[team], COMMANDS[command],
+                       tankid, value)
+            elif tag == 'S':
+                team, length = _taunt.unpack(read(_taunt.size))
+                yield ('taunt', self.teams[team], read(length))
+            elif tag == 'T':
+                yield ('tick', _tick.unpack(read(_tick.size))[0])
+            else:
+                raise ReplayError('corrupt replay: unknown event %r' % tag)
+
+    def close(self):
+        self.file.close()
+
+
+class Player(object):
+    """Drives a game from a replay instead of from connected agents."""
+
+    def __init__(self, reader, game):
+        self.reader = reader
+        self.game = game
+        self.events = reader.events()
+
+    def step(self):
+        """Apply the commands before the next recorded step and take it.
+
+        At the end of the replay the game is ended; returns False then.
+        """
+        teams = self.game.teams
+        for event in self.events:
+            kind = event[0]
+            if kind == 'tick':
+                self.game.update(event[1])
+                return True
+            elif kind == 'command':
+                kind, color, command, tankid, value = event
+                if command == 'shoot':
+                    teams[color].shoot(tankid)
+                else:
+                    getattr(teams[color], command)(tankid, value)
+            else:
+                teams[event[1]].taunt(event[2])
+        self.game.end_game = True
+        self.reader.close()
+        return False
+
+
+# vim: et sw=4 sts=4
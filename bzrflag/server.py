@@ -31,6 +31,7 @@ __copyright__ = "Copyright 2008-2011 Brigham Young University"
 __license__ = "GNU GPL"
 
 import sys
+import base64
 import asynchat
 import asyncore
 import math
@@ -39,6 +40,9 @@ import time
 import random
 import logging
 
+import numpy
+
+import binary
 import constants
 
 logger = logging.getLogger('server')
@@ -48,15 +52,21 @@ class Server(asyncore.dispatcher):
     """Server that listens on the BZRC port and dispatches connections.
 
     Each team has its own server which dispatches sessions to the Handler.
-    Only one connection is allowed at a time.  Any subsequent connections will
-    be rejected until the active connection closes.
+    Only max_connections connections (one by default) are allowed at a time.
+    Any subsequent connections will be rejected until an active connection
+    closes.
     """
 
-    def __init__(self, addr, team, game, config, sock=None, asyncore_map=None):
+    def __init__(self, addr, team, game, config, sock=None, asyncore_map=None,
+                 cache=None, stats=None):
         self.config = config
         self.team = team
         self.game = game
+        self.cache = cache
+        self.stats = stats
+        self.max_connections = config.get('max_connections', 1)
         self.in_use = False
+        self.handlers = []
         if sock is None:
             sock = socket.socket()
             sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
@@ -71,26 +81,321 @@ class Server(asyncore.dispatcher):
         self.listen(constants.BACKLOG)
 
     def handle_accept(self):
-        sock, addr = self.accept()
+        pair = self.accept()
+        if pair is None:
+            return
+        sock, addr = pair
         if self.in_use:
             sock.close()
         else:
-            self.in_use = True
-            Handler(sock, self.team, self.game, self.handle_closed_handler,
-                    self.config, self.asyncore_map)
+            self.handlers.append(Handler(sock, self.team, self.game,
+                    self.handle_closed_handler, self.config,
+                    self.asyncore_map, self.cache, self.stats))
+            self.in_use = len(self.handlers) >= self.max_connections
             self.sock = sock
 
     def get_port(self):
         return self.socket.getsockname()[1]
 
-    def handle_closed_handler(self):
-        self.in_use = False
+    def handle_closed_handler(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+        self.in_use = len(self.handlers) >= self.max_connections
 
     def __del__(self):
         if self.sock:
             self.sock.close()
 
 
+def poll(timeout=0.0, asyncore_map=None):
+    """Service all ready connections once, waiting at most timeout seconds.
+
+    Uses poll(2) rather than select(2), which copes with many more
+    connections.
+    """
+    asyncore.loop(timeout, True, asyncore_map, 1)
+
+
+class ResponseCache(object):
+    """Serialized responses to read-only queries, shared by all handlers.
+
+    Each world view is built at most once per simulation step (as counted by
+    game.tick, and game.epoch for steps taken again after Game.restore) and
+    handed to every handler that asks for it in that step.
+    Views carrying sensor noise are keyed by team, so each team still sees
+    its own noise, drawn once per step.  Responses which cannot change
+    during a game are kept for the whole game.
+    """
+
+    def __init__(self, game):
+        self.game = game
+        self.tick = None
+        self.responses = {}
+        self.static = {}
+
+    def lookup(self, key, build, *args):
+        """Return the response for key in this step, building it if needed."""
+        tick = (self.game.epoch, self.game.tick)
+        if tick != self.tick:
+            self.tick = tick
+            self.responses = {}
+        try:
+            return self.responses[key]
+        except KeyError:
+            response = self.responses[key] = build(*args)
+            return response
+
+    def lookup_static(self, key, build, *args):
+        """Return the response for key, building it once per game."""
+        try:
+            return self.static[key]
+        except KeyError:
+            response = self.static[key] = build(*args)
+            return response
+
+    def invalidate(self):
+        """Drop the responses for the current step.
+
+        Called when a command changes the world between steps (e.g. a new
+        shot was fired).
+        """
+        self.responses = {}
+
+    def teams(self):
+        return self.lookup_static('teams', self.build_teams)
+
+    def bases(self):
+        return self.lookup_static('bases', self.build_bases)
+
+    def obstacles(self, team):
+        if team.posnoise:
+            return self.lookup(('obstacles', team.color),
+                               self.build_obstacles, team)
+        return self.lookup_static('obstacles', self.build_obstacles, team)
+
+    def flags(self, team):
+        return self.lookup(('flags', team.color), self.build_flags, team)
+
+    def shots(self):
+        return self.lookup('shots', self.build_shots)
+
+    def mytanks(self, team):
+        return self.lookup(('mytanks', team.color), self.build_mytanks, team)
+
+    def othertanks(self, team):
+        return self.lookup(('othertanks', team.color),
+                           self.build_othertanks, team)
+
+    def state(self, team):
+        return self.lookup(('state', team.color), self.build_state, team)
+
+    def records(self, kind, team):
+        """Return the binary records of mytanks, othertanks, flags or
+        shots."""
+        if kind == 'shots':
+            key = ('records', kind)
+        else:
+            key = ('records', kind, team.color)
+        return self.lookup(key, getattr(self, 'build_%s_records' % kind),
+                           team)
+
+    def binary(self, kind, team):
+        """Return the binary frame for mytanks, othertanks, flags or
+        shots."""
+        return self.lookup(('binary', kind, team.color), self.build_binary,
+                           kind, team)
+
+    def binary_state(self, team):
+        return self.lookup(('binary', 'state', team.color),
+                           self.build_binary_state, team)
+
+    def build_teams(self):
+        response = ['begin\n']
+        for color,team in self.game.teams.items():
+            response.append('team %s %d\n' % (color, len(team.tanks)))
+        response.append('end\n')
+        return ''.join(response)
+
+    def build_bases(self):
+        response = ['begin\n']
+        for color,base in self.game.bases.items():
+            response.append('base %s' % color)
+            for point in base.shape:
+                response.append(' %s %s' % tuple(point))
+            response.append('\n')
+        response.append('end\n')
+        return ''.join(response)
+
+    def build_obstacles(self, team):
+        response = ['begin\n']
+        for obstacle in self.game.obstacles:
+            response.append('obstacle')
+            for x, y in obstacle.shape:
+                x = random.gauss(x, team.posnoise)
+                y = random.gauss(y, team.posnoise)
+                response.append(' %s %s' % (x, y))
+            response.append('\n')
+        response.append('end\n')
+        return ''.join(response)
+
+    def build_flags(self, myteam):
+        response = ['begin\n']
+        for color,team in self.game.teams.items():
+            possess = "none"
+            flag = team.flag
+            if flag.tank is not None:
+                possess = flag.tank.team.color
+            x,y = flag.pos
+            x = random.gauss(x,myteam.posnoise)
+            y = random.gauss(y,myteam.posnoise)
+            response.append('flag %s %s %s %s\n' % (color, possess, x, y))
+        response.append('end\n')
+        return ''.join(response)
+
+    def build_shots(self):
+        response = ['begin\n']
+        for shot in self.game.shots():
+            x, y = shot.pos
+            vx, vy = shot.vel
+            response.append('shot %s %s %s %s\n' % (x, y, vx, vy))
+        response.append('end\n')
+        return ''.join(response)
+
+    def build_mytanks(self, team):
+        response = ['begin\n']
+        entry_template = ('mytank %(id)s %(callsign)s %(status)s'
+                          ' %(shots_avail)s %(reload)s %(flag)s\
+                            %(x)s %(y)s %(angle)s'
+                          ' %(vx)s %(vy)s %(angvel)s\n')
+        for i, tank in enumerate(team.tanks):
+            data = {}
+            data['id'] = i
+            data['callsign'] = tank.callsign
+            data['status'] = tank.status
+            data['shots_avail'] = constants.MAXSHOTS-len(tank.shots)
+            data['reload'] = tank.reloadtimer
+            data['flag'] = tank.flag and tank.flag.team.color or '-'
+            data['x'] = int(tank.pos[0])
+            data['y'] = int(tank.pos[1])
+            data['angle'] = Handler.normalize_angle(tank.rot)
+            data['vx'],data['vy'] = tank.velocity()
+            data['angvel'] = tank.angvel
+            response.append(entry_template % data)
+        response.append('end\n')
+        return ''.join(response)
+
+    def build_othertanks(self, myteam):
+        response = ['begin\n']
+        entry_template = ('othertank %(callsign)s %(color)s %(status)s'
+                          ' %(flag)s %(x)s %(y)s %(angle)s\n')
+        for color,team in self.game.teams.items():
+            if team == myteam:
+                continue
+            for tank in team.tanks:
+                data = {}
+                data['color'] = color
+                data['callsign'] = tank.callsign
+                data['status'] = tank.status
+                data['flag'] = tank.flag and tank.flag.team.color or '-'
+
+                x, y = tank.pos
+                data['x'] = random.gauss(x, myteam.posnoise)
+                data['y'] = random.gauss(y, myteam.posnoise)
+
+                angle = random.gauss(tank.rot, myteam.angnoise)
+                data['angle'] = Handler.normalize_angle(angle)
+
+                vx,vy = tank.velocity()
+                data['vx'] = random.gauss(vx, myteam.velnoise)
+                data['vy'] = random.gauss(vy, myteam.velnoise)
+
+                response.append(entry_template % data)
+
+        response.append('end\n')
+        return ''.join(response)
+
+    def build_state(self, team):
+        # the bodies of this step's mytanks, othertanks, flags and shots
+        blocks = (self.mytanks(team), self.othertanks(team),
+                  self.flags(team), self.shots())
+        response = ['begin\n', 'state %s %s\n' % (self.game.timespent,
+                                                 self.game.tick)]
+        response.extend(block[len('begin\n'):-len('end\n')]
+                        for block in blocks)
+        response.append('end\n')
+        return ''.join(response)
+
+    def build_mytanks_records(self, team):
+        color = binary.COLORNAME.index(team.color)
+        records = []
+        for i, tank in enumerate(team.tanks):
+            x, y = tank.pos
+            vx, vy = tank.velocity()
+            records.append(binary.mytank.pack(color, i,
+                    binary.STATUSES.index(tank.status),
+                    constants.MAXSHOTS - len(tank.shots),
+                    self.flag_index(tank), tank.reloadtimer, x, y,
+                    Handler.normalize_angle(tank.rot), vx, vy, tank.angvel))
+        return records
+
+    def build_othertanks_records(self, myteam):
+        records = []
+        for color, team in self.game.teams.items():
+            if team == myteam:
+                continue
+            for i, tank in enumerate(team.tanks):
+                x, y = tank.pos
+                angle = random.gauss(tank.rot, myteam.angnoise)
+                records.append(binary.othertank.pack(
+                        binary.COLORNAME.index(color), i,
+                        binary.STATUSES.index(tank.status),
+                        self.flag_index(tank),
+                        random.gauss(x, myteam.posnoise),
+                        random.gauss(y, myteam.posnoise),
+                        Handler.normalize_angle(angle)))
+        return records
+
+    def build_flags_records(self, myteam):
+        records = []
+        for color, team in self.game.teams.items():
+            possess = binary.NONE
+            if team.flag.tank is not None:
+                possess = binary.COLORNAME.index(team.flag.tank.team.color)
+            x, y = team.flag.pos
+            records.append(binary.flag.pack(binary.COLORNAME.index(color),
+                    possess, random.gauss(x, myteam.posnoise),
+                    random.gauss(y, myteam.posnoise)))
+        return records
+
+    def build_shots_records(self, team):
+        records = []
+        for shot in self.game.shots():
+            x, y = shot.pos
+            vx, vy = shot.vel
+            records.append(binary.shot.pack(x, y, vx, vy))
+        return records
+
+    @staticmethod
+    def flag_index(tank):
+        if tank.flag is None:
+            return binary.NONE
+        return binary.COLORNAME.index(tank.flag.team.color)
+
+    def build_binary(self, kind, team):
+        frame_type = {'mytanks': binary.MYTANKS,
+                      'othertanks': binary.OTHERTANKS,
+                      'flags': binary.FLAGS, 'shots': binary.SHOTS}[kind]
+        return binary.frame(frame_type,
+                            binary.section(self.records(kind, team)))
+
+    def build_binary_state(self, team):
+        payload = [binary.state_header.pack(self.game.timespent,
+                                            self.game.tick)]
+        for kind in ('mytanks', 'othertanks', 'flags', 'shots'):
+            payload.append(binary.section(self.records(kind, team)))
+        return binary.frame(binary.STATE, ''.join(payload))
+
+
 class Handler(asynchat.async_chat):
     """Handler which implements the BZRC protocol with one client.
 
@@ -100,17 +405,37 @@ class Handler(asynchat.async_chat):
     sends an "xyz" request.  You don't have to add it to a table or anything.
     """
 
-    def __init__(self, sock, team, game, closed_callback, config, asyncore_map):
+    def __init__(self, sock, team, game, closed_callback, config, asyncore_map,
+                 cache=None, stats=None):
         asynchat.async_chat.__init__(self, sock, asyncore_map)
         self.config = config
         self.team = team
         self.game = game
+        if cache is None:
+            cache = ResponseCache(game)
+        self.cache = cache
         self.closed_callback = closed_callback
         self.set_terminator('\n')
         self.input_buffer = ''
+        # whether responses are sent as binary frames (see binary.py)
+        self.binary = False
         self.push('bzrobots 1\n')
         self.init_timestamp = time.time()
         self.established = False
+        # Commands received since the last fast-forward step.
+        self.requests = 0
+        # (every, delta, first tick) while subscribed to state frames
+        self.subscription = None
+        # the lines of the last delta frame, by entity
+        self.last_frame = None
+        # tank index -> (corner, grid) of the last delta occgrid sent
+        self.occgrids = {}
+        self.stats = stats
+        if stats is not None:
+            # time the connection's reads and writes as the network phase
+            read, write = self.handle_read, self.handle_write
+            self.handle_read = lambda: stats.call('network', read)
+            self.handle_write = lambda: stats.call('network', write)
 
     def handle_close(self):
         self.close()
@@ -125,7 +450,10 @@ class Handler(asynchat.async_chat):
             self.input_buffer = chunk
 
     def push(self, text):
-        asynchat.async_chat.push(self, text)
+        if self.binary:
+            asynchat.async_chat.push(self, binary.frame(binary.TEXT, text))
+        else:
+            asynchat.async_chat.push(self, text)
         if self.config['telnet_console']:
             message = (self.team.color +' > ' + text)
             self.game.game_loop.write_message(message)
@@ -133,6 +461,11 @@ class Handler(asynchat.async_chat):
         if text.startswith('fail '):
             logger.error(self.team.color + ' > ' + text)
 
+    def push_binary(self, data):
+        """Push a binary frame to a client using the binary protocol."""
+        asynchat.async_chat.push(self, data)
+        logger.debug(self.team.color + ' > [%d bytes]\n' % len(data))
+
     def found_terminator(self):
         """Called when Asynchat finds an end-of-line.
 
@@ -147,13 +480,17 @@ class Handler(asynchat.async_chat):
         self.input_buffer = ''
         if args:
             if self.established:
+                self.requests += 1
                 try:
                     command = getattr(self, 'bzrc_%s' % args[0])
                 except AttributeError:
                     self.push('fail invalid command\n')
                     return
                 try:
-                    command(args)
+                    if self.stats is None:
+                        command(args)
+                    else:
+                        self.stats.call(command.__name__, command, args)
                 except Exception, e:
                     color = self.team.color
                     logger.error(color + ' : ERROR : %s : %s\n' % (args, e))
@@ -166,6 +503,9 @@ class Handler(asynchat.async_chat):
                     return
             elif args == ['agent', '1']:
                 self.established = True
+            elif args == ['agent', '2', 'binary']:
+                self.established = True
+                self.binary = True
             else:
                 self.bad_handshake()
 
@@ -174,8 +514,76 @@ class Handler(asynchat.async_chat):
         self.push('fail Unrecognized handshake\n')
         self.close()
 
+    def readable(self):
+        """Stop reading commands from a client which is not reading its
+        responses, until the output queue has drained."""
+        return self.pending_output() < constants.MAX_PENDING_OUTPUT
+
+    def pending_output(self):
+        """Return the number of bytes queued to be sent."""
+        return sum(len(data) for data in self.producer_fifo)
+
+    def publish(self):
+        """Push a state frame if one is due; called after every step."""
+        every, delta, start = self.subscription
+        if (self.game.tick - start) % every:
+            return
+        if self.pending_output() >= constants.MAX_PENDING_OUTPUT:
+            # the agent is not keeping up; drop the frame rather than
+            # queue it behind the others
+            return
+        self.push_frame()
+
+    def push_frame(self):
+        """Push the state of the current step as a frame."""
+        every, delta, start = self.subscription
+        if self.binary:
+            self.push_binary_frame(delta)
+            return
+        state = self.cache.state(self.team)
+        # the entity lines, without begin, the state line and end
+        body = state[state.index('\n', len('begin\n')) + 1:-len('end\n')]
+        kind = 'full'
+        if delta:
+            current = {}
+            lines = []
+            last = self.last_frame
+            for line in body.splitlines(True):
+                if line.startswith('shot '):
+                    lines.append(line)
+                    continue
+                # mytank index, othertank callsign or flag color
+                key = line[:line.index(' ', line.index(' ') + 1)]
+                current[key] = line
+                if last is None or last.get(key) != line:
+                    lines.append(line)
+            if last is not None:
+                kind = 'delta'
+                body = ''.join(lines)
+            self.last_frame = current
+        self.push('frame %s %s %s\n%send\n' % (self.game.timespent,
+                                               self.game.tick, kind, body))
+
+    def push_binary_frame(self, delta):
+        last = self.last_frame
+        full = not delta or last is None
+        if delta and last is None:
+            # the last record of each entity, by kind
+            last = self.last_frame = dict((kind, {}) for kind in binary.KEYS)
+        payload = [binary.state_header.pack(self.game.timespent,
+                                            self.game.tick),
+                   binary.frame_kind.pack(not full)]
+        for kind in ('mytanks', 'othertanks', 'flags', 'shots'):
+            records = self.cache.records(kind, self.team)
+            if delta and kind in binary.KEYS:
+                changed = binary.delta(records, last[kind], binary.KEYS[kind])
+                if not full:
+                    records = changed
+            payload.append(binary.section(records))
+        self.push_binary(binary.frame(binary.FRAME, ''.join(payload)))
+
     def close(self):
-        self.closed_callback()
+        self.closed_callback(self)
         asynchat.async_chat.close(self)
 
     def invalid_args(self, args):
@@ -183,7 +591,10 @@ class Handler(asynchat.async_chat):
         self.push('fail Invalid parameter(s)\n')
 
     def ack(self, *args):
-        timestamp = time.time() - self.init_timestamp
+        if self.config.get('fast_forward', False):
+            timestamp = self.game.timespent
+        else:
+            timestamp = time.time() - self.init_timestamp
         arg_string = ' '.join(str(arg) for arg in args)
         self.push('ack %s %s\n' % (timestamp, arg_string))
 
@@ -248,6 +659,7 @@ class Handler(asynchat.async_chat):
         self.ack(command, tankid)
         result = self.team.shoot(tankid)
         if result:
+            self.cache.invalidate()
             self.push('ok\n')
         else:
             self.push('fail\n')
@@ -302,6 +714,67 @@ class Handler(asynchat.async_chat):
         self.team.angvel(tankid, value)
         self.push('ok\n')
 
+    def bzrc_batch(self, args):
+        """batch [tankid] [speed] [angvel] [shoot] ...
+
+        Sends speed, angvel and shoot commands to many tanks at once.  Each
+        tank takes four parameters: its id, its speed and angular velocity
+        (as for the speed and angvel commands, or - to leave them as they
+        are), and 1 to shoot or 0 not to.  The ack gives the number of tanks.
+
+        The response is a single line with a result for each tank, in order:
+            ok [result] ...
+        where each result has a character for its speed, angvel and shoot
+        commands: 1 if it succeeded, 0 if it failed, or - if there was none.
+
+        This is an extension to the BZRC protocol.
+        """
+        try:
+            command = args[0]
+            fields = args[1:]
+            if not fields or len(fields) % 4:
+                raise ValueError
+            orders = []
+            for i in xrange(0, len(fields), 4):
+                tankid, speed, angvel, shoot = fields[i:i+4]
+                if shoot not in ('0', '1'):
+                    raise ValueError
+                orders.append((int(tankid),
+                               None if speed == '-' else float(speed),
+                               None if angvel == '-' else float(angvel),
+                               shoot == '1'))
+        except ValueError, TypeError:
+            self.invalid_args(args)
+            return
+        self.ack(command, len(orders))
+        team = self.team
+        results = []
+        fired = False
+        for tankid, speed, angvel, shoot in orders:
+            result = ''
+            for order, value in ((team.speed, speed), (team.angvel, angvel)):
+                if value is None:
+                    result += '-'
+                    continue
+                try:
+                    order(tankid, value)
+                    result += '1'
+                except Exception:
+                    result += '0'
+            if shoot:
+                try:
+                    shot = team.shoot(tankid)
+                except ValueError:
+                    shot = False
+                fired = fired or shot
+                result += '1' if shot else '0'
+            else:
+                result += '-'
+            results.append(result)
+        if fired:
+            self.cache.invalidate()
+        self.push('ok %s\n' % ' '.join(results))
+
     def bzrc_teams(self, args):
         """teams
         Request a list of teams.
@@ -317,11 +790,7 @@ class Handler(asynchat.async_chat):
             self.invalid_args(args)
             return
         self.ack(command)
-        response = ['begin\n']
-        for color,team in self.game.teams.items():
-            response.append('team %s %d\n' % (color, len(team.tanks)))
-        response.append('end\n')
-        self.push(''.join(response))
+        self.push(self.cache.teams())
 
     def bzrc_obstacles(self, args):
         """obstacles
@@ -343,36 +812,48 @@ class Handler(asynchat.async_chat):
             self.push('fail\n')
             return
 
-        response = ['begin\n']
-        for obstacle in self.game.obstacles:
-            response.append('obstacle')
-            for x, y in obstacle.shape:
-                x = random.gauss(x, self.team.posnoise)
-                y = random.gauss(y, self.team.posnoise)
-                response.append(' %s %s' % (x, y))
-            response.append('\n')
-        response.append('end\n')
-        self.push(''.join(response))
+        self.push(self.cache.obstacles(self.team))
 
     def bzrc_occgrid(self, args):
-        """occgrid [tankid]
+        """occgrid [tankid] [delta] [encoding]
 
         Request an occupancy grid.
 
         Looks like:
             100,430|20,20|####
         #### = encoded 01 string
+
+        Given an encoding (bits, rle or zlib, see binary.py), the rows of
+        '0' and '1' characters are replaced by a line holding the encoding
+        and a line with the encoded grid in base64:
+            encoding [encoding]
+            [data]
+        With delta, the grid sent (rle unless another encoding is given) is
+        the difference from the last delta grid sent for the tank, and the
+        first line is "delta [encoding]" instead.  The whole window is
+        sampled, with noise, every time.
+        These are extensions to the BZRC protocol.
         """
         try:
-            command, tankid = args
-            tank = self.team.tank(int(tankid))
+            command, tankid = args[:2]
+            options = args[2:]
+            delta = options[:1] == ['delta']
+            if delta:
+                options = options[1:]
+            if len(options) > 1:
+                raise ValueError
+            if options:
+                encoding = options[0]
+                if encoding not in binary.ENCODINGS:
+                    raise ValueError
+            else:
+                encoding = 'rle' if delta else None
+            tankid = int(tankid)
+            tank = self.team.tank(tankid)
         except ValueError, TypeError:
             self.invalid_args(args)
             return
 
-        if self.game.occgrid is None:
-            raise Exception('occgrid not currently compatible with rotated '
-                            'obstacles')
         if tank.status == constants.TANKDEAD:
             self.push('fail\n')
             return
@@ -395,10 +876,8 @@ class Handler(asynchat.async_chat):
         width = epos[0]-spos[0]
         height = epos[1]-spos[1]
 
-        true_grid = self.game.occgrid[spos[0]:epos[0]]
-        for i in range(len(true_grid)):
-            true_grid[i] = true_grid[i][spos[1]:epos[1]]
-            
+        true_grid = self.game.occgrid[spos[0]:epos[0], spos[1]:epos[1]]
+
         true_positive = self.config['%s_true_positive' % self.team.color]
         if true_positive is None:
             true_positive = self.config['default_true_positive']
@@ -406,24 +885,48 @@ class Handler(asynchat.async_chat):
         if true_negative is None:
             true_negative = self.config['default_true_negative']
 
-        randomized_grid = [[0 for i in range(height)] for j in range(width)]
-        r_array = [[random.uniform(0,1) for i in range(height)] 
-                                        for j in range(width)]
-        for x in xrange(width):
-            for y in xrange(height):
-                occ = true_grid[x][y]
-                r = r_array[x][y]
-                if int(occ):
-                    randomized_grid[x][y] = int(r < true_positive)
-                else:
-                    randomized_grid[x][y] = int(r > true_negative)
+        if true_positive >= 1 and true_negative >= 1:
+            grid = true_grid
+        else:
+            r = numpy.random.random_sample(true_grid.shape)
+            grid = numpy.where(true_grid, r < true_positive,
+                               r > true_negative)
+
+        if delta:
+            world_spos = tuple(world_spos)
+            last_pos, last = self.occgrids.get(tankid, (None, None))
+            self.occgrids[tankid] = (world_spos, grid)
+            grid = grid != binary.shift_grid(last_pos, last, world_spos,
+                                             grid.shape)
+
+        if self.binary:
+            if encoding is None:
+                self.push_binary(binary.occgrid(world_spos, grid))
+            elif delta:
+                self.push_binary(binary.encoded_occgrid(world_spos, grid,
+                        encoding, binary.DELTA_OCCGRID))
+            else:
+                self.push_binary(binary.encoded_occgrid(world_spos, grid,
+                                                        encoding))
+            return
 
         response = ['begin\n']
         response.append('at %d,%d\n' % tuple(world_spos))
         response.append('size %dx%d\n' % (width, height))
-        for row in randomized_grid:
-            response.append(''.join([str(int(col)) for col in row]))
-            response.append('\n')
+        if encoding is not None:
+            data = binary.encode_grid(grid, encoding)
+            if delta:
+                response.append('delta %s\n' % encoding)
+            else:
+                response.append('encoding %s\n' % encoding)
+            response.append(base64.b64encode(data) + '\n')
+        else:
+            # One row of '0'/'1' characters per x, each ending in a newline.
+            rows = numpy.empty((width, height + 1), numpy.uint8)
+            rows[:, :height] = grid
+            rows[:, :height] += ord('0')
+            rows[:, height] = ord('\n')
+            response.append(rows.tostring())
         response.append('end\n')
         self.push(''.join(response))
 
@@ -443,15 +946,7 @@ class Handler(asynchat.async_chat):
             self.invalid_args(args)
             return
         self.ack(command)
-
-        response = ['begin\n']
-        for color,base in self.game.bases.items():
-            response.append('base %s' % color)
-            for point in base.shape:
-                response.append(' %s %s' % tuple(point))
-            response.append('\n')
-        response.append('end\n')
-        self.push(''.join(response))
+        self.push(self.cache.bases())
 
     def bzrc_flags(self, args):
         """flags
@@ -472,19 +967,10 @@ class Handler(asynchat.async_chat):
             self.invalid_args(args)
             return
         self.ack(command)
-
-        response = ['begin\n']
-        for color,team in self.game.teams.items():
-            possess = "none"
-            flag = team.flag
-            if flag.tank is not None:
-                possess = flag.tank.team.color
-            x,y = flag.pos
-            x = random.gauss(x,self.team.posnoise)
-            y = random.gauss(y,self.team.posnoise)
-            response.append('flag %s %s %s %s\n' % (color, possess, x, y))
-        response.append('end\n')
-        self.push(''.join(response))
+        if self.binary:
+            self.push_binary(self.cache.binary('flags', self.team))
+        else:
+            self.push(self.cache.flags(self.team))
 
     def bzrc_shots(self, args):
         """shots
@@ -502,14 +988,10 @@ class Handler(asynchat.async_chat):
             self.invalid_args(args)
             return
         self.ack(command)
-
-        response = ['begin\n']
-        for shot in self.game.shots():
-            x, y = shot.pos
-            vx, vy = shot.vel
-            response.append('shot %s %s %s %s\n' % (x, y, vx, vy))
-        response.append('end\n')
-        self.push(''.join(response))
+        if self.binary:
+            self.push_binary(self.cache.binary('shots', self.team))
+        else:
+            self.push(self.cache.shots())
 
     def bzrc_mytanks(self, args):
         """mytanks
@@ -535,28 +1017,10 @@ class Handler(asynchat.async_chat):
             self.invalid_args(args)
             return
         self.ack(command)
-
-        response = ['begin\n']
-        entry_template = ('mytank %(id)s %(callsign)s %(status)s'
-                          ' %(shots_avail)s %(reload)s %(flag)s\
-                            %(x)s %(y)s %(angle)s'
-                          ' %(vx)s %(vy)s %(angvel)s\n')
-        for i, tank in enumerate(self.team.tanks):
-            data = {}
-            data['id'] = i
-            data['callsign'] = tank.callsign
-            data['status'] = tank.status
-            data['shots_avail'] = constants.MAXSHOTS-len(tank.shots)
-            data['reload'] = tank.reloadtimer
-            data['flag'] = tank.flag and tank.flag.team.color or '-'
-            data['x'] = int(tank.pos[0])
-            data['y'] = int(tank.pos[1])
-            data['angle'] = self.normalize_angle(tank.rot)
-            data['vx'],data['vy'] = tank.velocity()
-            data['angvel'] = tank.angvel
-            response.append(entry_template % data)
-        response.append('end\n')
-        self.push(''.join(response))
+        if self.binary:
+            self.push_binary(self.cache.binary('mytanks', self.team))
+        else:
+            self.push(self.cache.mytanks(self.team))
 
     def bzrc_othertanks(self, args):
         """othertanks
@@ -575,39 +1039,34 @@ class Handler(asynchat.async_chat):
             self.invalid_args(args)
             return
         self.ack(command)
+        if self.binary:
+            self.push_binary(self.cache.binary('othertanks', self.team))
+        else:
+            self.push(self.cache.othertanks(self.team))
 
-        response = ['begin\n']
-        entry_template = ('othertank %(callsign)s %(color)s %(status)s'
-                          ' %(flag)s %(x)s %(y)s %(angle)s\n')
-        for color,team in self.game.teams.items():
-            if team == self.team:
-                continue
-            for tank in team.tanks:
-                data = {}
-                data['color'] = color
-                data['callsign'] = tank.callsign
-                data['status'] = tank.status
-                data['shots_avail'] = constants.MAXSHOTS-len(tank.shots)
-                data['reload'] = tank.reloadtimer
-                data['flag'] = tank.flag and tank.flag.team.color or '-'
-
-                x, y = tank.pos
-                data['x'] = random.gauss(x, self.team.posnoise)
-                data['y'] = random.gauss(y, self.team.posnoise)
-
-                angle = random.gauss(tank.rot, self.team.angnoise)
-                data['angle'] = self.normalize_angle(angle)
-
-                vx,vy = tank.velocity()
-                data['vx'] = random.gauss(vx, self.team.velnoise)
-                data['vy'] = random.gauss(vy, self.team.velnoise)
+    def bzrc_state(self, args):
+        """state
 
-                data['angvel'] = tank.angvel
+        Request everything that moves, as seen in a single simulation step.
 
-                response.append(entry_template % data)
+        The response starts with the step it describes:
+            state [time elapsed] [tick]
+        and is followed by the mytank, othertank, flag and shot lines which
+        the mytanks, othertanks, flags and shots commands would give in that
+        step.
 
-        response.append('end\n')
-        self.push(''.join(response))
+        This is an extension to the BZRC protocol.
+        """
+        try:
+            command, = args
+        except ValueError, TypeError:
+            self.invalid_args(args)
+            return
+        self.ack(command)
+        if self.binary:
+            self.push_binary(self.cache.binary_state(self.team))
+        else:
+            self.push(self.cache.state(self.team))
 
     def bzrc_constants(self, args):
         """constants
@@ -704,6 +1163,102 @@ class Handler(asynchat.async_chat):
         timelimit = self.game.timelimit
         self.push('timer %s %s\n' % (timespent, timelimit))
 
+    def bzrc_subscribe(self, args):
+        """subscribe [ticks] [delta]
+
+        Request the state (as for the state command) every given number of
+        simulation steps, pushed by the server without being asked for.
+        Subscribing to 0 steps stops the frames.
+
+        Each frame looks like:
+            frame [time elapsed] [tick] [full or delta]
+            [mytank, othertank, flag and shot lines]
+            end
+        Frames are not acked, and arrive between (never inside) responses
+        to other commands.  The first frame is sent straight away.  With
+        delta, later frames leave out the mytank, othertank and flag lines
+        that have not changed since the previous frame; the shot lines are
+        always complete.  Frames are dropped while the client is not
+        reading them.
+
+        This is an extension to the BZRC protocol.
+        """
+        try:
+            if len(args) == 3 and args[2] == 'delta':
+                delta = True
+            elif len(args) == 2:
+                delta = False
+            else:
+                raise ValueError
+            every = int(args[1])
+            if every < 0:
+                raise ValueError
+        except ValueError, TypeError:
+            self.invalid_args(args)
+            return
+        self.ack(*args)
+        self.push('ok\n')
+        self.last_frame = None
+        if every:
+            self.subscription = (every, delta, self.game.tick)
+            self.push_frame()
+        else:
+            self.subscription = None
+
+    def bzrc_stats(self, args):
+        """stats [reset | profile [phase] [calls]]
+
+        Reports where the server's time goes, for servers started with
+        --stats.  A line for each phase of the game loop:
+
+            phase [name] [calls] [total] [mean] [p50] [p99] [max]
+
+        Phases are update (a physics step), display (drawing a frame),
+        network (servicing a connection) and bzrc_[command] for each command.
+        Times are in milliseconds; the percentiles are over recent calls.
+        "stats reset" clears the figures, and "stats profile" runs the next
+        calls (500 by default) of a phase under cProfile.  Only one phase
+        can be profiled at a time.
+
+        This is an extension to the BZRC protocol.
+        """
+        try:
+            command = args[0]
+            if len(args) == 1:
+                action = None
+            elif args[1] == 'reset' and len(args) == 2:
+                action, = args[1:]
+            elif args[1] == 'profile' and len(args) in (3, 4):
+                action, phase = args[1:3]
+                calls = int(args[3]) if len(args) == 4 else None
+            else:
+                raise ValueError
+        except ValueError, TypeError:
+            self.invalid_args(args)
+            return
+        self.ack(*args)
+        if self.stats is None:
+            self.push('fail stats are disabled (start with --stats)\n')
+        elif action == 'reset':
+            self.stats.reset()
+            self.push('ok\n')
+        elif action == 'profile':
+            try:
+                if calls is None:
+                    self.stats.profile(phase)
+                else:
+                    self.stats.profile(phase, calls)
+            except ValueError, e:
+                self.push('fail %s\n' % e)
+                return
+            self.push('ok\n')
+        else:
+            response = ['begin\n']
+            for row in self.stats.rows():
+                response.append('phase %s %d %s %s %s %s %s\n' % row)
+            response.append('end\n')
+            self.push(''.join(response))
+
     def bzrc_quit(self, args):
         """quit
 
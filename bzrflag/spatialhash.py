@@ -0,0 +1,190 @@
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Uniform grid broadphase for BZRFlag collision tests.
+
+Objects are bucketed by the grid cells their bounding box overlaps.  A query
+returns every object sharing a cell with the query area, so the (expensive)
+narrowphase tests in :mod:`collisiontest` only run against nearby candidates.
+
+Buckets are plain lists so that query results come back in a deterministic
+order from one run to the next.
+
+"""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import math
+import logging
+
+logger = logging.getLogger('spatialhash')
+
+
+class SpatialHash(object):
+    """Spatial hash of objects keyed by uniform grid cells.
+
+    >>> grid = SpatialHash(10)
+    >>> grid.insert('a', (0, 0), 1)
+    >>> grid.insert('b', (35, 0), 1)
+    >>> grid.query((2, 2), 1)
+    ['a']
+    >>> grid.move('a', (33, 0), 1)
+    >>> grid.query((34, 0), 1)
+    ['b', 'a']
+    >>> grid.remove('b')
+    >>> grid.query((34, 0), 1)
+    ['a']
+    """
+
+    def __init__(self, cellsize):
+        self.cellsize = float(cellsize)
+        self.buckets = {}
+        self.cells = {}
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, obj):
+        return obj in self.cells
+
+    def cell_range(self, xmin, ymin, xmax, ymax):
+        """Return the keys of all cells overlapping the given bounds."""
+        cs = self.cellsize
+        x0 = int(math.floor(xmin / cs))
+        x1 = int(math.floor(xmax / cs))
+        y0 = int(math.floor(ymin / cs))
+        y1 = int(math.floor(ymax / cs))
+        return tuple((i, j) for i in xrange(x0, x1 + 1)
+                            for j in xrange(y0, y1 + 1))
+
+    def circle_cells(self, pos, radius):
+        """Return the keys of all cells overlapping the given circle."""
+        x, y = pos
+        return self.cell_range(x - radius, y - radius, x + radius, y + radius)
+
+    def poly_cells(self, poly):
+        """Return the keys of all cells overlapping the given polygon."""
+        xs = [p[0] for p in poly]
+        ys = [p[1] for p in poly]
+        return self.cell_range(min(xs), min(ys), max(xs), max(ys))
+
+    def insert(self, obj, pos, radius):
+        """Add a circular object to the grid."""
+        self.insert_cells(obj, self.circle_cells(pos, radius))
+
+    def insert_poly(self, obj, poly):
+        """Add a polygonal object to the grid."""
+        self.insert_cells(obj, self.poly_cells(poly))
+
+    def insert_cells(self, obj, cells):
+        """Add an object to the given cells."""
+        self.cells[obj] = cells
+        for key in cells:
+            self.buckets.setdefault(key, []).append(obj)
+
+    def move(self, obj, pos, radius):
+        """Re-bucket a circular object if it has changed cells.
+
+        Objects not yet in the grid are inserted.
+        """
+        cells = self.circle_cells(pos, radius)
+        old = self.cells.get(obj)
+        if old == cells:
+            return
+        if old is not None:
+            self._unlink(obj, old)
+        self.insert_cells(obj, cells)
+
+    def remove(self, obj):
+        """Remove an object from the grid (if present)."""
+        old = self.cells.pop(obj, None)
+        if old is not None:
+            self._unlink(obj, old)
+
+    def snapshot(self):
+        """Return a copy of the grid's contents, for restore()."""
+        return (dict(self.cells),
+                dict((key, tuple(bucket))
+                     for key, bucket in self.buckets.iteritems()))
+
+    def restore(self, state):
+        """Put back the contents saved by snapshot(), in the same order.
+
+        >>> grid = SpatialHash(10)
+        >>> grid.insert('a', (0, 0), 1)
+        >>> state = grid.snapshot()
+        >>> grid.move('a', (33, 0), 1)
+        >>> grid.restore(state)
+        >>> grid.query((2, 2), 1), grid.query((34, 0), 1)
+        (['a'], [])
+        """
+        cells, buckets = state
+        self.cells = dict(cells)
+        self.buckets = dict((key, list(bucket))
+                            for key, bucket in buckets.iteritems())
+
+    def _unlink(self, obj, cells):
+        for key in cells:
+            bucket = self.buckets[key]
+            bucket.remove(obj)
+            if not bucket:
+                del self.buckets[key]
+
+    def clear(self):
+        """Remove all objects from the grid."""
+        self.buckets = {}
+        self.cells = {}
+
+    def query(self, pos, radius):
+        """Return objects which may overlap the given circle."""
+        return self.query_cells(self.circle_cells(pos, radius))
+
+    def query_line(self, p1, p2, radius=0):
+        """Return objects which may overlap the given (thickened) segment."""
+        xmin, xmax = min(p1[0], p2[0]), max(p1[0], p2[0])
+        ymin, ymax = min(p1[1], p2[1]), max(p1[1], p2[1])
+        return self.query_cells(self.cell_range(xmin - radius, ymin - radius,
+                                                xmax + radius, ymax + radius))
+
+    def query_cells(self, cells):
+        """Return the objects in the given cells, without duplicates."""
+        buckets = self.buckets
+        found = []
+        seen = set()
+        for key in cells:
+            bucket = buckets.get(key)
+            if not bucket:
+                continue
+            for obj in bucket:
+                if obj not in seen:
+                    seen.add(obj)
+                    found.append(obj)
+        return found
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+# vim: et sw=4 sts=4
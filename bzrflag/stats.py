@@ -0,0 +1,223 @@
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Timing instrumentation for the game loop and the BZRC servers.
+
+With --stats, the game loop keeps the wall time spent in each phase of its
+work:
+
+    update       one physics step (Game.update, or a step of a replay)
+    display      drawing a frame
+    network      servicing an agent connection, including the commands it
+                 dispatched
+    bzrc_<name>  each BZRC command, by name
+
+For every phase it counts the calls and their total time, and keeps the most
+recent WINDOW samples, from which the percentiles are taken.  The figures
+are available from the BZRC stats command and, with --stats-interval, are
+written to the debug log periodically.  Any phase can also be run under
+cProfile for a number of calls, from the command line (--profile) or with
+"stats profile <phase> [calls]".  Only one phase is profiled at a time:
+phases nest (commands run within network), and in Python 2 a profiler
+started within another one takes over its hook and switches it off when
+done, which would leave the outer profile without most of its calls.
+
+Without --stats the game loop has no Stats object and skips all of this.
+
+"""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import time
+import pstats
+import logging
+import cProfile
+from cStringIO import StringIO
+
+logger = logging.getLogger('stats')
+
+# Samples kept per phase for the percentiles.
+WINDOW = 1000
+
+# Calls profiled when no count is given.
+PROFILE_CALLS = 500
+
+
+class Phase(object):
+    """Timings of one phase: totals, and a ring of recent samples."""
+
+    __slots__ = ('count', 'total', 'max', 'samples', 'next')
+
+    def __init__(self, window=WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = [0.0] * window
+        self.next = 0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.samples[self.next] = seconds
+        self.next += 1
+        if self.next == len(self.samples):
+            self.next = 0
+
+    def recent(self):
+        """Return the recent samples, sorted."""
+        return sorted(self.samples[:min(self.count, len(self.samples))])
+
+    def percentile(self, p):
+        """Return the p-th percentile of the recent samples.
+
+        >>> phase = Phase(window=4)
+        >>> for seconds in (5, 1, 2, 3, 4):
+        ...     phase.add(seconds)
+        >>> phase.percentile(50), phase.percentile(100)
+        (3, 4)
+        >>> phase.count, phase.total, phase.max
+        (5, 15.0, 5)
+        """
+        samples = self.recent()
+        if not samples:
+            return 0.0
+        index = int(round(p / 100.0 * (len(samples) - 1)))
+        return samples[index]
+
+
+class Stats(object):
+    """Wall time per phase, with periodic dumps and on-demand profiling.
+
+    >>> s = Stats()
+    >>> s.call('update', sum, [1, 2])
+    3
+    >>> s.phases['update'].count
+    1
+    """
+
+    def __init__(self, window=WINDOW, interval=0, profile_out=None):
+        self.window = window
+        self.interval = interval
+        self.profile_out = profile_out
+        self.phases = {}
+        # phase name -> [profiler, calls left], for the one phase (if any)
+        # being profiled
+        self.profiling = {}
+        self.next_dump = time.time() + interval
+
+    def add(self, name, seconds):
+        """Add a sample of seconds to the phase name."""
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase(self.window)
+        phase.add(seconds)
+
+    def call(self, name, func, *args):
+        """Call func(*args), timing it (and maybe profiling it) as name."""
+        profile = self.profiling.get(name)
+        start = time.time()
+        if profile is None:
+            result = func(*args)
+        else:
+            result = profile[0].runcall(func, *args)
+        self.add(name, time.time() - start)
+        if profile is not None:
+            profile[1] -= 1
+            if profile[1] <= 0:
+                self.finish_profile(name)
+        return result
+
+    def profile(self, name, calls=PROFILE_CALLS):
+        """Run the next calls of the phase name under cProfile.
+
+        Raises ValueError if another phase is being profiled.
+
+        >>> s = Stats()
+        >>> s.profile('update')
+        >>> s.profile('network')
+        Traceback (most recent call last):
+        ...
+        ValueError: update is being profiled
+        """
+        for other in self.profiling:
+            if other != name:
+                raise ValueError('%s is being profiled' % other)
+        self.profiling[name] = [cProfile.Profile(), calls]
+
+    def finish_profile(self, name):
+        """Stop profiling a phase and write out what was found.
+
+        The profile is saved to profile_out (with the phase name added)
+        when one was given, and logged otherwise.
+        """
+        profiler, calls = self.profiling.pop(name)
+        if self.profile_out:
+            path = '%s.%s' % (self.profile_out, name)
+            profiler.dump_stats(path)
+            logger.info('profile of %s written to %s' % (name, path))
+        else:
+            out = StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats(
+                    'cumulative').print_stats(25)
+            logger.debug('profile of %s:\n%s' % (name, out.getvalue()))
+
+    def reset(self):
+        self.phases = {}
+
+    def rows(self):
+        """Return (name, count, total, mean, p50, p99, max) for each phase,
+        with times in milliseconds."""
+        rows = []
+        for name, phase in sorted(self.phases.items()):
+            rows.append((name, phase.count, phase.total * 1000,
+                         phase.total * 1000 / phase.count,
+                         phase.percentile(50) * 1000,
+                         phase.percentile(99) * 1000, phase.max * 1000))
+        return rows
+
+    def report(self):
+        """Return the figures as a table."""
+        lines = ['%-18s %8s %10s %8s %8s %8s %8s' % ('phase', 'calls',
+                 'total ms', 'mean', 'p50', 'p99', 'max')]
+        for row in self.rows():
+            lines.append('%-18s %8d %10.1f %8.3f %8.3f %8.3f %8.3f' % row)
+        return '\n'.join(lines)
+
+    def tick(self):
+        """Write the report to the debug log if one is due."""
+        if not self.interval:
+            return
+        now = time.time()
+        if now >= self.next_dump:
+            self.next_dump = now + self.interval
+            logger.debug('timings:\n%s' % self.report())
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+# vim: et sw=4 sts=4
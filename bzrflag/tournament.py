@@ -0,0 +1,210 @@
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Tournament runner for BZRFlag.
+
+Runs many headless games in parallel, one per worker process, and collects
+the final scores into a JSON results file.  A tournament is described by a
+JSON spec such as::
+
+    {
+        "maps": ["maps/four_ls.bzw", "maps/rotated_box_world.bzw"],
+        "pairings": [
+            {"red": "python bzagents/agent0.py",
+             "green": "python bzagents/agent0.py"}
+        ],
+        "args": ["--fast-forward", "--time-limit=300"],
+        "repeat": 1
+    }
+
+Every map is played with every pairing ``repeat`` times.  Each agent command
+is started with ``localhost <port>`` appended, where the port is whatever the
+OS allocated to that team's server.
+
+"""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import os
+import time
+import json
+import random
+import shlex
+import optparse
+import logging
+import traceback
+import subprocess
+import multiprocessing
+
+import numpy
+
+import config
+import constants
+import game
+import server
+
+logger = logging.getLogger('tournament')
+
+DEFAULT_ARGS = ['--fast-forward']
+
+# Seconds to wait for the agents of a match to connect.
+CONNECT_TIMEOUT = 30
+
+
+def matches(spec):
+    """Expand a tournament spec into a list of match descriptions.
+
+    >>> spec = {'maps': ['a.bzw', 'b.bzw'], 'pairings': [{'red': 'x'}]}
+    >>> [m['world'] for m in matches(spec)]
+    ['a.bzw', 'b.bzw']
+    >>> matches(spec)[1]['agents']
+    {'red': 'x'}
+    """
+    args = spec.get('args', DEFAULT_ARGS)
+    result = []
+    for i in xrange(spec.get('repeat', 1)):
+        for world in spec['maps']:
+            for pairing in spec['pairings']:
+                result.append({'world': world, 'agents': pairing,
+                               'args': args, 'round': i})
+    return result
+
+
+def game_args(match):
+    """Return the bzrflag command line for a match."""
+    args = ['--test', '--world=%s' % match['world']]
+    args += list(match['args'])
+    # Hold the clock until every agent has connected.
+    args.append('--min-agents=%d' % len(match['agents']))
+    return args
+
+
+def wait_for_connections(game_loop, agents):
+    """Service the game's servers until every agent has connected.
+
+    Raises RuntimeError if an agent exits or takes too long to connect;
+    otherwise a fast-forward game would hold its clock forever.
+    """
+    deadline = time.time() + CONNECT_TIMEOUT
+    while len(game_loop.agents()) < len(agents):
+        for agent in agents:
+            if agent.poll() is not None:
+                raise RuntimeError('agent exited with status %s before '
+                                   'connecting' % agent.returncode)
+        if time.time() > deadline:
+            raise RuntimeError('timed out waiting for agents to connect')
+        server.poll(constants.LOOP_TIMEOUT)
+
+
+def run_match(match):
+    """Play one match and return its description updated with the scores.
+
+    Agents are started as subprocesses once the team servers are listening
+    and are killed when the game ends.  Failures are recorded in the
+    result rather than raised so that one bad match does not take down the
+    rest of the tournament.
+    """
+    result = dict(match)
+    agents = []
+    game_loop = None
+    devnull = open(os.devnull, 'w')
+    # Forked workers share the parent's random state, both the stdlib's
+    # (the game's own generator is seeded from it) and NumPy's (sensor
+    # noise in occgrid responses).  Unless the match gives a --seed, which
+    # GameLoop uses for both, every game should still play out, and see
+    # its noise, differently.
+    random.seed()
+    numpy.random.seed()
+    try:
+        game_loop = game.GameLoop(config.Config(game_args(match)))
+        game_loop.start_servers()
+        ports = dict((srv.team.color, srv.get_port())
+                     for srv in game_loop.servers)
+        for color, command in sorted(match['agents'].items()):
+            if color not in ports:
+                raise ValueError('no %s team on %s' % (color, match['world']))
+            argv = shlex.split(command) + ['localhost', str(ports[color])]
+            agents.append(subprocess.Popen(argv, stdout=devnull,
+                                           stderr=devnull))
+        wait_for_connections(game_loop, agents)
+        game_loop.loop()
+        result['scores'] = game_loop.scores()
+        result['time'] = game_loop.game.timespent
+    except Exception, e:
+        logger.error('match failed: %s' % e)
+        result['error'] = traceback.format_exc()
+    finally:
+        for agent in agents:
+            if agent.poll() is None:
+                agent.kill()
+            agent.wait()
+        if game_loop is not None:
+            game_loop.stop_servers()
+        devnull.close()
+    return result
+
+
+def run(spec, processes=None):
+    """Run every match in the spec and return the list of results.
+
+    The pool defaults to one worker per CPU.
+    """
+    pool = multiprocessing.Pool(processes or multiprocessing.cpu_count())
+    try:
+        return pool.map(run_match, matches(spec), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(args=None):
+    """Run the tournament described by the spec file named on the
+    command line."""
+    p = optparse.OptionParser(usage='%prog [options] spec.json')
+    p.add_option('-o', '--output',
+        dest='output', default='results.json',
+        help='file to write the results to')
+    p.add_option('-j', '--processes',
+        type='int', dest='processes',
+        help='number of games to run at once (default: one per CPU)')
+    opts, args = p.parse_args(args)
+    if len(args) != 1:
+        p.error('expected exactly one spec file')
+    logging.basicConfig(level=logging.WARNING)
+    spec = json.load(open(args[0]))
+    results = run(spec, opts.processes)
+    out = open(opts.output, 'w')
+    json.dump(results, out, indent=2, sort_keys=True)
+    out.close()
+    failed = len([r for r in results if 'error' in r])
+    print '%d matches, %d failed; results in %s' % (len(results), failed,
+                                                     opts.output)
+    return failed == 0
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+# vim: et sw=4 sts=4
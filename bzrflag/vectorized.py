@@ -0,0 +1,420 @@
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Struct-of-arrays storage for the vectorized simulation backend.
+
+With --vectorized, the state of every tank and shot lives in contiguous NumPy
+arrays, and the kinematics (acceleration toward the goal speeds, rotation,
+velocity, reload timers, shot travel) are advanced for all of them at once by
+:meth:`EntityArrays.step`.  The ArrayTank and ArrayShot classes in
+:mod:`game` are thin views over one row of these arrays, so collision
+handling, the server and the display keep working unchanged.
+
+The step also runs a vectorized, finer-grained version of the spatial hash
+broadphase.  A tank or shot whose path this tick only touches cells with no
+obstacle and no other tank cannot collide with anything, so it is flagged as
+clear.  Things which are near a flag or a base about to respawn a tank, or a
+shot about to run out of range, are not clear either: the outcome of those
+depends on the order in which the objects are updated.  The clear objects
+are all moved at once by the step, and the per-object updates skip them;
+everything else takes the ordinary per-object path, which keeps the results
+identical to the scalar backend.
+
+"""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import math
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import constants
+
+logger = logging.getLogger('vectorized')
+
+
+class EntityArrays(object):
+    """Contiguous per-tank and per-shot state.
+
+    Tanks are allocated once at startup.  Shot rows are handed out and
+    returned through a free list, so the arrays never need to grow as long
+    as shot_capacity covers max_shots for every tank.
+    """
+
+    def __init__(self, tank_capacity, shot_capacity):
+        if numpy is None:
+            raise ImportError('the vectorized backend requires NumPy')
+        self.ntanks = 0
+        self.tank_pos = numpy.zeros((tank_capacity, 2))
+        self.tank_rot = numpy.zeros(tank_capacity)
+        self.tank_speed = numpy.zeros(tank_capacity)
+        self.tank_goal_speed = numpy.zeros(tank_capacity)
+        self.tank_angvel = numpy.zeros(tank_capacity)
+        self.tank_goal_angvel = numpy.zeros(tank_capacity)
+        self.tank_reload = numpy.zeros(tank_capacity)
+        self.tank_vel = numpy.zeros((tank_capacity, 2))
+        # the velocity before this step, and whether the tank's per-object
+        # update has run yet this step (see ArrayTank.path)
+        self.tank_prev_vel = numpy.zeros((tank_capacity, 2))
+        self.tank_updated = numpy.zeros(tank_capacity, dtype=bool)
+        self.tank_alive = numpy.zeros(tank_capacity, dtype=bool)
+        self.tank_clear = numpy.zeros(tank_capacity, dtype=bool)
+        self.tank_cells = numpy.zeros((tank_capacity, 4), dtype=int)
+        self.tank_moved = numpy.zeros(tank_capacity, dtype=bool)
+        self.tank_last_pos = numpy.zeros((tank_capacity, 2))
+        self.tank_dead_timer = numpy.zeros(tank_capacity)
+        # center x, y and radius of the area each tank respawns in
+        self.tank_zone = numpy.zeros((tank_capacity, 3))
+
+        self.shot_pos = numpy.zeros((shot_capacity, 2))
+        self.shot_vel = numpy.zeros((shot_capacity, 2))
+        self.shot_disp = numpy.zeros((shot_capacity, 2))
+        self.shot_distance = numpy.zeros(shot_capacity)
+        self.shot_active = numpy.zeros(shot_capacity, dtype=bool)
+        self.shot_clear = numpy.zeros(shot_capacity, dtype=bool)
+        self.shot_cells = numpy.zeros((shot_capacity, 4), dtype=int)
+        self.shot_moved = numpy.zeros(shot_capacity, dtype=bool)
+        self.free_shots = range(shot_capacity - 1, -1, -1)
+        # the tank or shot object using each row
+        self.tanks = []
+        self.shots = [None] * shot_capacity
+        self.blocked = None
+
+    def setup_broadphase(self, cellsize, half_size, obstacles, gridsize):
+        """Rasterize obstacle bounding boxes into a grid of blocked cells.
+
+        half_size is the (x, y) distance from the center of the world to
+        its walls, and obstacles a list of polygons.  gridsize is the cell
+        size of the game's spatial hashes, which step reports moves across.
+        """
+        self.gridsize = float(gridsize)
+        self.cellsize = float(cellsize)
+        self.half_size = half_size
+        cs = self.cellsize
+        self.cell_min = (int(math.floor(-half_size[0] / cs)),
+                         int(math.floor(-half_size[1] / cs)))
+        shape = (int(math.floor(half_size[0] / cs)) - self.cell_min[0] + 1,
+                 int(math.floor(half_size[1] / cs)) - self.cell_min[1] + 1)
+        self.blocked = numpy.zeros(shape, dtype=bool)
+        for poly in obstacles:
+            xs = [p[0] for p in poly]
+            ys = [p[1] for p in poly]
+            i0, j0 = self.cell_index(min(xs), min(ys))
+            i1, j1 = self.cell_index(max(xs), max(ys))
+            self.blocked[max(i0, 0):max(i1 + 1, 0),
+                         max(j0, 0):max(j1 + 1, 0)] = True
+
+    def cell_index(self, x, y):
+        """Return the (unclipped) blocked-grid index of a point."""
+        return (int(math.floor(x / self.cellsize)) - self.cell_min[0],
+                int(math.floor(y / self.cellsize)) - self.cell_min[1])
+
+    # fields which outlive a step (the rest is recomputed by every step)
+    STATE = ('tank_pos', 'tank_rot', 'tank_speed', 'tank_goal_speed',
+             'tank_angvel', 'tank_goal_angvel', 'tank_reload', 'tank_vel',
+             'tank_alive', 'tank_dead_timer', 'shot_pos', 'shot_vel',
+             'shot_distance', 'shot_active')
+
+    def snapshot(self):
+        """Return a copy of the state, for game.Game.snapshot."""
+        return ([getattr(self, name).copy() for name in self.STATE],
+                list(self.free_shots))
+
+    def restore(self, state):
+        """Put back a snapshot.
+
+        The arrays are overwritten in place, so views held by the tank and
+        shot objects stay valid.
+        """
+        arrays, free_shots = state
+        for name, saved in zip(self.STATE, arrays):
+            getattr(self, name)[...] = saved
+        self.free_shots[:] = free_shots
+
+    def add_tank(self, tank=None):
+        """Allocate the next tank row for tank and return its index."""
+        if self.ntanks == len(self.tank_pos):
+            raise ValueError('tank capacity exceeded')
+        slot = self.ntanks
+        self.ntanks += 1
+        self.tanks.append(tank)
+        return slot
+
+    def add_shot(self, shot=None):
+        """Allocate a shot row for shot and return its index."""
+        if not self.free_shots:
+            raise ValueError('shot capacity exceeded')
+        slot = self.free_shots.pop()
+        self.shot_distance[slot] = 0
+        self.shot_disp[slot] = 0
+        self.shot_active[slot] = True
+        self.shot_moved[slot] = False
+        self.shots[slot] = shot
+        return slot
+
+    def free_shot(self, slot):
+        """Return a shot row to the free list."""
+        self.shot_active[slot] = False
+        self.shot_moved[slot] = False
+        self.shots[slot] = None
+        self.free_shots.append(slot)
+
+    def step(self, dt, flags=()):
+        """Advance the kinematics of every tank and shot by dt.
+
+        With a broadphase set up, the clear tanks and shots are also moved;
+        flags is a list of the positions of the flags.  Returns the tank and
+        shot objects which moved into different spatial hash cells, to be
+        rebucketed.
+        """
+        self.step_tanks(dt)
+        self.step_shots(dt)
+        if self.blocked is None:
+            return [], []
+        self.find_clear(dt, flags)
+        return self.move_clear(dt)
+
+    def step_tanks(self, dt):
+        """Update reload timers, speeds, rotations and velocities.
+
+        Mirrors Tank.update_goals and Tank.velocity for all live tanks.
+        """
+        n = self.ntanks
+        self.tank_prev_vel[:n] = self.tank_vel[:n]
+        self.tank_updated[:n] = False
+        reload = self.tank_reload[:n]
+        reload -= numpy.where(reload > 0, dt, 0)
+
+        alive = self.tank_alive[:n]
+        self.tank_speed[:n] = numpy.where(alive, toward(self.tank_speed[:n],
+                self.tank_goal_speed[:n], constants.LINEARACCEL * dt),
+                self.tank_speed[:n])
+        self.tank_angvel[:n] = numpy.where(alive,
+                toward(self.tank_angvel[:n], self.tank_goal_angvel[:n],
+                       constants.ANGULARACCEL * dt),
+                self.tank_angvel[:n])
+        rot = self.tank_rot[:n]
+        # in the same order as the scalar code, to round the same way
+        rot += numpy.where(alive, self.tank_angvel[:n], 0) * \
+               constants.TANKANGVEL * dt
+        numpy.remainder(rot, 2 * math.pi, rot)
+
+        speed = self.tank_speed[:n]
+        self.tank_vel[:n, 0] = speed * numpy.cos(rot) * constants.TANKSPEED
+        self.tank_vel[:n, 1] = speed * numpy.sin(rot) * constants.TANKSPEED
+
+    def step_shots(self, dt):
+        """Compute this tick's displacement and travelled distance.
+
+        The displacement is applied (or swept) by the per-shot collision
+        check in Shot.update.
+        """
+        active = self.shot_active
+        numpy.multiply(self.shot_vel, dt, self.shot_disp)
+        self.shot_disp[~active] = 0
+        self.shot_distance += numpy.hypot(self.shot_disp[:, 0],
+                                          self.shot_disp[:, 1])
+
+    def find_clear(self, dt, flags=()):
+        """Flag the tanks and shots that cannot collide this tick."""
+        n = self.ntanks
+        dz = constants.DEADZONE[0]
+        tanks = numpy.flatnonzero(self.tank_alive[:n] &
+                                  (self.tank_pos[:n, 0] != dz))
+        shots = numpy.flatnonzero(self.shot_active &
+                                  (self.shot_pos[:, 0] != dz))
+        nt = len(tanks)
+        pos = numpy.concatenate((self.tank_pos[tanks], self.shot_pos[shots]))
+        disp = numpy.concatenate((self.tank_vel[tanks] * dt,
+                                  self.shot_disp[shots]))
+        radius = numpy.empty(len(pos))
+        radius[:nt] = constants.TANKRADIUS
+        radius[nt:] = constants.SHOTRADIUS
+
+        cells, ok = self.swept_cells(pos, disp, radius)
+        reach = radius + numpy.hypot(disp[:, 0], disp[:, 1])
+        ok &= ~self.conflicts(cells, pos, reach, nt)
+        ok &= ~self.near_zones(pos, reach, self.zones(dt, flags))
+        ok[nt:] &= self.shot_distance[shots] <= constants.SHOTRANGE
+
+        self.tank_clear[:n] = False
+        self.tank_clear[tanks] = ok[:nt]
+        self.tank_cells[:n] = -1
+        self.tank_cells[tanks] = cells[:nt]
+        self.shot_clear[:] = False
+        self.shot_clear[shots] = ok[nt:]
+        self.shot_cells[:] = -1
+        self.shot_cells[shots] = cells[nt:]
+
+    def zones(self, dt, flags):
+        """Return the circles (x, y, radius) around the flags and around
+        the bases where a tank may respawn during this tick."""
+        n = self.ntanks
+        dz = constants.DEADZONE[0]
+        alive = self.tank_alive[:n]
+        respawning = ((~alive & (self.tank_dead_timer[:n] - dt <= 0)) |
+                      (alive & (self.tank_pos[:n, 0] == dz) &
+                       (self.tank_pos[:n, 1] == constants.DEADZONE[1])))
+        zones = [self.tank_zone[:n][respawning]]
+        if len(flags):
+            circles = numpy.empty((len(flags), 3))
+            circles[:, :2] = flags
+            circles[:, 2] = constants.FLAGRADIUS
+            zones.append(circles)
+        return numpy.concatenate(zones)
+
+    def near_zones(self, pos, reach, zones):
+        """Return which objects may reach into any of the zones."""
+        near = numpy.zeros(len(pos), dtype=bool)
+        for x, y, radius in zones:
+            near |= (numpy.hypot(pos[:, 0] - x, pos[:, 1] - y) <=
+                     radius + reach)
+        return near
+
+    def move_clear(self, dt):
+        """Move every clear tank and shot, as Tank.move and Shot.update
+        would, and mark them as moved.
+
+        Returns the tank and shot objects which changed spatial hash cells.
+        """
+        n = self.ntanks
+        self.tank_moved[:n] = self.tank_clear[:n]
+        tanks = numpy.flatnonzero(self.tank_moved[:n])
+        before = self.tank_pos[tanks]
+        self.tank_last_pos[tanks] = before
+        after = before + self.tank_vel[tanks] * dt
+        self.tank_pos[tanks] = after
+        tanks = tanks[self.changed_cells(before, after,
+                                         constants.TANKRADIUS)]
+
+        self.shot_moved[:] = self.shot_clear
+        shots = numpy.flatnonzero(self.shot_moved)
+        before = self.shot_pos[shots]
+        after = before + self.shot_disp[shots]
+        self.shot_pos[shots] = after
+        shots = shots[self.changed_cells(before, after,
+                                         constants.SHOTRADIUS)]
+        return ([self.tanks[i] for i in tanks],
+                [self.shots[i] for i in shots])
+
+    def changed_cells(self, before, after, radius):
+        """Return which circles cover different spatial hash cells after
+        moving from before to after."""
+        gs = self.gridsize
+        changed = numpy.zeros(len(before), dtype=bool)
+        for offset in (-radius, radius):
+            changed |= (numpy.floor((before + offset) / gs) !=
+                        numpy.floor((after + offset) / gs)).any(axis=1)
+        return changed
+
+    def conflicts(self, cells, pos, reach, nt):
+        """Find objects which may touch a tank this tick.
+
+        The first nt objects are tanks and the rest shots.  Objects sharing
+        a cell conflict if their centers are within the sum of their reach
+        (radius plus travel), except that shots never conflict with shots
+        and tanks are not held up by shots.
+        """
+        owner = numpy.repeat(numpy.arange(len(cells)), 4)
+        flat = cells.ravel()
+        keep = flat >= 0
+        owner = owner[keep]
+        flat = flat[keep]
+        order = numpy.argsort(flat, kind='mergesort')
+        owner = owner[order]
+        flat = flat[order]
+
+        conflict = numpy.zeros(len(cells), dtype=bool)
+        k = 1
+        while k < len(flat):
+            same = flat[k:] == flat[:-k]
+            if not same.any():
+                break
+            a = owner[:-k][same]
+            b = owner[k:][same]
+            delta = pos[a] - pos[b]
+            close = (numpy.hypot(delta[:, 0], delta[:, 1]) <=
+                     reach[a] + reach[b])
+            a_tank = a < nt
+            b_tank = b < nt
+            conflict[a[close & b_tank]] = True
+            conflict[b[close & a_tank]] = True
+            k += 1
+        return conflict
+
+    def swept_cells(self, pos, disp, radius):
+        """Find the grid cells covered by circles moving by disp.
+
+        Returns an (n, 4) array of flat cell indices (-1 for duplicates) and
+        a mask of the circles which stay inside the walls, span at most 2x2
+        cells and touch no obstacle cell.  Cells of the circles failing any
+        of these tests are still reported, so that they count as occupied.
+        """
+        cs = self.cellsize
+        hx, hy = self.half_size
+        x0 = numpy.minimum(pos[:, 0], pos[:, 0] + disp[:, 0]) - radius
+        x1 = numpy.maximum(pos[:, 0], pos[:, 0] + disp[:, 0]) + radius
+        y0 = numpy.minimum(pos[:, 1], pos[:, 1] + disp[:, 1]) - radius
+        y1 = numpy.maximum(pos[:, 1], pos[:, 1] + disp[:, 1]) + radius
+        ok = (x0 >= -hx) & (y0 >= -hy) & (x1 <= hx) & (y1 <= hy)
+
+        nx, ny = self.blocked.shape
+        ix0 = numpy.floor(x0 / cs).astype(int) - self.cell_min[0]
+        ix1 = numpy.floor(x1 / cs).astype(int) - self.cell_min[0]
+        iy0 = numpy.floor(y0 / cs).astype(int) - self.cell_min[1]
+        iy1 = numpy.floor(y1 / cs).astype(int) - self.cell_min[1]
+        ok &= (ix1 - ix0 <= 1) & (iy1 - iy0 <= 1)
+        for index, top in ((ix0, nx), (ix1, nx), (iy0, ny), (iy1, ny)):
+            numpy.clip(index, 0, top - 1, index)
+
+        cells = numpy.empty((len(pos), 4), dtype=int)
+        cells[:, 0] = ix0 * ny + iy0
+        cells[:, 1] = numpy.where(iy1 != iy0, ix0 * ny + iy1, -1)
+        cells[:, 2] = numpy.where(ix1 != ix0, ix1 * ny + iy0, -1)
+        cells[:, 3] = numpy.where((ix1 != ix0) & (iy1 != iy0),
+                                  ix1 * ny + iy1, -1)
+        blocked = self.blocked.ravel()[numpy.maximum(cells, 0)] & (cells >= 0)
+        ok &= ~blocked.any(axis=1)
+        return cells, ok
+
+
+def toward(value, goal, by):
+    """Move value toward goal by at most by (vectorized Tank.update_goal).
+
+    >>> toward(numpy.array([0.0, 1.0, 0.5]), numpy.array([1.0, 0.0, 0.6]), 0.25)
+    array([0.25, 0.75, 0.6 ])
+    """
+    return numpy.where(value < goal, numpy.minimum(value + by, goal),
+                       numpy.maximum(value - by, goal))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+# vim: et sw=4 sts=4
@@ -71,6 +71,16 @@ rotation = Group((Keyword('rot') | Keyword('rotation')) + floatnum)
 obstacle_items = [position, Optional(size), Optional(rotation)]
 
 
+def plain_state(obj):
+    """Return obj's attributes with parse results turned into lists, so
+    parsed objects pickle compactly (see :mod:`worldcache`)."""
+    state = dict(obj.__dict__)
+    for name in ('pos', 'size'):
+        if state.get(name) is not None:
+            state[name] = list(state[name])
+    return state
+
+
 class Box(object):
     """A basic obstacle type."""
 
@@ -84,6 +94,8 @@ class Box(object):
         if not self.pos:
             raise ValueError('Position is required')
 
+    __getstate__ = plain_state
+
     @classmethod
     def parser(cls):
         box_contents = Each(obstacle_items)
@@ -108,6 +120,8 @@ class Base(object):
         if not self.pos:
             raise ValueError('Position is required')
 
+    __getstate__ = plain_state
+
     @classmethod
     def parser(cls):
         color = Group(Keyword('color') + integer)
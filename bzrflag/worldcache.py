@@ -0,0 +1,146 @@
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""On-disk cache of parsed worlds and their occupancy grids.
+
+Parsing a large .bzw file with the pyparsing grammar and rasterizing its
+occupancy grid can take a large part of a short game's startup.  Entries are
+keyed by a hash of the world text and size, so an edited map simply gets a
+new entry.  Worlds are pickled; grids are stored as .npy files and memory
+mapped read-only when loaded, so many games on the same map share one copy.
+
+"""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import os
+import errno
+import hashlib
+import logging
+import cPickle as pickle
+import tempfile
+
+import numpy
+
+logger = logging.getLogger('worldcache')
+
+# Bump whenever the parser or the grid rasterization changes, so stale
+# entries are ignored.
+VERSION = 1
+
+
+def world_key(text, width, height):
+    """Return the cache key for a world file's text at the given size.
+
+    >>> world_key('box end', 800, 800) == world_key('box end', 800, 800)
+    True
+    >>> world_key('box end', 800, 800) == world_key('box end', 400, 400)
+    False
+    """
+    digest = hashlib.sha1('%d %dx%d\n' % (VERSION, width, height))
+    digest.update(text)
+    return digest.hexdigest()
+
+
+class WorldCache(object):
+    """A directory of cached worlds and occupancy grids."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key, ext):
+        return os.path.join(self.directory, key + ext)
+
+    def load_world(self, key):
+        """Return the cached World for key, or None."""
+        path = self.path(key, '.world')
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            return pickle.load(f)
+        except Exception, e:
+            logger.warning('ignoring unreadable world cache %s: %s'
+                           % (path, e))
+            return None
+        finally:
+            f.close()
+
+    def save_world(self, key, world):
+        self.write(self.path(key, '.world'),
+                   lambda f: pickle.dump(world, f, pickle.HIGHEST_PROTOCOL))
+
+    def load_grid(self, key):
+        """Return the cached occupancy grid for key as a read-only memory
+        mapped array, or None."""
+        path = self.path(key, '.npy')
+        if not os.path.exists(path):
+            return None
+        try:
+            return numpy.load(path, mmap_mode='r')
+        except Exception, e:
+            logger.warning('ignoring unreadable grid cache %s: %s'
+                           % (path, e))
+            return None
+
+    def save_grid(self, key, grid):
+        self.write(self.path(key, '.npy'), lambda f: numpy.save(f, grid))
+
+    def write(self, path, dump):
+        """Write a cache file atomically.
+
+        Games running in parallel may race to fill the same entry; each
+        writes its own temporary file and renames it into place.  Failures
+        are logged and otherwise ignored, as the cache is only an
+        optimization.
+        """
+        try:
+            os.makedirs(self.directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                logger.warning('cannot create world cache %s: %s'
+                               % (self.directory, e))
+                return
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            f = os.fdopen(fd, 'wb')
+            try:
+                dump(f)
+            finally:
+                f.close()
+            os.chmod(tmp, 0644)
+            os.rename(tmp, path)
+        except (IOError, OSError), e:
+            logger.warning('cannot write world cache %s: %s' % (path, e))
+            if tmp is not None and os.path.exists(tmp):
+                os.remove(tmp)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
+
+# vim: et sw=4 sts=4
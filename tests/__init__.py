@@ -0,0 +1,84 @@
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Unit tests for BZRFlag, and the helpers they share for playing games."""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import os
+import random
+
+# The names config and game here would be taken by the test modules of the
+# same names as they are imported.
+import bzrflag.config
+import bzrflag.game
+
+WORLD = "--world=" + os.path.join(os.path.dirname(__file__), "..", "maps",
+                                  "test.bzw")
+
+
+def make_game_loop(*args):
+    """Return a game loop on the test world, seeded and with quick
+    respawns, given any further command line arguments."""
+    cfg = bzrflag.config.Config(['--test', WORLD, '--seed=5', '--respawn-time=1']
+                        + list(args))
+    return bzrflag.game.GameLoop(cfg)
+
+
+def drive(g, seed, ticks, each_tick=None):
+    """Give every tank random commands (drawn with the given seed) and
+    shoot, then update the game g, ticks times.  each_tick(g) is called
+    before each update."""
+    rand = random.Random(seed)
+    for i in xrange(ticks):
+        for team in g.teams.values():
+            for tankid in xrange(len(team.tanks)):
+                team.speed(tankid, rand.uniform(-1, 1))
+                team.angvel(tankid, rand.uniform(-1, 1))
+                team.shoot(tankid)
+        if each_tick is not None:
+            each_tick(g)
+        g.update(0.05)
+
+
+def tank_fields(tank):
+    return tank.pos[0], tank.pos[1], tank.rot
+
+
+def shot_fields(shot):
+    return shot.pos[0], shot.pos[1]
+
+
+def state(g, tank=tank_fields, shot=shot_fields):
+    """Return the tanks, shots and scores of the game g, to compare games.
+
+    Each tank is its callsign and status followed by tank(t), and each
+    shot is shot(s).
+    """
+    tanks = [(t.callsign, t.status) + tuple(tank(t)) for t in g.tanks()]
+    shots = [tuple(shot(s)) for s in g.shots()]
+    scores = [team.score.total() for team in g.teams.values()]
+    return tanks, shots, scores
+
+# vim: et sw=4 sts=4
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Unit test for BZRFlag module benchmark.py."""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+
+import os
+
+import unittest
+from bzrflag import benchmark
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.dirname(__file__)
+        self.world = os.path.join(path, "..", "maps", "test.bzw")
+
+    def testRuns(self):
+        runs = benchmark.runs(['a.bzw', 'b.bzw'], [10, 20], [5], 100,
+                              ['--vectorized'])
+        self.assertEquals(len(runs), 4)
+        self.assertEquals(runs[1]['tanks'], 20)
+        self.assertEquals(runs[3]['map'], 'b.bzw')
+        self.assertEquals(runs[3]['args'], ['--vectorized'])
+
+    def testRunOne(self):
+        run = benchmark.runs([self.world], [2], [3], 5)[0]
+        result = benchmark.run_one(run)
+        self.assertTrue(result['ticks_per_s'] > 0)
+        self.assertTrue(result['tick_p50_ms'] <= result['tick_p99_ms'])
+        self.assertTrue(result['peak_rss_kb'] > 0)
+        self.assertTrue(result['shots'] <= 2 * 4 * 3)
+
+    def testCompare(self):
+        old = {'results': [{'map': 'a.bzw', 'tanks': 10, 'max_shots': 5,
+                            'args': [], 'ticks_per_s': 100.0}]}
+        new = {'results': [{'map': 'a.bzw', 'tanks': 10, 'max_shots': 5,
+                            'args': [], 'ticks_per_s': 150.0},
+                           {'map': 'b.bzw', 'tanks': 10, 'max_shots': 5,
+                            'args': [], 'ticks_per_s': 150.0}]}
+        lines = benchmark.compare(old, new)
+        self.assertEquals(len(lines), 2)
+        self.assertTrue(lines[1].endswith('+50.0%'))
+
+# vim: et sw=4 sts=4
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Unit test for BZRFlag module binary.py."""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+
+import numpy
+
+import unittest
+from bzrflag import binary
+
+
+class BinaryTest(unittest.TestCase):
+
+    def testSection(self):
+        records = [binary.shot.pack(1, 2, 3, 4), binary.shot.pack(5, 6, 7, 8)]
+        data = binary.section(records)
+        self.assertEquals(binary.count.unpack_from(data), (2,))
+        self.assertEquals(binary.shot.unpack_from(data, binary.count.size
+                                                  + binary.shot.size),
+                          (5, 6, 7, 8))
+
+    def testOccgrid(self):
+        grid = numpy.zeros((3, 5), bool)
+        grid[0, 0] = grid[1, 2] = grid[2, 4] = True
+        data = binary.occgrid((-10, 20), grid)
+        length, kind = binary.header.unpack_from(data)
+        self.assertEquals(kind, binary.OCCGRID)
+        self.assertEquals(length, len(data) - binary.header.size)
+        offset = binary.header.size
+        self.assertEquals(binary.occgrid_header.unpack_from(data, offset),
+                          (-10, 20, 3, 5))
+        bits = numpy.fromstring(data[offset + binary.occgrid_header.size:],
+                                numpy.uint8)
+        unpacked = numpy.unpackbits(bits)[:15].reshape(3, 5)
+        self.assertTrue((unpacked == grid).all())
+
+    def testDelta(self):
+        last = {}
+        first = [binary.flag.pack(1, binary.NONE, 0, 0),
+                 binary.flag.pack(2, binary.NONE, 5, 5)]
+        self.assertEquals(binary.delta(first, last, 1), first)
+        moved = binary.flag.pack(2, 1, 6, 5)
+        self.assertEquals(binary.delta([first[0], moved], last, 1), [moved])
+        self.assertEquals(len(last), 2)
+
+# vim: et sw=4 sts=4
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Unit test for the agent client bzagents/bzrc.py."""
+
+from __future__ import absolute_import
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import os
+import select
+import socket
+import sys
+import threading
+
+import numpy
+
+import unittest
+from bzrflag import binary
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bzagents"))
+import bzrc
+
+# Responses as the server sends them.
+MYTANKS = """ack 0.1 mytanks
+begin
+mytank 0 red0 alive 10 0 -  -376 -5 -1.13082841481 0.0 -0.0 0
+mytank 1 red1 dead 9 3.5 green  -362 -4 -1.42943514647 2.5 -1.0 0.5
+end
+"""
+OTHERTANKS = """ack 0.2 othertanks
+begin
+othertank blue0 blue alive - -4.85846385187 369.840824176 -0.873090908304
+othertank green1 green dead red 367.434033451 0.710302054587 1.00840996514
+end
+"""
+FLAGS = """ack 0.3 flags
+begin
+flag blue none 0.0 370.0
+flag red green -370.0 0.0
+end
+"""
+SHOTS = """ack 0.4 shots
+begin
+shot -376.190230059 -5.35740924164 42.5910433158 -90.4765330308
+shot 10 20 -30 40
+end
+"""
+STATE = """ack 0.5 state
+begin
+state 2.8 140
+mytank 0 red0 alive 9 3.5 -  -376 -5 -1.13082841481 0.0 -0.0 0
+othertank blue0 blue alive - -4.85846385187 369.840824176 -0.873090908304
+flag blue none 0.0 370.0
+flag red none -370.0 0.0
+shot -376.190230059 -5.35740924164 42.5910433158 -90.4765330308
+end
+"""
+FRAME = """frame 2.82 141 full
+mytank 0 red0 alive 9 3.48 -  -376 -5 -1.13082841481 0.0 -0.0 0
+othertank blue0 blue alive - -4.85846385187 369.840824176 -0.873090908304
+flag blue none 0.0 370.0
+shot -375.338409192 -7.1669399022 42.5910433158 -90.4765330308
+end
+"""
+SHOOT = """ack 0.6 shoot 0
+ok
+"""
+
+
+class ClientTest(unittest.TestCase):
+    """Drive a BZRC over a socket pair, playing the server's part."""
+
+    def setUp(self):
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def connect(self, binary=False, compact=False):
+        self.server, sock = socket.socketpair()
+        self.sockets += [self.server, sock]
+        # a client waiting on a response which never comes fails the test
+        # instead of hanging it
+        sock.settimeout(5)
+        self.server.sendall('bzrobots 1\n')
+        self.client = bzrc.BZRC(None, None, binary=binary, compact=compact,
+                                sock=sock)
+        if binary:
+            self.assertEquals(self.received(), 'agent 2 binary\n')
+        else:
+            self.assertEquals(self.received(), 'agent 1\n')
+
+    def send(self, data):
+        self.server.sendall(data)
+
+    def received(self):
+        """Return what the client has sent so far."""
+        data = ''
+        while select.select([self.server], [], [], 0)[0]:
+            data += self.server.recv(65536)
+        return data
+
+
+class PipelineTest(ClientTest):
+
+    def setUp(self):
+        ClientTest.setUp(self)
+        self.connect()
+
+    def testPartialResponses(self):
+        tanks = self.client.request('mytanks')
+        shot = self.client.request('shoot', 0)
+        self.assertEquals(self.client.poll(), 2)
+        self.assertEquals(self.received(), 'mytanks\nshoot 0\n')
+        # split within a line, then between lines, then after the first
+        # response
+        data = MYTANKS + SHOOT
+        cuts = [0, 30, MYTANKS.index('mytank 1'), len(MYTANKS), len(data)]
+        pending = [2, 2, 1, 0]
+        for start, end, count in zip(cuts, cuts[1:], pending):
+            self.send(data[start:end])
+            self.assertEquals(self.client.poll(), count)
+            self.assertEquals(tanks.done(), count < 2)
+            self.assertEquals(shot.done(), count < 1)
+        self.assertEquals([tank.callsign for tank in tanks.result()],
+                          ['red0', 'red1'])
+        self.assertEquals(tanks.result()[1].vx, 2.5)
+        self.assertEquals(shot.result(), True)
+        self.assertEquals(self.client.poll(), 0)
+
+    def testFail(self):
+        flags = self.client.request('flags')
+        shot = self.client.request('shoot', 0)
+        self.send('fail invalid command\n' + SHOOT)
+        self.assertEquals(self.client.poll(), 0)
+        self.assertRaises(bzrc.UnexpectedResponse, flags.result)
+        self.assertEquals(shot.result(), True)
+
+    def testFrames(self):
+        tanks = self.client.request('mytanks')
+        shots = self.client.request('shots')
+        self.client.poll()
+        # a frame between the responses, and one cut in two within the
+        # second response
+        later = FRAME.replace('2.82 141', '2.84 142').replace('3.48', '3.46')
+        cut = later.index('flag')
+        self.send(MYTANKS + FRAME + SHOTS[:20] + later[:cut])
+        self.assertEquals(self.client.poll(), 1)
+        self.assertTrue(tanks.done())
+        self.assertFalse(shots.done())
+        self.assertEquals(self.client.frame.tick, 141)
+        self.send(later[cut:] + SHOTS[20:])
+        self.assertEquals(self.client.poll(), 0)
+        self.assertEquals(len(shots.result()), 2)
+        self.assertEquals(self.client.frame.tick, 142)
+        self.assertEquals(self.client.frame.mytanks[0].time_to_reload, 3.46)
+        self.assertEquals(len(self.client.frame.flags), 1)
+
+    def testBlockingCall(self):
+        tanks = self.client.request('mytanks')
+        shot = self.client.request('shoot', 0)
+        # the client sends the requests and reads their responses before
+        # its own
+        self.send(MYTANKS + SHOOT + FLAGS)
+        flags = self.client.get_flags()
+        self.assertEquals(self.received(), 'mytanks\nshoot 0\nflags\n')
+        self.assertTrue(tanks.done())
+        self.assertTrue(shot.done())
+        self.assertEquals([flag.color for flag in flags], ['blue', 'red'])
+        self.assertFalse(self.client.pending)
+
+    def testResult(self):
+        tanks = self.client.request('mytanks')
+        shot = self.client.request('shoot', 0)
+        self.send(MYTANKS + SHOOT)
+        self.assertEquals(shot.result(), True)
+        self.assertTrue(tanks.done())
+
+    def testCannotPipeline(self):
+        self.assertRaises(ValueError, self.client.request, 'subscribe', 1)
+
+
+class CompactTest(ClientTest):
+
+    def fetch(self, compact, response, method):
+        self.connect(compact=compact)
+        self.send(response)
+        return getattr(self.client, method)()
+
+    def assertSameRecords(self, records, answers):
+        self.assertEquals(len(records), len(answers))
+        for record, answer in zip(records, answers):
+            self.assertEquals(dict(record._asdict()), answer.__dict__)
+
+    def testRecords(self):
+        for response, method, record in ((MYTANKS, 'get_mytanks',
+                                          bzrc.MyTank),
+                                         (OTHERTANKS, 'get_othertanks',
+                                          bzrc.OtherTank),
+                                         (FLAGS, 'get_flags', bzrc.Flag),
+                                         (SHOTS, 'get_shots', bzrc.Shot)):
+            records = self.fetch(True, response, method)
+            self.assertTrue(records)
+            for item in records:
+                self.assertTrue(isinstance(item, record))
+            self.assertSameRecords(records,
+                                   self.fetch(False, response, method))
+
+    def testState(self):
+        compact = self.fetch(True, STATE, 'get_state')
+        state = self.fetch(False, STATE, 'get_state')
+        self.assertEquals((compact.time, compact.tick), (2.8, 140))
+        self.assertEquals((state.time, state.tick), (2.8, 140))
+        for section in ('mytanks', 'othertanks', 'flags', 'shots'):
+            self.assertSameRecords(getattr(compact, section),
+                                   getattr(state, section))
+
+    def testFrame(self):
+        compact = self.fetch(True, FRAME, 'poll_frame')
+        frame = self.fetch(False, FRAME, 'poll_frame')
+        self.assertEquals((compact.time, compact.tick), (2.82, 141))
+        for section in ('mytanks', 'othertanks', 'flags', 'shots'):
+            self.assertSameRecords(getattr(compact, section),
+                                   getattr(frame, section))
+
+    def testSplitBlock(self):
+        self.connect(compact=True)
+        cut = OTHERTANKS.index('green1')
+        self.send(OTHERTANKS[:cut])
+        # the rest arrives while the client is reading the block
+        timer = threading.Timer(0.05, self.send, [OTHERTANKS[cut:]])
+        timer.start()
+        try:
+            tanks = self.client.get_othertanks()
+        finally:
+            timer.join()
+        self.assertEquals([tank.callsign for tank in tanks],
+                          ['blue0', 'green1'])
+        self.assertEquals(tanks[1].angle, 1.00840996514)
+
+    def testSplitBlockPoll(self):
+        self.connect(compact=True)
+        tanks = self.client.request('othertanks')
+        self.assertEquals(self.client.poll(), 1)
+        cut = OTHERTANKS.index('green1')
+        self.send(OTHERTANKS[:cut])
+        self.assertEquals(self.client.poll(), 1)
+        self.send(OTHERTANKS[cut:])
+        self.assertEquals(self.client.poll(), 0)
+        self.assertSameRecords(tanks.result(),
+                               self.fetch(False, OTHERTANKS,
+                                          'get_othertanks'))
+
+    def testMalformed(self):
+        good = 'mytank 0 red0 alive 10 0 - -376 -5 -1.1 0.0 -0.0 0\n'
+        for bad in ('mytank 1 red1 alive 10 0 - -376 -5 -1.1 0.0 -0.0\n',
+                    'mytank 1 red1 alive 10 0 - -376 -5 -1.1 0.0 -0.0 0 1\n',
+                    'mytank 1 red1 alive ten 0 - -376 -5 -1.1 0.0 -0.0 0\n',
+                    'flag blue none 0.0 370.0\n'):
+            self.connect(compact=True)
+            self.send('ack 0.1 mytanks\nbegin\n' + bad + good + 'end\n')
+            self.assertRaises(bzrc.UnexpectedResponse,
+                              self.client.get_mytanks)
+
+
+class OccgridTest(ClientTest):
+
+    def setUp(self):
+        ClientTest.setUp(self)
+        self.grid = numpy.random.RandomState(3).rand(40, 30) > 0.7
+        self.data = binary.occgrid((-20, 10), self.grid)
+
+    def testBinary(self):
+        self.connect(binary=True)
+        self.send(binary.frame(binary.TEXT, 'ack 1.0 occgrid 0\n')
+                  + self.data)
+        pos, grid = self.client.get_occgrid(0)
+        self.assertEquals(self.received(), 'occgrid 0\n')
+        self.assertEquals(pos, (-20, 10))
+        self.assertTrue((grid == self.grid).all())
+
+    def testWithoutNumpy(self):
+        self.connect(binary=True)
+        self.send(binary.frame(binary.TEXT, 'ack 1.0 occgrid 0\n')
+                  + self.data)
+        saved, bzrc.numpy = bzrc.numpy, None
+        try:
+            pos, grid = self.client.get_occgrid(0)
+        finally:
+            bzrc.numpy = saved
+        self.assertEquals(pos, (-20, 10))
+        self.assertTrue(isinstance(grid, list))
+        self.assertEquals(grid, self.grid.astype(int).tolist())
+
+# vim: et sw=4 sts=4
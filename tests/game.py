@@ -28,9 +28,11 @@ __copyright__ = "Copyright 2008-2011 Brigham Young University"
 __license__ = "GNU GPL"
 
 import os
+import math
 
 import unittest
-from bzrflag import game, config
+from bzrflag import game, config, collisiontest
+from tests import make_game_loop, drive, state
 
 
 class GameTest(unittest.TestCase):
@@ -40,7 +42,7 @@ class GameTest(unittest.TestCase):
         world = "--world="+os.path.join(path, "..", "maps", "test.bzw")
         self.config = config.Config(['--test', world])
         self.game_loop = game.GameLoop(self.config)
-        self.game_loop.update_game()
+        self.game_loop.step()
         self.team = "red"
 
     def tearDown(self):
@@ -52,4 +54,229 @@ class GameTest(unittest.TestCase):
         self.assertEquals(len(list(self.game_loop.game.tanks())), 40)
         self.assertEquals(len(list(self.game_loop.game.shots())), 0)
 
+    def testBroadphase(self):
+        game = self.game_loop.game
+        self.assertEquals(len(game.obstacle_grid), len(game.obstacles))
+        for tank in game.tanks():
+            self.assertTrue(tank in game.tanks_near(tank.pos, 0))
+        tank = game.teams['red'].tanks[0]
+        tank.kill()
+        self.assertFalse(tank in game.tank_grid)
+
+    def testRotatedOccgrid(self):
+        game = self.game_loop.game
+        grid = game.occgrid
+        offset = self.config.world.width / 2
+        obstacle = [o for o in game.obstacles if o.rot != 0][0]
+        x, y = [int(c) + offset for c in obstacle.pos]
+        for i in xrange(x - 30, x + 30):
+            for j in xrange(y - 30, y + 30):
+                center = (i - offset + 0.5, j - offset + 0.5)
+                inside = any(collisiontest.point_in_poly(center, o.shape)
+                             for o in game.obstacles)
+                self.assertEquals(bool(grid[i, j]), inside)
+
+
+class ShotTest(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.dirname(__file__)
+        world = "--world="+os.path.join(path, "..", "maps", "test.bzw")
+        self.config = config.Config(['--test', world])
+        self.game_loop = game.GameLoop(self.config)
+        self.game_loop.step()
+        self.game = self.game_loop.game
+
+    def tearDown(self):
+        del self.game_loop
+
+    def place(self, tank, pos):
+        tank.pos = list(pos)
+        tank.status = game.constants.TANKALIVE
+        tank.reset_speed()
+        self.game.move_tank(tank)
+
+    def fire(self, tank, rot):
+        tank.rot = rot
+        tank.reloadtimer = 0
+        self.assertTrue(tank.shoot())
+        return tank.shots[-1]
+
+    def testFastShotHitsTank(self):
+        red = self.game.teams['red'].tanks[0]
+        green = self.game.teams['green'].tanks[0]
+        self.place(red, (0, 300))
+        self.place(green, (0, 360))
+        shot = self.fire(red, math.pi/2)
+        # one step carries the shot well past the target
+        shot.update(1.0)
+        self.assertEquals(green.status, game.constants.TANKDEAD)
+        self.assertEquals(shot.status, game.constants.SHOTDEAD)
+        radii = game.constants.TANKRADIUS + game.constants.SHOTRADIUS
+        self.assertAlmostEqual(shot.pos[1], 360 - radii)
+
+    def testFastShotStopsAtWall(self):
+        red = self.game.teams['red'].tanks[0]
+        self.place(red, (0, 350))
+        shot = self.fire(red, math.pi/2)
+        shot.update(1.0)
+        self.assertEquals(shot.status, game.constants.SHOTDEAD)
+        self.assertAlmostEqual(shot.pos[1], 400 - game.constants.SHOTRADIUS)
+
+    def testShotPool(self):
+        red = self.game.teams['red'].tanks[0]
+        self.place(red, (0, 0))
+        first = self.fire(red, 0)
+        second = self.fire(red, math.pi)
+        first.kill()
+        self.assertEquals(red.shots, [second])
+        self.assertEquals(second.index, 0)
+        self.assertEquals(len(self.game.shot_pool), 1)
+        third = self.fire(red, math.pi/2)
+        self.assertTrue(third is first)
+        self.assertEquals(third.status, game.constants.SHOTALIVE)
+        self.assertEquals(third.distance, 0)
+        red.kill()
+        self.assertEquals(red.shots, [])
+        self.assertEquals(len(self.game.shot_pool), 2)
+
+    def testKillWithDeadShot(self):
+        red = self.game.teams['red'].tanks[0]
+        self.place(red, (0, 0))
+        live = self.fire(red, 0)
+        dead = self.fire(red, math.pi)
+        dead.kill()
+        red.shots.append(dead)
+        red.kill()
+        self.assertEquals(red.shots, [])
+        self.assertEquals(live.status, game.constants.SHOTDEAD)
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def state(self, g):
+        flags = [(tuple(team.flag.pos), team.flag.tank)
+                 for team in g.teams.values()]
+        return (g.tick, g.timespent, flags) + state(g,
+                lambda t: (tuple(t.pos), t.rot, t.speed, t.reloadtimer,
+                           len(t.shots)),
+                lambda s: (tuple(s.pos), tuple(s.vel), s.distance))
+
+    def check(self, *args):
+        g = make_game_loop(*args).game
+        drive(g, 1, 60)
+        before = self.state(g)
+        snapshot = g.snapshot()
+        drive(g, 2, 40)
+        after = self.state(g)
+        self.assertNotEqual(after, before)
+        g.restore(snapshot)
+        self.assertEqual(self.state(g), before)
+        # the same future plays out the same way again
+        drive(g, 2, 40)
+        self.assertEqual(self.state(g), after)
+        with g.rollout():
+            drive(g, 3, 40)
+        self.assertEqual(self.state(g), after)
+        for tank in g.tanks():
+            for i, shot in enumerate(tank.shots):
+                self.assertEqual(shot.index, i)
+                self.assertTrue(shot in g.shot_grid)
+        return g
+
+    def testRestore(self):
+        self.check()
+
+    def testRestoreSprites(self):
+        for args in ((), ('--vectorized',)):
+            game_loop = make_game_loop(*args)
+            g = game_loop.game
+            # with a display, shots go through the inbox and trash
+            game_loop.config.options['test'] = False
+            shown = set()
+            def show(g):
+                """Do what GameLoop.update_graphics does with shots."""
+                while g.inbox:
+                    item = g.inbox.pop()
+                    if isinstance(item, game.Shot):
+                        shown.add(item)
+                while g.trash:
+                    shot = g.trash.pop()
+                    shown.remove(shot)
+                    g.shot_pool.release(shot)
+            drive(g, 1, 60, show)
+            show(g)
+            snapshot = g.snapshot()
+            drive(g, 2, 40, show)
+            show(g)
+            g.restore(snapshot)
+            show(g)
+            self.assertTrue(shown)
+            self.assertEqual(shown, set(g.shots()))
+
+    def testRestoreVectorized(self):
+        g = self.check('--vectorized')
+        live = len(list(g.shots()))
+        self.assertEqual(g.arrays.shot_active.sum(), live)
+        self.assertEqual(len(g.arrays.free_shots) + live,
+                         len(g.arrays.shot_active))
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.dirname(__file__)
+        world = "--world="+os.path.join(path, "..", "maps", "test.bzw")
+        self.config = config.Config(['--test', world, '--tick-rate=20'])
+        self.game_loop = game.GameLoop(self.config)
+
+    def tearDown(self):
+        del self.game_loop
+
+    def testFixedSteps(self):
+        self.game_loop.clock -= 0.33
+        self.game_loop.run_physics()
+        self.assertAlmostEqual(self.game_loop.game.timespent, 0.3)
+        self.assertEquals(self.game_loop.game.tick, 6)
+        self.assertTrue(0.03 <= self.game_loop.accumulator < 0.05)
+        self.assertTrue(self.game_loop.time_to_next_event() <= 0.02)
+
+    def testCatchUpLimit(self):
+        self.game_loop.clock -= 10
+        self.game_loop.run_physics()
+        self.assertEquals(self.game_loop.game.tick,
+                          game.constants.MAX_CATCHUP_STEPS)
+        self.assertEquals(self.game_loop.accumulator, 0)
+
+
+class FastForwardTest(unittest.TestCase):
+
+    class MockAgent:
+        established = True
+        requests = 1
+        subscription = None
+
+    class MockServer:
+        pass
+
+    def setUp(self):
+        path = os.path.dirname(__file__)
+        world = "--world="+os.path.join(path, "..", "maps", "test.bzw")
+        self.config = config.Config(['--test', world, '--fast-forward',
+                                     '--tick-rate=20', '--step-timeout=0'])
+        self.game_loop = game.GameLoop(self.config)
+        self.game_loop.running = True
+
+    def tearDown(self):
+        del self.game_loop
+
+    def testStep(self):
+        srv = self.MockServer()
+        srv.handlers = [self.MockAgent()]
+        self.game_loop.servers.append(srv)
+        for i in xrange(40):
+            self.game_loop.step()
+        self.assertAlmostEqual(self.game_loop.game.timespent, 2.0)
+        self.assertEquals(srv.handlers[0].requests, 0)
+
 # vim: et sw=4 sts=4
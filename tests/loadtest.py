@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Unit test for BZRFlag module loadtest.py."""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+
+import os
+
+import unittest
+from bzrflag import loadtest
+
+
+class LoadTest(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.dirname(__file__)
+        self.world = os.path.join(path, "..", "maps", "test.bzw")
+
+    def testSummarize(self):
+        samples = {'shoot': ([0.001] * 99 + [0.1], [0.002] * 100)}
+        report = loadtest.summarize(2.0, samples)
+        self.assertEquals(report['shoot']['count'], 100)
+        self.assertEquals(report['shoot']['per_s'], 50)
+        self.assertAlmostEqual(report['shoot']['ack_p50_ms'], 1)
+        self.assertTrue(report['shoot']['ack_p999_ms'] > 90)
+        self.assertAlmostEqual(report['shoot']['done_p99_ms'], 2)
+
+    def testRun(self):
+        server, ports = loadtest.start_server(self.world, 2,
+                                              ['--occgrid-width=20'])
+        try:
+            opts = {'mix': 'drive,poll,occgrid', 'tanks': 10, 'depth': 4,
+                    'rate': 0, 'duration': 1, 'connections': 2}
+            report = loadtest.run('localhost', ports, opts)
+        finally:
+            server.kill()
+            server.wait()
+        self.assertEquals(sorted(report), ['angvel', 'mytanks', 'occgrid',
+                                           'othertanks', 'shoot', 'speed'])
+        for entry in report.values():
+            self.assertTrue(entry['count'] > 0)
+            self.assertTrue(entry['ack_p50_ms'] <= entry['done_p99_ms'])
+        # every drive burst is speed, angvel and shoot in turn
+        self.assertTrue(abs(report['speed']['count'] -
+                            report['shoot']['count']) <= 2 * len(ports))
+
+# vim: et sw=4 sts=4
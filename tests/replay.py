@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Unit test for BZRFlag module replay.py."""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+
+import os
+import random
+import shutil
+import tempfile
+
+import unittest
+from bzrflag import config, game, replay
+from tests import make_game_loop, drive, state
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'game.bzr')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def record(self, *args):
+        """Play a game with random commands, recording it."""
+        game_loop = make_game_loop('--record=%s' % self.path, *args)
+        def each_tick(g):
+            for team in g.teams.values():
+                # noise drawn for the agents must not change the game
+                random.random()
+            team.taunt('taunt')
+        drive(game_loop.game, 7, 100, each_tick)
+        game_loop.recorder.close()
+        return game_loop.game
+
+    def play(self, *args):
+        cfg = config.Config(['--test', '--replay=%s' % self.path] +
+                            list(args))
+        game_loop = game.GameLoop(cfg)
+        game_loop.loop()
+        return game_loop.game
+
+    def testPlayback(self):
+        recorded = self.record()
+        played = self.play()
+        self.assertEqual(played.seed, recorded.seed)
+        self.assertEqual(played.tick, 100)
+        self.assertTrue(played.end_game)
+        self.assertEqual(state(played), state(recorded))
+
+    def testPlaybackVectorized(self):
+        recorded = self.record('--vectorized', '--seed=3')
+        played = self.play()
+        self.assertEqual(played.seed, 3)
+        self.assertTrue(played.arrays is not None)
+        self.assertEqual(state(played), state(recorded))
+
+    def testHeader(self):
+        self.record('--seed=3')
+        header = replay.load_header(self.path)
+        self.assertEqual(header['seed'], 3)
+        self.assertTrue('--seed=3' in header['argv'])
+        self.assertEqual(sorted(header['teams']), header['teams'])
+
+    def testBadFile(self):
+        open(self.path, 'wb').write('not a replay')
+        self.assertRaises(Exception, replay.load_header, self.path)
+
+# vim: et sw=4 sts=4
@@ -28,11 +28,12 @@ __copyright__ = "Copyright 2008-2011 Brigham Young University"
 __license__ = "GNU GPL"
 
 from cStringIO import StringIO
+import base64
 import asyncore
 import os
 import unittest
 
-from bzrflag import server, config
+from bzrflag import server, config, constants, game, stats, binary
 
 LISTEN_SOCK_FILENO = 5
 CONN_SOCK_1_FILENO = 11
@@ -63,6 +64,17 @@ class HandlerTest(unittest.TestCase):
         self.serverRead()
         self.assertIn("ok", self.clientRead())
 
+    def testBatch(self):
+        self.handshake()
+        self.clientWrite('batch 0 1 - 1 1 - 0.5 0\n')
+        self.serverRead()
+        response = self.clientRead()
+        self.assertIn("ack", response)
+        self.assertTrue(response.endswith("\nok 1-1 -1-\n"))
+        self.clientWrite('batch 0 1 1\n')
+        self.serverRead()
+        self.assertIn("fail Invalid parameter", self.clientRead())
+
     def testBases(self):
         self.handshake()
         self.clientWrite('bases\n')
@@ -158,6 +170,77 @@ class HandlerTest(unittest.TestCase):
         self.serverRead()
         self.assertIn("timer 0 0", self.clientRead())
 
+    def testState(self):
+        self.handshake()
+        self.game.tick = 7
+        self.game.num_shots = [MockShot()]
+        self.clientWrite('state\n')
+        self.serverRead()
+        response = self.clientRead()
+        self.assertIn("begin\nstate 0 7\nshot 1 2 3 4\nend\n", response)
+
+    def testBinary(self):
+        self.assertEquals(self.clientRead(), 'bzrobots 1\n')
+        self.clientWrite('agent 2 binary\n')
+        self.serverRead()
+        self.assertTrue(self.handler.binary)
+        self.game.num_shots = [MockShot()]
+        self.clientWrite('shots\n')
+        self.serverRead()
+        response = self.clientRead()
+        length, kind = binary.header.unpack_from(response)
+        self.assertEquals(kind, binary.TEXT)
+        ack = response[binary.header.size:binary.header.size + length]
+        self.assertTrue(ack.startswith('ack ') and ack.endswith(' shots\n'))
+        shots = response[binary.header.size + length:]
+        self.assertEquals(shots, binary.frame(binary.SHOTS,
+                binary.section([binary.shot.pack(1, 2, 3, 4)])))
+
+    def testSubscribe(self):
+        self.handshake()
+        self.game.num_shots = [MockShot()]
+        self.clientWrite('subscribe 2 delta\n')
+        self.serverRead()
+        response = self.clientRead()
+        self.assertTrue(response.endswith("ok\nframe 0 0 full\n"
+                                          "shot 1 2 3 4\nend\n"))
+        self.game.tick = 1
+        self.handler.publish()
+        self.assertEquals(self.clientRead(), '')
+        self.game.tick = 2
+        self.handler.publish()
+        self.assertEquals(self.clientRead(),
+                          "frame 0 2 delta\nshot 1 2 3 4\nend\n")
+        self.clientWrite('subscribe 0\n')
+        self.serverRead()
+        self.assertTrue(self.clientRead().endswith("ok\n"))
+        self.assertEquals(self.handler.subscription, None)
+
+    def testStats(self):
+        self.handshake()
+        self.clientWrite('stats\n')
+        self.serverRead()
+        self.assertIn("fail stats are disabled", self.clientRead())
+
+    def testStatsEnabled(self):
+        self.handler.stats = stats.Stats()
+        self.handshake()
+        self.clientWrite('shoot 1\n')
+        self.serverRead()
+        self.clientRead()
+        self.clientWrite('stats\n')
+        self.serverRead()
+        response = self.clientRead()
+        self.assertIn("begin\nphase bzrc_shoot 1 ", response)
+        self.clientWrite('stats profile update 5\n')
+        self.serverRead()
+        self.assertIn("ok", self.clientRead())
+        self.assertTrue('update' in self.handler.stats.profiling)
+        self.clientWrite('stats profile network\n')
+        self.serverRead()
+        self.assertIn("fail update is being profiled", self.clientRead())
+        self.assertFalse('network' in self.handler.stats.profiling)
+
     def handshake(self):
         self.assertEquals(self.clientRead(), 'bzrobots 1\n')
         self.clientWrite('agent 1\n')
@@ -209,6 +292,25 @@ class ServerTest(unittest.TestCase):
         asyncore.read(self.srv)
         self.assertTrue(self.conn_sock_2.closed)
 
+    def testMaxConnections(self):
+        self.srv.max_connections = 2
+        asyncore.read(self.srv)
+        self.assertEquals(self.srv.in_use, False)
+        asyncore.read(self.srv)
+        self.assertEquals(self.srv.in_use, True)
+        self.assertEquals(len(self.srv.handlers), 2)
+
+        self.srv.handlers[0].close()
+        self.assertEquals(self.srv.in_use, False)
+        self.assertEquals(len(self.srv.handlers), 1)
+
+    def testBackpressure(self):
+        asyncore.read(self.srv)
+        handler = self.srv.handlers[0]
+        self.assertTrue(handler.readable())
+        handler.producer_fifo.append('x' * server.constants.MAX_PENDING_OUTPUT)
+        self.assertFalse(handler.readable())
+
     def testHandshake(self):
         # Trigger an accept.
         asyncore.read(self.srv)
@@ -219,11 +321,145 @@ class ServerTest(unittest.TestCase):
         self.assertEquals(self.conn_sock_1.remote_read(), 'bzrobots 1\n')
 
 
+class OccgridTest(unittest.TestCase):
+    def setUp(self):
+        path = os.path.dirname(__file__)
+        self.world = "--world="+os.path.join(path, "..", "maps",
+                                             "four_ls.bzw")
+
+    def respond(self, command, *args):
+        """Send command for tank 0 and return the lines after the size."""
+        cfg = config.Config(['--test', self.world, '--occgrid-width=60']
+                            + list(args))
+        self.game = game.Game(None, cfg)
+        team = self.game.teams['red']
+        team.tanks[0].pos = [90, 120]
+        team.tanks[0].status = constants.TANKALIVE
+        sock = MockSocket(CONN_SOCK_1_FILENO)
+        handler = server.Handler(sock, team, self.game, None, cfg, {})
+        handler.bzrc_occgrid(command)
+        asyncore.write(handler)
+        lines = sock.remote_read().splitlines()
+        self.assertTrue(lines[1].startswith('ack '))
+        self.assertEquals(lines[2:4], ['begin', 'at 60,90'])
+        self.assertEquals(lines[4], 'size 60x60')
+        self.assertEquals(lines[-1], 'end')
+        return lines[5:-1]
+
+    def occgrid(self, *args):
+        lines = self.respond(['occgrid', '0'], *args)
+        return [[int(c) for c in line] for line in lines]
+
+    def testOccgrid(self):
+        grid = self.occgrid()
+        true_grid = self.game.occgrid[460:520, 490:550].tolist()
+        self.assertEquals(grid, true_grid)
+        self.assertTrue(0 < sum(map(sum, grid)) < 3600)
+
+    def testNoise(self):
+        # With both probabilities at 0 every cell reads the other way.
+        grid = self.occgrid('--default-true-positive=0',
+                            '--default-true-negative=0')
+        true_grid = self.game.occgrid[460:520, 490:550]
+        self.assertEquals(grid, (1 - true_grid).tolist())
+
+    def testEncodings(self):
+        for encoding in binary.ENCODINGS:
+            lines = self.respond(['occgrid', '0', encoding])
+            self.assertEquals(lines[0], 'encoding %s' % encoding)
+            data = base64.b64decode(lines[1])
+            grid = binary.decode_grid(data, encoding, 60, 60)
+            true_grid = self.game.occgrid[460:520, 490:550]
+            self.assertEquals(grid.tolist(), true_grid.tolist())
+        self.assertTrue(len(binary.encode_grid(true_grid, 'zlib')) <
+                        len(binary.encode_grid(true_grid, 'bits')) < 3600)
+
+    def testDelta(self):
+        cfg = config.Config(['--test', self.world, '--occgrid-width=60'])
+        self.game = game.Game(None, cfg)
+        team = self.game.teams['red']
+        tank = team.tanks[0]
+        tank.status = constants.TANKALIVE
+        sock = MockSocket(CONN_SOCK_1_FILENO)
+        handler = server.Handler(sock, team, self.game, None, cfg, {})
+        sock.remote_read()
+        last_pos, last = None, None
+        sizes = []
+        for x, y in ((90, 120), (90, 120), (93, 118), (300, 300)):
+            tank.pos = [x, y]
+            handler.bzrc_occgrid(['occgrid', '0', 'delta'])
+            asyncore.write(handler)
+            lines = sock.remote_read().splitlines()
+            pos = tuple(int(a) for a in lines[2][3:].split(','))
+            self.assertEquals(pos, (x - 30, y - 30))
+            self.assertEquals(lines[4], 'delta rle')
+            changed = binary.decode_grid(base64.b64decode(lines[5]), 'rle',
+                                         60, 60)
+            grid = binary.shift_grid(last_pos, last, pos, (60, 60)) ^ changed
+            true_grid = self.game.occgrid[x + 370:x + 430, y + 370:y + 430]
+            self.assertEquals(grid.tolist(), true_grid.tolist())
+            sizes.append(changed.sum())
+            last_pos, last = pos, grid
+        # Nothing changes while the tank stands still, and only the newly
+        # exposed strips (at most) once it moves a little.
+        self.assertEquals(sizes[1], 0)
+        self.assertTrue(sizes[2] <= 5 * 60)
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.game = MockGame()
+        self.cache = server.ResponseCache(self.game)
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return 'response %s\n' % self.builds
+
+    def testPerTick(self):
+        self.assertEquals(self.cache.lookup('x', self.build), 'response 1\n')
+        self.assertEquals(self.cache.lookup('x', self.build), 'response 1\n')
+        self.game.tick += 1
+        self.assertEquals(self.cache.lookup('x', self.build), 'response 2\n')
+        self.cache.invalidate()
+        self.assertEquals(self.cache.lookup('x', self.build), 'response 3\n')
+
+    def testStatic(self):
+        self.cache.lookup_static('x', self.build)
+        self.game.tick += 1
+        self.cache.invalidate()
+        self.assertEquals(self.cache.lookup_static('x', self.build),
+                          'response 1\n')
+
+    def testNoise(self):
+        team = MockTeam()
+        team.posnoise = 5
+        self.game.obstacles = [MockObstacle()]
+        noisy = self.cache.obstacles(team)
+        self.assertEquals(self.cache.obstacles(team), noisy)
+        self.game.tick += 1
+        self.assertNotEqual(self.cache.obstacles(team), noisy)
+        team.color = 'red'
+        team.posnoise = 0
+        self.assertIn('obstacle 0.0 0.0 1.0 0.0', self.cache.obstacles(team))
+
+
+class MockObstacle(object):
+    shape = ((0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0))
+
+
+class MockShot(object):
+    pos = (1, 2)
+    vel = (3, 4)
+
+
 class MockGame(object):
 
     def __init__(self):
         self.timespent = 0
         self.timelimit = 0
+        self.tick = 0
+        self.epoch = 0
         self.num_shots = []
         self.tanks = []
         self.bases = {}
@@ -318,7 +554,7 @@ class MockHandleClosedHandler(object):
     def __init__(self):
         self.closed = False
 
-    def __call__(self):
+    def __call__(self, handler):
         self.closed = True
 
 # vim: et sw=4 sts=4
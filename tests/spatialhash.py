@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Unit test for BZRFlag module spatialhash.py."""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import unittest
+
+from bzrflag import spatialhash
+
+
+class SpatialHashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = spatialhash.SpatialHash(10)
+
+    def tearDown(self):
+        del self.grid
+
+    def testInsert(self):
+        self.grid.insert('a', (5, 5), 1)
+        self.grid.insert_poly('wall', ((20,0), (40,0), (40,5), (20,5)))
+        self.assertEqual(self.grid.query((5, 5), 1), ['a'])
+        self.assertEqual(self.grid.query((35, 2), 1), ['wall'])
+        self.assertEqual(self.grid.query((-50, -50), 1), [])
+        self.assertEqual(len(self.grid), 2)
+
+    def testStraddle(self):
+        # An object on a cell border lands in every cell it overlaps.
+        self.grid.insert('a', (10, 10), 2)
+        self.assertEqual(self.grid.query((5, 5), 1), ['a'])
+        self.assertEqual(self.grid.query((15, 15), 1), ['a'])
+
+    def testMove(self):
+        self.grid.insert('a', (5, 5), 1)
+        self.grid.move('a', (55, 5), 1)
+        self.assertEqual(self.grid.query((5, 5), 1), [])
+        self.assertEqual(self.grid.query((55, 5), 1), ['a'])
+        self.grid.move('b', (55, 5), 1)
+        self.assertEqual(self.grid.query((55, 5), 1), ['a', 'b'])
+
+    def testRemove(self):
+        self.grid.insert('a', (5, 5), 1)
+        self.grid.remove('a')
+        self.grid.remove('a')
+        self.assertFalse('a' in self.grid)
+        self.assertEqual(self.grid.buckets, {})
+
+    def testQueryLine(self):
+        self.grid.insert('a', (45, 45), 1)
+        self.assertEqual(self.grid.query_line((0, 0), (50, 50)), ['a'])
+        self.assertEqual(self.grid.query_line((0, 0), (20, 0)), [])
+
+# vim: et sw=4 sts=4
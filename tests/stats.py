@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Unit test for BZRFlag module stats.py."""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+
+import os
+import shutil
+import tempfile
+
+import unittest
+from bzrflag import stats
+
+
+class StatsTest(unittest.TestCase):
+
+    def testRollingWindow(self):
+        phase = stats.Phase(window=10)
+        for i in xrange(100):
+            phase.add(i)
+        self.assertEquals(phase.count, 100)
+        self.assertEquals(phase.max, 99)
+        # only the last ten samples are kept
+        self.assertEquals(phase.recent(), range(90, 100))
+        self.assertEquals(phase.percentile(0), 90)
+
+    def testRows(self):
+        s = stats.Stats()
+        s.add('update', 0.002)
+        s.add('update', 0.004)
+        s.add('bzrc_shoot', 0.001)
+        rows = s.rows()
+        self.assertEquals([row[0] for row in rows], ['bzrc_shoot', 'update'])
+        name, count, total, mean, p50, p99, top = rows[1]
+        self.assertEquals(count, 2)
+        self.assertAlmostEqual(total, 6)
+        self.assertAlmostEqual(mean, 3)
+        self.assertAlmostEqual(top, 4)
+        self.assertEquals(len(s.report().splitlines()), 3)
+        s.reset()
+        self.assertEquals(s.rows(), [])
+
+    def testProfile(self):
+        path = tempfile.mkdtemp()
+        try:
+            s = stats.Stats(profile_out=os.path.join(path, 'prof'))
+            s.profile('update', 2)
+            s.call('update', sorted, [3, 1, 2])
+            self.assertTrue('update' in s.profiling)
+            s.call('update', sorted, [3, 1, 2])
+            self.assertFalse('update' in s.profiling)
+            self.assertTrue(os.path.exists(os.path.join(path, 'prof.update')))
+            self.assertEquals(s.phases['update'].count, 2)
+        finally:
+            shutil.rmtree(path)
+
+    def testOneProfileAtATime(self):
+        s = stats.Stats()
+        s.profile('network', 1)
+        self.assertRaises(ValueError, s.profile, 'bzrc_shoot')
+        self.assertFalse('bzrc_shoot' in s.profiling)
+        s.call('network', s.call, 'bzrc_shoot', sorted, [3, 1, 2])
+        self.assertEquals(s.profiling, {})
+        s.profile('bzrc_shoot')
+        self.assertTrue('bzrc_shoot' in s.profiling)
+
+# vim: et sw=4 sts=4
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Unit test for BZRFlag module tournament.py."""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+
+import os
+
+import unittest
+from bzrflag import tournament
+
+
+class TournamentTest(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.dirname(__file__)
+        self.world = os.path.join(path, "..", "maps", "test.bzw")
+
+    def testMatches(self):
+        spec = {'maps': ['a.bzw', 'b.bzw'],
+                'pairings': [{'red': 'x'}, {'red': 'y', 'green': 'z'}],
+                'repeat': 2}
+        matches = tournament.matches(spec)
+        self.assertEquals(len(matches), 8)
+        self.assertEquals(matches[0]['args'], tournament.DEFAULT_ARGS)
+        args = tournament.game_args(matches[3])
+        self.assertTrue('--world=b.bzw' in args)
+        self.assertTrue('--min-agents=2' in args)
+
+    def testRunMatch(self):
+        match = {'world': self.world, 'agents': {},
+                 'args': ['--fast-forward', '--time-limit=1']}
+        result = tournament.run_match(match)
+        self.assertFalse('error' in result)
+        self.assertEquals(sorted(result['scores']),
+                          ['blue', 'green', 'purple', 'red'])
+        self.assertTrue(result['time'] > 1)
+
+    def testAgentExits(self):
+        match = {'world': self.world, 'agents': {'red': 'false'},
+                 'args': ['--fast-forward', '--time-limit=1']}
+        result = tournament.run_match(match)
+        self.assertTrue('agent exited' in result['error'])
+
+# vim: et sw=4 sts=4
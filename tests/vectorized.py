@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Unit test for BZRFlag module vectorized.py."""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+import unittest
+from bzrflag import game, vectorized
+from tests import make_game_loop, drive, state
+
+
+class VectorizedTest(unittest.TestCase):
+
+    def run_game(self, *args):
+        """Drive every tank randomly for a while and return the game."""
+        g = make_game_loop(*args).game
+        drive(g, 7, 150)
+        return g
+
+    def state(self, g):
+        # dead tanks may have been turned by the batched step before being
+        # killed later in the same tick; that is reset on respawn.
+        return state(g, lambda t: (round(t.pos[0], 6), round(t.pos[1], 6),
+                                   t.status == 'alive' and round(t.rot, 6)),
+                     lambda s: (round(s.pos[0], 6), round(s.pos[1], 6)))
+
+    def testMatchesScalar(self):
+        scalar = self.run_game()
+        vector = self.run_game('--vectorized')
+        self.assertTrue(isinstance(vector.teams['red'].tanks[0],
+                                   game.ArrayTank))
+        self.assertEqual(self.state(scalar), self.state(vector))
+
+    def testMovesClear(self):
+        g = self.run_game('--vectorized')
+        self.assertTrue(g.arrays.tank_moved.any())
+        # tanks moved by the step are bucketed where they ended up
+        for tank in g.tanks():
+            if not game.in_deadzone(tank.pos):
+                self.assertEqual(g.tank_grid.cells[tank],
+                        g.tank_grid.circle_cells(tank.pos, tank.radius))
+
+    def testShotRows(self):
+        g = self.run_game('--vectorized')
+        arrays = g.arrays
+        live = len(list(g.shots()))
+        self.assertEqual(arrays.shot_active.sum(), live)
+        self.assertEqual(len(arrays.free_shots) + live,
+                         len(arrays.shot_active))
+
+    def testStepTanks(self):
+        arrays = vectorized.EntityArrays(2, 0)
+        arrays.add_tank()
+        arrays.add_tank()
+        arrays.tank_alive[0] = True
+        arrays.tank_goal_speed[:] = 1
+        arrays.tank_reload[:] = 1
+        arrays.step(0.5)
+        self.assertEqual(list(arrays.tank_speed), [0.25, 0])
+        self.assertEqual(list(arrays.tank_reload), [0.5, 0.5])
+        self.assertAlmostEqual(arrays.tank_vel[0][0], 0.25*25)
+
+# vim: et sw=4 sts=4
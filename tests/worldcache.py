@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# Bzrflag
+# Copyright 2008-2011 Brigham Young University
+#
+# This file is part of Bzrflag.
+#
+# Bzrflag is free software: you can redistribute it and/or modify it under the
+# terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Bzrflag is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# Bzrflag.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Inquiries regarding any further use of Bzrflag, please contact the Copyright
+# Licensing Office, Brigham Young University, 3760 HBLL, Provo, UT 84602,
+# (801) 422-9339 or 422-3821, e-mail copyright@byu.edu.
+
+"""Unit test for BZRFlag module worldcache.py."""
+
+__author__ = "BYU AML Lab <kseppi@byu.edu>"
+__copyright__ = "Copyright 2008-2011 Brigham Young University"
+__license__ = "GNU GPL"
+
+
+import os
+import shutil
+import tempfile
+
+import unittest
+from bzrflag import config, game
+
+
+class WorldCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.dirname(__file__)
+        self.world = "--world="+os.path.join(path, "..", "maps", "test.bzw")
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_game(self, *args):
+        cfg = config.Config(['--test', self.world,
+                             '--world-cache=%s' % self.directory]
+                            + list(args))
+        return game.Game(None, cfg)
+
+    def testRoundTrip(self):
+        first = self.make_game()
+        self.assertEquals(len(os.listdir(self.directory)), 2)
+        second = self.make_game()
+        self.assertFalse(second.occgrid.flags.writeable)
+        self.assertTrue((first.occgrid == second.occgrid).all())
+        self.assertEquals([o.shape for o in first.obstacles],
+                          [o.shape for o in second.obstacles])
+        self.assertEquals(sorted(first.bases), sorted(second.bases))
+
+    def testKey(self):
+        self.make_game()
+        self.make_game('--world-size=400')
+        self.assertEquals(len(os.listdir(self.directory)), 4)
+
+    def testCorrupt(self):
+        self.make_game()
+        for name in os.listdir(self.directory):
+            open(os.path.join(self.directory, name), 'w').write('junk')
+        g = self.make_game()
+        self.assertEquals(len(g.obstacles), len(g.config.world.boxes))
+        self.assertTrue(g.occgrid.any())
+
+# vim: et sw=4 sts=4